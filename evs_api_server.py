@@ -0,0 +1,251 @@
+"""
+EVS/WVS 2017-2022 — Serveur d'API JSON local
+Expose les agrégats par pays calculés par l'application Streamlit.
+
+Lancement :
+    python evs_api_server.py [--data data_evs_mapped.csv.zip] [--port 8502]
+    python evs_api_server.py --aggregates evs_aggregates.json.gz
+    python evs_api_server.py --database evs_survey.sqlite
+    python evs_api_server.py --weight-col Weight
+
+Endpoints (GET) :
+    /variables                              liste des variables de THEMES
+    /countries                              pays disponibles et nombre de répondants
+    /stats?var=…&countries=FR,DE            moyenne, écart-type, IC95, N, médiane par pays
+    /distribution?var=…&countries=FR,DE     volumes (poids cumulés si --weight-col) et
+                                            pourcentages par valeur de réponse
+
+`var` accepte le libellé français ou le nom de colonne du dataset ;
+sans `countries`, tous les pays sont inclus.
+"""
+import argparse
+import hashlib
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from evs_cache import BoundedCache
+from evs_stats_core import (
+    COUNTRY_NAMES, THEMES, WEIGHT_COL,
+    load_dataset, load_aggregates, resolve_variable,
+    RowBackend, CountsBackend, SqlBackend,
+)
+
+
+class ApiError(Exception):
+    """Erreur renvoyée au client avec un code HTTP."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ─── DATASET EN LECTURE SEULE ────────────────────────────────────────────────
+class StatsService:
+    """Calcule les réponses JSON à partir d'un backend chargé une seule fois.
+
+    Chaque requête interroge le backend (RowBackend, CountsBackend ou
+    SqlBackend) sans jamais copier ni modifier les données chargées : les
+    requêtes concurrentes ne font que des lectures. Les tables par variable
+    que le backend mémorise au premier accès sont recalculées à l'identique
+    si deux threads se croisent ; seul le cache de réponses (LRU,
+    evs_cache.BoundedCache) est protégé par un verrou.
+    """
+
+    def __init__(self, backend, cache_size=512):
+        self.backend = backend
+        self.countries = backend.countries()
+        self.country_sizes = backend.n_respondents(self.countries)
+        self.cache = BoundedCache('api', max_entries=cache_size, label="Réponses API")
+
+    def _parse_countries(self, params):
+        raw = params.get('countries', [''])[0]
+        if not raw:
+            return self.countries
+        codes = sorted({c.strip().upper() for c in raw.split(',') if c.strip()})
+        unknown = [c for c in codes if c not in self.country_sizes]
+        if unknown:
+            raise ApiError(400, f"Pays inconnus : {', '.join(unknown)}")
+        return codes
+
+    def _parse_variable(self, params):
+        name = params.get('var', [''])[0]
+        if not name:
+            raise ApiError(400, "Paramètre `var` manquant")
+        resolved = resolve_variable(name)
+        if resolved is None:
+            raise ApiError(400, f"Variable inconnue : {name}")
+        if not self.backend.has_variable(resolved[1]):
+            raise ApiError(404, f"Variable `{resolved[1]}` non disponible dans le dataset")
+        return resolved
+
+    def variables(self, params):
+        return {
+            'themes': {
+                theme: [{'label': label, 'column': col, 'scale': scale,
+                         'available': self.backend.has_variable(col)}
+                        for label, (col, scale) in theme_vars.items()]
+                for theme, theme_vars in THEMES.items()
+            }
+        }
+
+    def countries_list(self, params):
+        return {
+            'countries': [{'code': c, 'name': COUNTRY_NAMES.get(c, c),
+                           'respondents': self.country_sizes[c]}
+                          for c in self.countries]
+        }
+
+    def stats(self, params):
+        label, col_name, scale = self._parse_variable(params)
+        codes = self._parse_countries(params)
+        stats = self.backend.stats(col_name, codes)
+        stats['N'] = stats['N'].astype(int)
+        return {
+            'variable': col_name, 'label': label, 'scale': scale,
+            'countries': codes,
+            'stats': _records(stats),
+        }
+
+    def distribution(self, params):
+        label, col_name, scale = self._parse_variable(params)
+        codes = self._parse_countries(params)
+        pivot, pivot_pct = self.backend.distribution(col_name, codes)
+        values = [int(v) if float(v).is_integer() else float(v) for v in pivot.columns]
+        # Mode pondéré : volumes = poids cumulés (réels), jamais tronqués
+        volume = float if self.backend.weight_col else int
+        return {
+            'variable': col_name, 'label': label, 'scale': scale,
+            'countries': codes,
+            'values': values,
+            'distribution': [
+                {'Pays': pays,
+                 'counts': [volume(c) for c in pivot.loc[pays].values],
+                 'pct': [round(float(p), 3) for p in pivot_pct.loc[pays].values]}
+                for pays in pivot.index
+            ],
+        }
+
+    def cache_key(self, route, params):
+        """Clé canonique : variable résolue, pays triés, paramètres inconnus ignorés."""
+        if route in ('/stats', '/distribution'):
+            resolved = self._parse_variable(params)
+            return route, resolved[1], tuple(self._parse_countries(params))
+        return (route,)
+
+    def respond(self, route, params):
+        """Renvoie (corps, ETag) pour une route, depuis le cache si possible."""
+        handler = ROUTES.get(route)
+        if handler is None:
+            raise ApiError(404, f"Route inconnue : {route}")
+        key = self.cache_key(route, params)
+        entry = self.cache.get(key)
+        if entry is None:
+            payload = handler(self, params)
+            body = json.dumps(payload, ensure_ascii=False, default=_scalar).encode('utf-8')
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            entry = (body, etag)
+            self.cache.put(key, entry)
+        return entry
+
+
+ROUTES = {
+    '/variables': StatsService.variables,
+    '/countries': StatsService.countries_list,
+    '/stats': StatsService.stats,
+    '/distribution': StatsService.distribution,
+}
+
+
+def _scalar(value):
+    """Convertit les scalaires numpy en types JSON (NaN → null)."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _records(frame):
+    return [{k: _scalar(v) for k, v in row.items()} for row in frame.to_dict(orient='records')]
+
+
+# ─── SERVEUR HTTP ────────────────────────────────────────────────────────────
+class ApiHandler(BaseHTTPRequestHandler):
+    service = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        route = url.path.rstrip('/') or '/'
+        params = parse_qs(url.query)
+        try:
+            body, etag = self.service.respond(route, params)
+        except ApiError as e:
+            self._send(e.status, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'))
+            return
+        if etag in self.headers.get('If-None-Match', ''):
+            self._send(304, b'', etag)
+            return
+        self._send(200, body, etag)
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'public, max-age=300')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Pas de log par requête : coûteux à plusieurs centaines de req/s
+        pass
+
+
+def make_server(backend, host='127.0.0.1', port=8502, cache_size=512):
+    """Construit le serveur (non démarré) autour d'un backend déjà chargé."""
+    handler = type('BoundApiHandler', (ApiHandler,), {'service': StatsService(backend, cache_size)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API JSON locale des agrégats EVS/WVS")
+    parser.add_argument('--data', help="CSV ou ZIP local (défaut : release GitHub)")
+    parser.add_argument('--aggregates', help="Artefact evs_build_aggregates.py (aucune ligne répondant chargée)")
+    parser.add_argument('--database', help="Base SQL evs_build_database.py (SQLite, ou DuckDB si .duckdb)")
+    parser.add_argument('--weight-col', help=f"Colonne de poids : statistiques pondérées (ex. {WEIGHT_COL})")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--cache-size', type=int, default=512, help="Nombre de réponses gardées en cache")
+    args = parser.parse_args()
+
+    print("📥 Chargement des données…")
+    if args.aggregates:
+        backend = CountsBackend(load_aggregates(args.aggregates))
+    elif args.database:
+        backend = SqlBackend(args.database)
+    else:
+        df_full = load_dataset(args.data)
+        if args.weight_col and args.weight_col not in df_full.columns:
+            raise SystemExit(f"Colonne de poids absente du dataset : {args.weight_col}")
+        backend = RowBackend(df_full, args.weight_col)
+    server = make_server(backend, args.host, args.port, args.cache_size)
+    print(f"✅ {backend.n_rows:,} lignes · API sur http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
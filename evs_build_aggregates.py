@@ -0,0 +1,39 @@
+"""
+EVS/WVS 2017-2022 — Construction de l'artefact d'agrégats
+Précalcule les volumes par pays × variable × valeur pour toutes les
+variables de THEMES (quelques centaines de Ko au lieu de ~157 000 lignes).
+
+Usage :
+    python evs_build_aggregates.py [--data data_evs_mapped.csv.zip] [--out evs_aggregates.json.gz]
+    python evs_build_aggregates.py --data wvs_evs_trend.csv --max-memory-mb 128
+
+Le CSV est lu par blocs de lignes (colonnes utiles seulement) : le pic
+mémoire est borné par --max-memory-mb quelle que soit la taille du fichier.
+
+L'application l'utilise ensuite sans charger les répondants :
+    EVS_AGGREGATES=evs_aggregates.json.gz streamlit run evs_stats_app.py
+"""
+import argparse
+import os
+
+from evs_stats_core import stream_aggregates, save_aggregates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Précalcule l'artefact d'agrégats EVS/WVS")
+    parser.add_argument('--data', help="CSV ou ZIP local (défaut : release GitHub)")
+    parser.add_argument('--out', default='evs_aggregates.json.gz')
+    parser.add_argument('--max-memory-mb', type=float, default=256, help="Mémoire visée pour un bloc de lignes")
+    parser.add_argument('--chunk-rows', type=int, help="Lignes par bloc (prioritaire sur --max-memory-mb)")
+    args = parser.parse_args()
+
+    print("📥 Lecture des données par blocs…")
+    aggregates = stream_aggregates(args.data, max_memory_mb=args.max_memory_mb, chunk_rows=args.chunk_rows)
+    save_aggregates(aggregates, args.out)
+    size_kb = os.path.getsize(args.out) / 1024
+    print(f"✅ {aggregates['source_rows']:,} lignes · {len(aggregates['counts'])} variables "
+          f"· {len(aggregates['countries'])} pays · {args.out} ({size_kb:,.0f} Ko)")
+
+
+if __name__ == '__main__':
+    main()
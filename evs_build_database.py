@@ -0,0 +1,35 @@
+"""
+EVS/WVS 2017-2022 — Construction de la base SQL embarquée
+Écrit les répondants (pays, année, variables de THEMES) dans une table
+indexée par pays : SQLite par défaut, DuckDB si le fichier finit par .duckdb
+(pip install duckdb).
+
+Usage :
+    python evs_build_database.py [--data data_evs_mapped.csv.zip] [--out evs_survey.sqlite]
+    python evs_build_database.py --data wvs_evs_trend.csv --out evs_survey.duckdb
+
+Le CSV est lu par blocs de lignes : aucune copie complète en mémoire.
+L'application interroge ensuite la base au lieu de charger les lignes :
+    EVS_DATABASE=evs_survey.sqlite streamlit run evs_stats_app.py
+"""
+import argparse
+import os
+
+from evs_stats_core import stream_database, sql_engine_for
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit la base SQL embarquée EVS/WVS")
+    parser.add_argument('--data', help="CSV ou ZIP local (défaut : release GitHub)")
+    parser.add_argument('--out', default='evs_survey.sqlite', help="Fichier de base (.sqlite ou .duckdb)")
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help="Lignes par bloc")
+    args = parser.parse_args()
+
+    print(f"📥 Lecture des données par blocs → {sql_engine_for(args.out)}…")
+    rows = stream_database(args.out, args.data, chunk_rows=args.chunk_rows)
+    size_mb = os.path.getsize(args.out) / 1024 ** 2
+    print(f"✅ {rows:,} lignes · {args.out} ({size_mb:,.1f} Mo)")
+
+
+if __name__ == '__main__':
+    main()
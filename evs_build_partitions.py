@@ -0,0 +1,34 @@
+"""
+EVS/WVS — Construction du dataset partitionné par vague × pays
+Écrit une partition (CSV gzip) par pays pour une vague et met à jour le
+manifeste ; relancer pour chaque vague (EVS 2008, WVS 2010-2014, …).
+
+Usage :
+    python evs_build_partitions.py --wave 2017-2022 [--data data_evs_mapped.csv.zip] [--out evs_partitions]
+    python evs_build_partitions.py --wave 2008-2010 --data evs_2008_mapped.csv
+
+L'application lit ensuite uniquement les partitions des vagues et pays choisis :
+    EVS_PARTITIONS=evs_partitions streamlit run evs_stats_app.py
+"""
+import argparse
+
+from evs_stats_core import load_dataset, write_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitionne un dataset EVS/WVS par vague et par pays")
+    parser.add_argument('--wave', default='2017-2022', help="Libellé de la vague (ex. 2017-2022)")
+    parser.add_argument('--data', help="CSV ou ZIP local (défaut : release GitHub)")
+    parser.add_argument('--out', default='evs_partitions')
+    args = parser.parse_args()
+
+    print("📥 Chargement des données…")
+    df_full = load_dataset(args.data)
+    manifest = write_partitions(df_full, args.out, args.wave)
+    wave = manifest['waves'][args.wave]
+    print(f"✅ Vague {args.wave} : {len(df_full):,} lignes · {len(wave['countries'])} partitions pays")
+    print(f"   Vagues disponibles dans {args.out} : {', '.join(manifest['waves'])}")
+
+
+if __name__ == '__main__':
+    main()
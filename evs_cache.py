@@ -0,0 +1,516 @@
+"""
+EVS/WVS 2017-2022 — Politique de cache centrale
+Caches partagés par toutes les sessions du processus : nombre d'entrées,
+taille en octets et durée de vie bornés, éviction LRU, statistiques
+(entrées, octets, taux de succès) pour le panneau d'administration.
+
+Les valeurs renvoyées sont partagées entre sessions : les traiter en
+lecture seule (toute transformation doit produire une copie).
+
+Optionnellement (EVS_DISK_CACHE=<dossier>), les agrégats et graphiques sont
+aussi écrits dans un cache disque partagé par tous les processus de
+l'application (plusieurs workers derrière un répartiteur de charge) et
+conservé entre deux redémarrages.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+MB = 1024 ** 2
+
+# Limites par famille de cache ; surchargeables par variables d'environnement :
+#   EVS_CACHE_<NOM>_MAX_ENTRIES, EVS_CACHE_<NOM>_MAX_MB, EVS_CACHE_<NOM>_TTL (secondes, 0 = sans TTL)
+# 'disk' : famille également persistée dans le cache disque partagé (s'il est activé)
+CACHE_POLICY = {
+    'dataset':    {'label': "Données",   'max_entries': 8,    'max_mb': None, 'ttl': None,      'disk': False},
+    'partitions': {'label': "Partitions", 'max_entries': 1024, 'max_mb': 512,  'ttl': None,      'disk': False},
+    'aggregates': {'label': "Agrégats",  'max_entries': 2048, 'max_mb': 64,   'ttl': 6 * 3600, 'disk': True},
+    'figures':    {'label': "Graphiques", 'max_entries': 256,  'max_mb': 128,  'ttl': 3600,      'disk': True},
+    'exports':    {'label': "Exports",   'max_entries': 128,  'max_mb': 64,   'ttl': 3600,      'disk': False},
+}
+
+# Cache disque partagé entre processus : dossier (vide = désactivé) et taille maximale
+DISK_CACHE_DIR = os.environ.get("EVS_DISK_CACHE", "")
+DISK_CACHE_MAX_MB = float(os.environ.get("EVS_DISK_CACHE_MAX_MB", "1024"))
+
+
+def cache_policy(name):
+    """Politique effective d'un cache (valeurs par défaut + surcharges d'environnement)."""
+    policy = dict(CACHE_POLICY[name])
+    prefix = f"EVS_CACHE_{name.upper()}_"
+    for key, cast in (('max_entries', int), ('max_mb', float), ('ttl', float)):
+        raw = os.environ.get(prefix + key.upper())
+        if raw:
+            policy[key] = cast(raw) or None
+    return policy
+
+
+# ─── TAILLE DES ENTRÉES ──────────────────────────────────────────────────────
+def estimate_bytes(obj):
+    """Empreinte mémoire approximative d'une valeur mise en cache."""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'memory_bytes'):
+        return int(obj.memory_bytes())
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(index=True, deep=False)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(estimate_bytes(v) for v in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_bytes(k) + estimate_bytes(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+# ─── CACHE LRU BORNÉ ─────────────────────────────────────────────────────────
+class BoundedCache:
+    """Cache LRU thread-safe borné en entrées, en octets et en durée de vie."""
+
+    def __init__(self, name, max_entries=None, max_mb=None, ttl=None, label=None, disk=False):
+        self.name = name
+        self.label = label or name
+        self.disk = disk
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * MB if max_mb else None
+        self.ttl = ttl
+        self._entries = OrderedDict()   # clé → (valeur, octets, date d'insertion)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, inserted):
+        return self.ttl is not None and time.monotonic() - inserted > self.ttl
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[2]):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = estimate_bytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, nbytes, time.monotonic())
+            self._bytes += nbytes
+            # Éviction LRU (on garde toujours l'entrée qui vient d'être ajoutée)
+            while len(self._entries) > 1 and (
+                (self.max_entries and len(self._entries) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            expired = [k for k, (_, _, t) in self._entries.items() if self._expired(t)]
+            for key in expired:
+                self._drop(key)
+            calls = self.hits + self.misses
+            return {
+                'name': self.name, 'label': self.label,
+                'entries': len(self._entries), 'max_entries': self.max_entries,
+                'bytes': self._bytes, 'max_bytes': self.max_bytes, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / calls if calls else None,
+            }
+
+
+# ─── CACHE DISQUE PARTAGÉ ────────────────────────────────────────────────────
+@contextmanager
+def _file_lock(path):
+    """Verrou exclusif inter-processus (fichier `path`)."""
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DiskCache:
+    """Cache de résultats sur disque, partagé par tous les processus qui l'ouvrent.
+
+    Une entrée par fichier pickle, nommé par l'empreinte SHA-256 de sa clé.
+    Les écritures passent par un fichier temporaire renommé (jamais d'entrée
+    à moitié écrite) ; écritures et éviction sont sérialisées par un verrou
+    de fichier. Éviction LRU à la date de modification, rafraîchie à chaque
+    lecture, dès que la taille totale dépasse `max_mb`.
+
+    Les fichiers sont relus avec pickle : le dossier ne doit être accessible
+    qu'aux processus de l'application.
+    """
+
+    SUFFIX = '.pkl'
+
+    def __init__(self, root, max_mb=1024):
+        self.root = root
+        self.max_bytes = max_mb * MB
+        os.makedirs(root, exist_ok=True)
+        self._lock_path = os.path.join(root, '.lock')
+        self._lock = threading.Lock()
+        self._written = 0   # octets écrits depuis la dernière éviction
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + self.SUFFIX)
+
+    def get(self, digest, default=None):
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except Exception:
+            # Entrée illisible (écrite par une autre version de pandas…) : supprimée
+            self.errors += 1
+            self.misses += 1
+            self._remove(path)
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, digest, value):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            self.errors += 1
+            return
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(digest)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            with self._lock, _file_lock(self._lock_path):
+                os.replace(tmp, path)
+                self._written += len(data)
+                # Balayage du dossier seulement tous les ~5 % de la taille maximale écrits
+                if self._written > self.max_bytes / 20:
+                    self._evict()
+        except OSError:
+            self.errors += 1
+            if tmp:
+                self._remove(tmp)
+
+    def _files(self):
+        """[(date de modification, octets, chemin)] des entrées et fichiers temporaires."""
+        files = []
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((info.st_mtime, info.st_size, entry.path))
+        return files
+
+    def _evict(self):
+        """Supprime les entrées les moins récemment utilisées (verrou tenu)."""
+        self._written = 0
+        files = self._files()
+        now = time.time()
+        total = 0
+        for mtime, size, path in files:
+            # Temporaires orphelins (processus interrompu pendant une écriture)
+            if path.endswith('.tmp') and now - mtime > 600:
+                self._remove(path)
+            else:
+                total += size
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            if path.endswith(self.SUFFIX):
+                self._remove(path)
+                total -= size
+                self.evictions += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock, _file_lock(self._lock_path):
+            for _, _, path in self._files():
+                self._remove(path)
+
+    def stats(self):
+        files = [(size, path) for _, size, path in self._files() if path.endswith(self.SUFFIX)]
+        calls = self.hits + self.misses
+        return {
+            'name': 'disk', 'label': "Disque partagé",
+            'entries': len(files), 'max_entries': None,
+            'bytes': sum(size for size, _ in files), 'max_bytes': self.max_bytes, 'ttl': None,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'hit_rate': self.hits / calls if calls else None,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version(source_file):
+    """Empreinte du code : fichier de la fonction et modules evs_* chargés.
+
+    Fait partie des clés disque : un graphique rendu par une version
+    antérieure du code n'est jamais relu après une mise à jour.
+    """
+    files = {source_file, *(getattr(m, '__file__', None) for n, m in list(sys.modules.items())
+                            if n.startswith('evs_'))}
+    digest = hashlib.sha256()
+    for path in sorted(f for f in files if f and os.path.exists(f)):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def disk_key(func, key):
+    """Empreinte disque d'une clé de cache, None si elle n'est pas stable entre processus.
+
+    La clé contient déjà la version de chaque backend (empreinte du dataset).
+    """
+    text = repr(key)
+    if ' at 0x' in text:
+        # Objet sans représentation stable (adresse mémoire) : pas de partage possible
+        return None
+    source = getattr(func.__code__, 'co_filename', '')
+    return hashlib.sha256(f"{_code_version(source)}\n{text}".encode('utf-8')).hexdigest()
+
+
+_DISK_CACHE = None
+
+
+def disk_cache():
+    """Cache disque partagé (EVS_DISK_CACHE), None s'il n'est pas activé."""
+    global _DISK_CACHE
+    if DISK_CACHE_DIR and _DISK_CACHE is None:
+        with _REGISTRY_LOCK:
+            if _DISK_CACHE is None:
+                _DISK_CACHE = DiskCache(DISK_CACHE_DIR, DISK_CACHE_MAX_MB)
+    return _DISK_CACHE
+
+
+# ─── REGISTRE ────────────────────────────────────────────────────────────────
+_CACHES = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_cache(name):
+    """Cache partagé `name` (créé à la première utilisation selon CACHE_POLICY)."""
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _REGISTRY_LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                cache = BoundedCache(name, **cache_policy(name))
+                _CACHES[name] = cache
+    return cache
+
+
+def cache_stats():
+    """Statistiques de tous les caches déclarés dans CACHE_POLICY (+ cache disque)."""
+    stats = [get_cache(name).stats() for name in CACHE_POLICY]
+    if disk_cache():
+        stats.append(disk_cache().stats())
+    return stats
+
+
+def clear_caches():
+    """Vide les caches du processus (le cache disque partagé est conservé)."""
+    for name in CACHE_POLICY:
+        get_cache(name).clear()
+
+
+def _freeze(value):
+    """Rend hashables les arguments d'appel (listes, dicts, backends…)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    if hasattr(value, 'version'):
+        return (type(value).__name__, value.version)
+    return value
+
+
+def cached(name):
+    """Décorateur : mémorise le résultat dans le cache partagé `name`.
+
+    La clé est formée du nom qualifié de la fonction et de ses arguments ;
+    un backend est identifié par son attribut `version`. Un échec du cache
+    mémoire consulte le cache disque partagé, si la famille y est persistée.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, _freeze(args), _freeze(kwargs))
+            cache = get_cache(name)
+            compute = lambda: func(*args, **kwargs)
+            if cache.disk and disk_cache():
+                compute = functools.partial(_disk_or_compute, func, key, compute)
+            return cache.get_or_compute(key, compute)
+        return wrapper
+    return decorator
+
+
+_MISSING = object()
+
+
+def _disk_or_compute(func, key, compute):
+    digest = disk_key(func, key)
+    if digest is None:
+        return compute()
+    value = disk_cache().get(digest, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        disk_cache().put(digest, value)
+    return value
+
+
+# ─── PRÉCHAUFFAGE EN ARRIÈRE-PLAN ────────────────────────────────────────────
+class Warmup:
+    """Exécute des tâches de préchauffage dans un pool de threads.
+
+    Les tâches remplissent les caches partagés (agrégats, graphiques) ; une
+    erreur n'interrompt pas le préchauffage : elle est gardée dans `failures`
+    (indice de la tâche, exception).
+    """
+
+    def __init__(self, tasks, workers=4):
+        self.total = len(tasks)
+        self.done = 0
+        self.failures = []
+        self.started = time.monotonic()
+        self.finished_at = self.started if not tasks else None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='evs-warmup')
+        for index, task in enumerate(tasks):
+            self._executor.submit(self._run, index, task)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, index, task):
+        try:
+            task()
+        except Exception as e:
+            with self._lock:
+                self.failures.append((index, e))
+        with self._lock:
+            self.done += 1
+            if self.done == self.total:
+                self.finished_at = time.monotonic()
+
+    @property
+    def errors(self):
+        return len(self.failures)
+
+    @property
+    def finished(self):
+        return self.done >= self.total
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started
+
+
+_WARMUPS = {}
+# Préchauffages terminés gardés (les plus anciens sont oubliés au-delà)
+MAX_WARMUPS = 32
+
+
+def start_warmup(key, tasks, workers=4):
+    """Lance le préchauffage `key` une seule fois par processus et le renvoie.
+
+    `tasks` est un itérable de fonctions sans argument, ou une fabrique sans
+    argument qui le renvoie ; il n'est consommé (et la fabrique appelée)
+    qu'au premier appel : les reruns suivants retrouvent le préchauffage en
+    cours sans reconstruire ses tâches.
+    """
+    with _REGISTRY_LOCK:
+        warmup = _WARMUPS.get(key)
+        if warmup is None:
+            warmup = Warmup(list(tasks() if callable(tasks) else tasks), workers)
+            _WARMUPS[key] = warmup
+            finished = [k for k, w in _WARMUPS.items() if w.finished and k != key]
+            for old in finished[:max(0, len(_WARMUPS) - MAX_WARMUPS)]:
+                del _WARMUPS[old]
+    return warmup
+
+
+def forget_warmup(key):
+    """Oublie le préchauffage `key` s'il est terminé : le prochain start_warmup le relance."""
+    with _REGISTRY_LOCK:
+        warmup = _WARMUPS.get(key)
+        if warmup is not None and warmup.finished:
+            del _WARMUPS[key]
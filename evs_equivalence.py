@@ -0,0 +1,514 @@
+"""
+EVS/WVS 2017-2022 — Banc d'équivalence des moteurs d'agrégation
+Compare chaque moteur candidat (backends lignes, artefact d'agrégats,
+artefact en flux, partitions, bases SQL…) à la logique de référence : les calculs
+pandas d'origine des onglets (compute_stats, tableau croisé de l'onglet 1,
+moyennes + z-score de l'onglet 2, pays analysé / autres de l'onglet 4,
+value_counts des exports de l'onglet 5).
+
+Les jeux pondérés (colonne WEIGHT_COL) comparent les moteurs qui savent
+pondérer à une référence directe : np.average, médiane pondérée par tri des
+lignes, N effectif de Kish.
+
+Le banc échoue (code 1) si un résultat s'écarte de la référence au-delà des
+tolérances, ou si une étape d'un moteur dépasse son budget de temps.
+
+Usage :
+    python evs_equivalence.py
+    python evs_equivalence.py --data data_evs_mapped.csv.zip --sample 50000
+    python evs_equivalence.py --engines rows,counts --budget stats=0.5
+    python evs_equivalence.py --budget partitions.stats=30
+
+Sans --data, seuls des jeux synthétiques sont testés (aucun téléchargement).
+"""
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from evs_stats_core import (
+    COUNTRY_COL, COUNTRY_NAMES, THEMES, WEIGHT_COL,
+    flat_variables, open_csv, sanitize_missing_codes, country_frame,
+    compute_stats, distribution_pivot, country_means,
+    build_aggregates, stream_aggregates, write_partitions, write_database, synthetic_dataset,
+    RowBackend, CountsBackend, PartitionBackend, SqlBackend,
+)
+
+# Tolérances par défaut : les moteurs ne diffèrent que par l'ordre des sommes
+RTOL = 1e-9
+ATOL = 1e-9
+
+# Budgets par étape (secondes, cumul de toutes les requêtes de l'étape)
+# pour un jeu de BUDGET_ROWS lignes ; proportionnels au-delà.
+BUDGET_ROWS = 157_000
+STAGE_BUDGETS = {
+    'build': 30.0,
+    'stats': 5.0,
+    'distribution': 2.0,
+    'heatmap': 2.0,
+    'profile': 2.0,
+    'value_counts': 2.0,
+}
+
+
+# ─── JEUX DE TEST ────────────────────────────────────────────────────────────
+class Case:
+    """Jeu de test : lignes brutes (codes de non-réponse compris) et requêtes à comparer.
+
+    Avec `weight_col`, les moteurs calculent des statistiques pondérées.
+    """
+
+    def __init__(self, name, raw, seed=0, weight_col=None):
+        self.name = name
+        self.raw = raw
+        self.df = sanitize_missing_codes(raw.copy())
+        self.n_rows = len(raw)
+        self.weight_col = weight_col
+        if weight_col:
+            # Poids manquants ou négatifs comptés 0, comme dans RowBackend
+            weights = self.df[weight_col].to_numpy(dtype=float)
+            self.weights = pd.Series(np.where(weights > 0, weights, 0.0), index=self.df.index)
+        self.workdir = tempfile.mkdtemp(prefix='evs_equivalence_')
+        self._csv_path = None
+        self._frames = {}
+
+        codes = sorted(self.df[COUNTRY_COL].dropna().unique())
+        rng = random.Random(seed)
+        # Tous les pays, puis des sélections de 8, 2 et 1 pays
+        self.selections = [tuple(codes)] + [
+            tuple(sorted(rng.sample(codes, k))) for k in (8, 2, 1) if k < len(codes)
+        ]
+        self.columns = list(dict.fromkeys(
+            col for col, _ in flat_variables().values() if col in self.df.columns))
+        self.themes = {
+            theme: {label: col for label, (col, _) in theme_vars.items() if col in self.df.columns}
+            for theme, theme_vars in THEMES.items()
+        }
+        # Onglet 5 : pays de la sélection intermédiaire
+        self.detail_codes = self.selections[1] if len(self.selections) > 1 else self.selections[0]
+
+    @property
+    def csv_path(self):
+        """Lignes brutes écrites en CSV (moteurs qui relisent le fichier)."""
+        if self._csv_path is None:
+            self._csv_path = os.path.join(self.workdir, 'data_evs_mapped.csv')
+            self.raw.to_csv(self._csv_path, index=False)
+        return self._csv_path
+
+    def frame(self, codes):
+        """country_frame d'une sélection, construit une fois."""
+        frame = self._frames.get(codes)
+        if frame is None:
+            frame = country_frame(self.df, codes)
+            self._frames[codes] = frame
+        return frame
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def edge_case_dataset(seed=0):
+    """Petit jeu synthétique avec cas limites : pays à un répondant, variable vide pour un pays."""
+    raw = synthetic_dataset(3_000, seed=seed + 1)
+    codes = sorted(raw[COUNTRY_COL].unique())
+    lone = raw.index[raw[COUNTRY_COL] == codes[0]]
+    raw = raw.drop(lone[1:])
+    blank_col = next(col for col, _ in flat_variables().values())
+    raw.loc[raw[COUNTRY_COL] == codes[1], blank_col] = np.nan
+    return raw.reset_index(drop=True)
+
+
+def weighted_edge_case_dataset(seed=0):
+    """Cas limites pondérés : poids manquants, nuls ou négatifs dans un pays."""
+    raw = edge_case_dataset(seed)
+    codes = sorted(raw[COUNTRY_COL].unique())
+    rows = raw.index[raw[COUNTRY_COL] == codes[2]]
+    raw.loc[rows[::3], WEIGHT_COL] = np.nan
+    raw.loc[rows[1::3], WEIGHT_COL] = -1.0
+    raw.loc[rows[2::6], WEIGHT_COL] = 0.0
+    return raw
+
+
+def sample_dataset(path, n_rows, seed=0):
+    """Échantillon de lignes brutes du dataset EVS (CSV, ZIP ou release GitHub)."""
+    with open_csv(path) as source:
+        raw = pd.read_csv(source)
+    if n_rows and n_rows < len(raw):
+        raw = raw.sample(n_rows, random_state=seed).reset_index(drop=True)
+    return raw
+
+
+# ─── MOTEURS CANDIDATS ───────────────────────────────────────────────────────
+# nom → fabrique(case) ; la construction est chronométrée (étape 'build')
+ENGINES = {
+    'rows': lambda case: RowBackend(case.df, case.weight_col),
+    'counts': lambda case: CountsBackend(build_aggregates(case.df)),
+    'counts-stream': lambda case: CountsBackend(
+        stream_aggregates(case.csv_path, chunk_rows=max(1_000, case.n_rows // 7))),
+    'partitions': lambda case: _partition_backend(case),
+    'sqlite': lambda case: _sql_backend(case, 'survey.sqlite'),
+}
+if importlib.util.find_spec('duckdb') is not None:
+    ENGINES['duckdb'] = lambda case: _sql_backend(case, 'survey.duckdb')
+# Moteurs qui savent pondérer : seuls comparés sur les jeux pondérés
+WEIGHTED_ENGINES = ('rows', 'partitions')
+
+
+def _partition_backend(case):
+    root = os.path.join(case.workdir, 'partitions')
+    write_partitions(case.df, root, 'test')
+    return PartitionBackend(root, 'test', weight_col=case.weight_col)
+
+
+def _sql_backend(case, filename):
+    path = os.path.join(case.workdir, filename)
+    write_database(case.df, path)
+    return SqlBackend(path)
+
+
+# ─── RÉFÉRENCE ET ÉTAPES ─────────────────────────────────────────────────────
+# Chaque étape : (référence(case), candidat(case, backend)) → {requête: résultat}
+def _zscore(means):
+    return (means - means.mean()) / means.std()
+
+
+def _ref_stats(case):
+    return {(col, sel): compute_stats(case.frame(sel)[['Pays', col]].dropna(), col)
+            for col in case.columns for sel in case.selections}
+
+
+def _run_stats(case, backend):
+    return {(col, sel): backend.stats(col, list(sel))
+            for col in case.columns for sel in case.selections}
+
+
+def _ref_distribution(case):
+    return {(col, sel): distribution_pivot(case.frame(sel)[['Pays', col]].dropna(), col)
+            for col in case.columns for sel in case.selections}
+
+
+def _run_distribution(case, backend):
+    return {(col, sel): backend.distribution(col, list(sel))
+            for col in case.columns for sel in case.selections}
+
+
+def _ref_heatmap(case):
+    results = {}
+    for theme, columns in case.themes.items():
+        for sel in case.selections:
+            means = country_means(case.frame(sel), columns).dropna(how='all')
+            results[theme, sel] = (means, _zscore(means))
+    return results
+
+
+def _run_heatmap(case, backend):
+    results = {}
+    for theme, columns in case.themes.items():
+        for sel in case.selections:
+            means = backend.means(columns, list(sel)).dropna(how='all')
+            results[theme, sel] = (means, _zscore(means))
+    return results
+
+
+def _ref_profile(case):
+    results = {}
+    for sel in case.selections:
+        if len(sel) < 2:
+            continue
+        df_focus = case.df[case.df[COUNTRY_COL] == sel[0]]
+        df_others = case.df[case.df[COUNTRY_COL].isin(sel[1:])]
+        for col in case.columns:
+            results[col, sel] = (df_focus[col].mean(), df_others[col].mean())
+    return results
+
+
+def _run_profile(case, backend):
+    return {(col, sel): (backend.pooled_mean(col, [sel[0]]), backend.pooled_mean(col, list(sel[1:])))
+            for sel in case.selections if len(sel) >= 2 for col in case.columns}
+
+
+def _ref_value_counts(case):
+    results = {}
+    for code in case.detail_codes:
+        rows = case.df[case.df[COUNTRY_COL] == code]
+        for col in case.columns:
+            results[col, code] = rows[col].dropna().value_counts().sort_index()
+    return results
+
+
+def _run_value_counts(case, backend):
+    return {(col, code): backend.value_counts(col, code)
+            for code in case.detail_codes for col in case.columns}
+
+
+# Références pondérées : calcul direct par pays, indépendant de weighted_counts
+def _weighted_median(values, weights):
+    """Première valeur où le poids cumulé des lignes triées atteint la moitié
+    (moyennée avec la suivante si la moitié tombe exactement entre deux)."""
+    order = np.argsort(values, kind='stable')
+    values, cum = values[order], np.cumsum(weights[order])
+    half, tol = cum[-1] / 2, cum[-1] * 1e-12
+    return (values[np.argmax(cum >= half - tol)] + values[np.argmax(cum > half + tol)]) / 2
+
+
+def _weighted_country_stats(values, weights):
+    n, total = len(values), weights.sum()
+    mean = np.average(values, weights=weights)
+    n_eff = total ** 2 / (weights ** 2).sum()
+    std = np.sqrt(np.average((values - mean) ** 2, weights=weights) * n_eff / (n_eff - 1)) if n > 1 else np.nan
+    return {'Moyenne': mean, 'Écart-type': std, 'IC95': 1.96 * std / np.sqrt(n_eff) if n > 1 else 0.0,
+            'N': float(n), 'Médiane': _weighted_median(values, weights), 'N effectif': n_eff}
+
+
+def _weighted_rows(case, col, codes):
+    """(noms de pays, valeurs, poids) des réponses valides des pays `codes`."""
+    rows = case.df[COUNTRY_COL].isin(codes) & case.df[col].notna()
+    names = case.df.loc[rows, COUNTRY_COL].map(lambda c: COUNTRY_NAMES.get(c, c))
+    return names, case.df.loc[rows, col].to_numpy(dtype=float), case.weights[rows].to_numpy()
+
+
+def _ref_weighted_stats(case):
+    results = {}
+    for col in case.columns:
+        for sel in case.selections:
+            names, values, weights = _weighted_rows(case, col, sel)
+            table = [{'Pays': name, **_weighted_country_stats(values[mask], weights[mask])}
+                     for name in sorted(set(names)) for mask in [(names == name).to_numpy()]]
+            results[col, sel] = pd.DataFrame(table, columns=['Pays', 'Moyenne', 'Écart-type', 'IC95',
+                                                             'N', 'Médiane', 'N effectif'])
+    return results
+
+
+def _ref_weighted_distribution(case):
+    results = {}
+    for col in case.columns:
+        for sel in case.selections:
+            names, values, weights = _weighted_rows(case, col, sel)
+            pivot = (pd.DataFrame({'Pays': names.to_numpy(), col: values, 'w': weights})
+                     .pivot_table(index='Pays', columns=col, values='w', aggfunc='sum', fill_value=0.0))
+            pivot = pivot.loc[:, (pivot != 0).any()].sort_index().sort_index(axis=1)
+            results[col, sel] = (pivot, pivot.div(pivot.sum(axis=1), axis=0) * 100)
+    return results
+
+
+def _ref_weighted_heatmap(case):
+    results = {}
+    for theme, columns in case.themes.items():
+        for sel in case.selections:
+            means = {}
+            for label, col in columns.items():
+                names, values, weights = _weighted_rows(case, col, sel)
+                means[label] = {name: np.average(values[mask], weights=weights[mask])
+                                if weights[mask].sum() > 0 else np.nan
+                                for name in set(names) for mask in [(names == name).to_numpy()]}
+            means = pd.DataFrame(means, columns=list(columns)).sort_index().dropna(how='all')
+            results[theme, sel] = (means, _zscore(means))
+    return results
+
+
+def _ref_weighted_profile(case):
+    results = {}
+    for sel in case.selections:
+        if len(sel) < 2:
+            continue
+        for col in case.columns:
+            pooled = []
+            for codes in ([sel[0]], sel[1:]):
+                _, values, weights = _weighted_rows(case, col, codes)
+                pooled.append(np.average(values, weights=weights) if weights.sum() > 0 else np.nan)
+            results[col, sel] = tuple(pooled)
+    return results
+
+
+def _ref_weighted_value_counts(case):
+    results = {}
+    for code in case.detail_codes:
+        for col in case.columns:
+            _, values, weights = _weighted_rows(case, col, [code])
+            counts = pd.Series(weights).groupby(values).sum()
+            results[col, code] = counts[counts > 0].sort_index()
+    return results
+
+
+STAGES = {
+    'stats': (_ref_stats, _run_stats),
+    'distribution': (_ref_distribution, _run_distribution),
+    'heatmap': (_ref_heatmap, _run_heatmap),
+    'profile': (_ref_profile, _run_profile),
+    'value_counts': (_ref_value_counts, _run_value_counts),
+}
+WEIGHTED_REFERENCES = {
+    'stats': _ref_weighted_stats,
+    'distribution': _ref_weighted_distribution,
+    'heatmap': _ref_weighted_heatmap,
+    'profile': _ref_weighted_profile,
+    'value_counts': _ref_weighted_value_counts,
+}
+
+
+# ─── COMPARAISON ─────────────────────────────────────────────────────────────
+def compare(expected, actual, rtol=RTOL, atol=ATOL):
+    """Description du premier écart, ou None si `actual` égale `expected` aux tolérances près.
+
+    L'ordre des lignes et des colonnes fait partie du résultat ; les types
+    (int/float) et les noms d'index ne sont pas comparés.
+    """
+    if isinstance(expected, tuple):
+        if not isinstance(actual, tuple) or len(actual) != len(expected):
+            return f"attendu {len(expected)} résultats, obtenu {actual!r:.80}"
+        for e, a in zip(expected, actual):
+            message = compare(e, a, rtol, atol)
+            if message:
+                return message
+        return None
+    options = dict(check_dtype=False, check_index_type=False, check_names=False,
+                   check_exact=False, rtol=rtol, atol=atol)
+    try:
+        if isinstance(expected, pd.DataFrame):
+            pdt.assert_frame_equal(actual, expected, check_column_type=False, **options)
+        elif isinstance(expected, pd.Series):
+            pdt.assert_series_equal(actual, expected, **options)
+        else:
+            np.testing.assert_allclose(actual, expected, rtol=rtol, atol=atol, equal_nan=True)
+    except (AssertionError, TypeError, ValueError) as e:
+        return ' '.join(str(e).split())[:200]
+    return None
+
+
+# ─── EXÉCUTION ───────────────────────────────────────────────────────────────
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def check_engine(case, name, reference, rtol=RTOL, atol=ATOL):
+    """Construit le moteur `name` puis compare chaque étape : [(étape, secondes, écarts)]."""
+    backend, elapsed = _timed(ENGINES[name], case)
+    report = [('build', elapsed, [])]
+    for stage, (_, run) in STAGES.items():
+        results, elapsed = _timed(run, case, backend)
+        mismatches = []
+        for key, expected in reference[stage].items():
+            message = compare(expected, results.get(key), rtol, atol)
+            if message:
+                mismatches.append(f"{key[0]} · {_selection_label(key[1])} : {message}")
+        report.append((stage, elapsed, mismatches))
+    return report
+
+
+def _selection_label(sel):
+    if isinstance(sel, str):
+        return sel
+    return ','.join(sel) if len(sel) <= 8 else f"{len(sel)} pays"
+
+
+def stage_budget(budgets, engine, stage, n_rows):
+    """Budget (s) d'une étape : surcharge moteur, sinon budget commun, proportionnel aux lignes."""
+    budget = budgets.get((engine, stage), budgets[None, stage])
+    return budget * max(1.0, n_rows / BUDGET_ROWS)
+
+
+def run_case(case, engines, budgets, rtol=RTOL, atol=ATOL):
+    """Compare tous les moteurs sur un jeu ; renvoie True si tout est conforme."""
+    if case.weight_col:
+        engines = [e for e in engines if e in WEIGHTED_ENGINES]
+    if 'counts-stream' in engines:
+        case.csv_path   # écrit hors chronométrage
+    print(f"\n🧪 {case.name} · {case.n_rows:,} lignes · {len(case.selections[0])} pays · "
+          f"{len(case.columns)} variables" + (f" · pondéré par « {case.weight_col} »" if case.weight_col else ""))
+
+    reference, ref_times = {}, {}
+    for stage, (ref, _) in STAGES.items():
+        ref = WEIGHTED_REFERENCES[stage] if case.weight_col else ref
+        reference[stage], ref_times[stage] = _timed(ref, case)
+    print("   référence : " + ' · '.join(f"{s} {t:.2f} s" for s, t in ref_times.items()))
+
+    print(f"   {'moteur':<14} {'étape':<13} {'temps (s)':>9} {'budget (s)':>10} "
+          f"{'vs réf.':>8} {'requêtes':>9}  résultat")
+    ok = True
+    for name in engines:
+        for stage, elapsed, mismatches in check_engine(case, name, reference, rtol, atol):
+            budget = stage_budget(budgets, name, stage, case.n_rows)
+            over = elapsed > budget
+            queries = len(reference[stage]) if stage in reference else 1
+            ratio = f"×{ref_times[stage] / elapsed:.1f}" if stage in ref_times and elapsed else ''
+            status = (f"❌ {len(mismatches)} écart(s)" if mismatches
+                      else "⏱️ hors budget" if over else "✅")
+            print(f"   {name:<14} {stage:<13} {elapsed:>9.3f} {budget:>10.2f} "
+                  f"{ratio:>8} {queries:>9}  {status}")
+            for message in mismatches[:3]:
+                print(f"      ↳ {message}")
+            ok &= not mismatches and not over
+    return ok
+
+
+def _parse_budgets(overrides):
+    """Budgets {(moteur ou None, étape): secondes}, surcharges « [moteur.]étape=secondes » comprises."""
+    budgets = {(None, stage): seconds for stage, seconds in STAGE_BUDGETS.items()}
+    for item in overrides:
+        target, _, seconds = item.partition('=')
+        engine, _, stage = target.rpartition('.')
+        if stage not in STAGE_BUDGETS:
+            raise SystemExit(f"Étape inconnue : {stage} (attendu : {', '.join(STAGE_BUDGETS)})")
+        if engine and engine not in ENGINES:
+            raise SystemExit(f"Moteur inconnu : {engine}")
+        if engine:
+            budgets[engine, stage] = float(seconds)
+        else:
+            # Surcharge commune : remplace aussi les budgets propres aux moteurs
+            budgets = {k: v for k, v in budgets.items() if k[1] != stage}
+            budgets[None, stage] = float(seconds)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Équivalence des moteurs d'agrégation avec la logique de référence")
+    parser.add_argument('--engines', default=','.join(ENGINES), help="Moteurs candidats à comparer")
+    parser.add_argument('--rows', type=int, default=157_000, help="Lignes du jeu synthétique principal")
+    parser.add_argument('--data', help="Dataset EVS à échantillonner (CSV ou ZIP ; '-' = release GitHub)")
+    parser.add_argument('--sample', type=int, default=50_000, help="Lignes tirées de --data (0 = toutes)")
+    parser.add_argument('--rtol', type=float, default=RTOL)
+    parser.add_argument('--atol', type=float, default=ATOL)
+    parser.add_argument('--budget', action='append', default=[], metavar='[MOTEUR.]ÉTAPE=SECONDES',
+                        help=f"Surcharge d'un budget ({', '.join(STAGE_BUDGETS)}), répétable")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    unknown = [e for e in engines if e not in ENGINES]
+    if unknown:
+        raise SystemExit(f"Moteurs inconnus : {', '.join(unknown)} (disponibles : {', '.join(ENGINES)})")
+    budgets = _parse_budgets(args.budget)
+
+    datasets = [
+        ("cas limites", lambda: edge_case_dataset(args.seed), None),
+        ("synthétique", lambda: synthetic_dataset(args.rows, seed=args.seed), None),
+        ("cas limites pondérés", lambda: weighted_edge_case_dataset(args.seed), WEIGHT_COL),
+        ("synthétique pondéré", lambda: synthetic_dataset(args.rows, seed=args.seed), WEIGHT_COL),
+    ]
+    if args.data:
+        path = None if args.data == '-' else args.data
+        datasets.append(("échantillon EVS", lambda: sample_dataset(path, args.sample, args.seed), None))
+
+    ok = True
+    for name, make, weight_col in datasets:
+        case = Case(name, make(), args.seed, weight_col)
+        try:
+            ok &= run_case(case, engines, budgets, args.rtol, args.atol)
+        finally:
+            case.cleanup()
+    print("\n✅ Tous les moteurs sont équivalents à la référence" if ok
+          else "\n❌ Écarts ou dépassements de budget")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+EVS/WVS 2017-2022 — Graphiques
+Construction des figures matplotlib de l'application, sans dépendance à
+Streamlit (réutilisables hors de l'app, mises en cache sous forme de PNG).
+
+Les figures sont créées avec l'API objet (matplotlib.figure.Figure) et non
+pyplot : pas d'état global partagé entre sessions concurrentes.
+"""
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.collections import PathCollection
+from matplotlib.colors import LinearSegmentedColormap, ListedColormap
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
+
+PALETTE = ['#E63946', '#457B9D', '#2A9D8F', '#E9C46A', '#F4A261',
+           '#264653', '#A8DADC', '#6D6875', '#B5838D', '#FFAFCC',
+           '#80B918', '#FF6B6B', '#4CC9F0', '#F72585', '#7209B7']
+
+HEATMAP_CMAP = LinearSegmentedColormap.from_list('evs', ['#D62828', '#F7F7F7', '#2A9D8F'])
+DIVERGENCE_CMAP = LinearSegmentedColormap.from_list('evs_divergence', ['#F7F7F7', '#E9C46A', '#D62828'])
+# Heatmap : pouces par cellule (colonne, ligne) et taille maximale de la figure.
+# Au-delà de HEATMAP_MAX_SIZE, les cellules rétrécissent : le nombre de pixels
+# (donc le temps de rendu) reste borné ; les grandes matrices sont découpées
+# en tuiles de HEATMAP_TILE_ROWS lignes par l'appelant.
+HEATMAP_CELL = (0.7, 0.45)
+HEATMAP_MAX_SIZE = (24, 16)
+HEATMAP_TILE_ROWS = 30
+
+
+def figure_png(fig, dpi=200):
+    """Rendu PNG d'une figure (mêmes réglages que st.pyplot)."""
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def _new_figure(figsize):
+    fig = Figure(figsize=figsize)
+    fig.patch.set_facecolor('#FAFAF8')
+    ax = fig.subplots()
+    ax.set_facecolor('#FAFAF8')
+    return fig, ax
+
+
+# ─── ONGLET 1 ────────────────────────────────────────────────────────────────
+def stats_bar_chart(stats, var_label, show_ci=False, show_n=True):
+    """Barres horizontales des moyennes par pays (avec IC95 et N optionnels)."""
+    fig, ax = _new_figure((10, max(4, len(stats) * 0.55)))
+
+    colors = [PALETTE[i % len(PALETTE)] for i in range(len(stats))]
+    bars = ax.barh(stats['Pays'], stats['Moyenne'],
+                   color=colors, alpha=0.85, height=0.6, zorder=3)
+
+    if show_ci:
+        ax.errorbar(stats['Moyenne'], stats['Pays'],
+                    xerr=stats['IC95'], fmt='none', color='#333',
+                    capsize=3, linewidth=1.2, zorder=4)
+
+    # Labels valeurs
+    for bar, (_, row) in zip(bars, stats.iterrows()):
+        label = f"{row['Moyenne']:.2f}"
+        if show_n:
+            label += f"  (n={int(row['N']):,}"
+            # Mode pondéré : effectif efficace
+            label += f" · n eff.={row['N effectif']:,.0f})" if 'N effectif' in row else ")"
+        ax.text(bar.get_width() + ax.get_xlim()[1] * 0.01, bar.get_y() + bar.get_height() / 2,
+                label, va='center', fontsize=8.5, color='#333', fontfamily='monospace')
+
+    ax.set_xlabel('Moyenne', fontsize=9, color='#555')
+    ax.set_title(var_label, fontsize=13, fontweight='bold', color='#1A1A2E', pad=14)
+    ax.tick_params(axis='both', labelsize=9)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_color('#DDD')
+    ax.spines['bottom'].set_color('#DDD')
+    ax.grid(axis='x', alpha=0.25, zorder=0)
+    ax.set_xlim(0, stats['Moyenne'].max() * 1.22)
+
+    fig.tight_layout()
+    return fig
+
+
+def _distribution_colors(n_values):
+    return matplotlib.colormaps['RdYlGn'](np.linspace(0.1, 0.9, n_values))
+
+
+def distribution_pct_chart(pivot_pct, var_label):
+    """Barres empilées : % des répondants par valeur de réponse."""
+    fig, ax = _new_figure((10, max(4, len(pivot_pct) * 0.55)))
+
+    cmap_colors = _distribution_colors(len(pivot_pct.columns))
+    left = np.zeros(len(pivot_pct))
+
+    for i, val in enumerate(pivot_pct.columns):
+        widths = pivot_pct[val].values
+        ax.barh(pivot_pct.index, widths, left=left,
+                color=cmap_colors[i], label=f"{int(val)}", height=0.6, zorder=3)
+        for j, (w, l) in enumerate(zip(widths, left)):
+            if w > 5:
+                ax.text(l + w / 2, j, f"{w:.0f}%",
+                        ha='center', va='center', fontsize=7.5, color='white', fontweight='bold')
+        left += widths
+
+    ax.set_xlabel('% des répondants', fontsize=9, color='#555')
+    ax.set_title(f'Distribution % — {var_label}', fontsize=10, fontweight='bold', color='#1A1A2E')
+    ax.legend(title='Valeur', bbox_to_anchor=(1.01, 1), loc='upper left', fontsize=8)
+    ax.set_xlim(0, 100)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='x', alpha=0.2, zorder=0)
+    fig.tight_layout()
+    return fig
+
+
+def distribution_volume_chart(pivot, var_label):
+    """Barres empilées : nombre de répondants par valeur de réponse."""
+    fig, ax = _new_figure((10, max(4, len(pivot) * 0.55)))
+
+    cmap_colors = _distribution_colors(len(pivot.columns))
+    left_vol = np.zeros(len(pivot))
+    for i, val in enumerate(pivot.columns):
+        widths_vol = pivot[val].values
+        ax.barh(pivot.index, widths_vol, left=left_vol,
+                color=cmap_colors[i], label=f"{int(val)}", height=0.6, zorder=3)
+        for j, (w, l) in enumerate(zip(widths_vol, left_vol)):
+            if w > pivot[val].max() * 0.08:  # Affiche si > 8% du max
+                ax.text(l + w / 2, j, f"{int(w):,}",
+                        ha='center', va='center', fontsize=7.5, color='white', fontweight='bold')
+        left_vol += widths_vol
+
+    ax.set_xlabel('Nombre de répondants', fontsize=9, color='#555')
+    ax.set_title(f'Distribution volume — {var_label}', fontsize=10, fontweight='bold', color='#1A1A2E')
+    ax.legend(title='Valeur', bbox_to_anchor=(1.01, 1), loc='upper left', fontsize=8)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='x', alpha=0.2, zorder=0)
+    fig.tight_layout()
+    return fig
+
+
+def divergence_chart(divergence, cbar_label, title):
+    """Matrice pays × pays de divergence des distributions (0 = mêmes réponses)."""
+    k = len(divergence)
+    fig = Figure(figsize=(max(7, k * 0.3 + 3), max(6, k * 0.28 + 2)))
+    fig.patch.set_facecolor('#FAFAF8')
+    ax = fig.subplots()
+
+    values = divergence.to_numpy(dtype=float)
+    im = ax.imshow(values, cmap=DIVERGENCE_CMAP, vmin=0, aspect='auto')
+    if k <= 15:
+        _annotate_cells(ax, values, decimals=2)
+
+    fontsize = 9 if k <= 30 else 6
+    ax.set_xticks(range(k))
+    ax.set_xticklabels(divergence.columns, rotation=90, fontsize=fontsize)
+    ax.set_yticks(range(k))
+    ax.set_yticklabels(divergence.index, fontsize=fontsize)
+
+    cbar = fig.colorbar(im, ax=ax, shrink=0.6)
+    cbar.set_label(cbar_label, fontsize=9)
+    ax.set_title(title, fontsize=11, fontweight='bold', color='#1A1A2E', pad=12)
+
+    fig.tight_layout()
+    return fig
+
+
+# ─── ONGLET 2 ────────────────────────────────────────────────────────────────
+def heatmap_chart(heatmap_df_plot, cmap_label, annotate=False, limits=None,
+                  title="Comparaison pays × variables"):
+    """Carte de chaleur pays × variables (valeurs optionnelles dans les cellules).
+
+    `limits` (vmin, vmax) fixe l'échelle de couleurs : commune à toutes les
+    tuiles d'une même matrice.
+    """
+    n_rows, n_cols = heatmap_df_plot.shape
+    fig = Figure(figsize=(min(max(10, n_cols * HEATMAP_CELL[0]), HEATMAP_MAX_SIZE[0]),
+                          min(max(6, n_rows * HEATMAP_CELL[1]), HEATMAP_MAX_SIZE[1])))
+    fig.patch.set_facecolor('#FAFAF8')
+    ax = fig.subplots()
+
+    values = heatmap_df_plot.to_numpy(dtype=float)
+    vmin, vmax = limits if limits is not None else (None, None)
+    im = ax.imshow(values, cmap=HEATMAP_CMAP, aspect='auto', vmin=vmin, vmax=vmax)
+
+    ax.set_xticks(range(n_cols))
+    ax.set_xticklabels(heatmap_df_plot.columns, rotation=45, ha='right', fontsize=8.5)
+    ax.set_yticks(range(n_rows))
+    ax.set_yticklabels(heatmap_df_plot.index, fontsize=9)
+
+    # Valeurs dans les cellules
+    if annotate:
+        _annotate_cells(ax, values)
+
+    cbar = fig.colorbar(im, ax=ax, shrink=0.6)
+    cbar.set_label(cmap_label, fontsize=9)
+    ax.set_title(title, fontsize=13, fontweight='bold', color='#1A1A2E', pad=14)
+
+    fig.tight_layout()
+    return fig
+
+
+def heatmap_tiles(n_rows, max_rows=HEATMAP_TILE_ROWS):
+    """Découpage de n_rows lignes en tuiles équilibrées d'au plus max_rows : [(début, fin)]."""
+    if n_rows <= max_rows:
+        return [(0, n_rows)]
+    size = -(-n_rows // -(-n_rows // max_rows))
+    return [(start, min(start + size, n_rows)) for start in range(0, n_rows, size)]
+
+
+@lru_cache(maxsize=1024)
+def _label_path(text, size):
+    """Contour d'un libellé, centré sur l'origine (en points)."""
+    path = TextPath((0, 0), text, size=size)
+    (x0, y0), (x1, y1) = path.get_extents().get_points()
+    return path.transformed(Affine2D().translate(-(x0 + x1) / 2, -(y0 + y1) / 2))
+
+
+def _annotate_cells(ax, values, fontsize=7, color='#111', decimals=1):
+    """Valeurs des cellules (hors NaN) dessinées en un seul artiste.
+
+    Un ax.text par cellule coûte une mise en page de texte chacun (plusieurs
+    secondes pour 80 pays × 44 variables) ; ici les contours des libellés,
+    mis en cache, sont placés au centre des cellules par une PathCollection.
+    """
+    rows, cols = np.nonzero(~np.isnan(values))
+    paths = [_label_path(f"{v:.{decimals}f}", fontsize) for v in values[rows, cols]]
+    ax.add_collection(PathCollection(
+        paths, offsets=np.column_stack([cols, rows]), offset_transform=ax.transData,
+        transform=Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans,
+        facecolors=color, edgecolors='none'), autolim=False)
+
+
+# ─── ONGLET 3 ────────────────────────────────────────────────────────────────
+def significance_chart(diff, pvalues, alpha, title):
+    """Matrice pays × pays : écart (ligne − colonne) en couleur si significatif, gris sinon."""
+    k = len(diff)
+    fig = Figure(figsize=(max(7, k * 0.3 + 3), max(6, k * 0.28 + 2)))
+    fig.patch.set_facecolor('#FAFAF8')
+    ax = fig.subplots()
+    ax.set_facecolor('#FAFAF8')
+
+    values = diff.to_numpy(dtype=float)
+    significant = pvalues.to_numpy(dtype=float) < alpha
+    # Fond gris pour les paires non significatives, diagonale vide
+    ax.imshow(np.where(np.eye(k, dtype=bool), np.nan, 1.0),
+              cmap=ListedColormap(['#E5E5E5']), aspect='auto')
+    limit = np.nanmax(np.abs(values)) if k > 1 else 1.0
+    im = ax.imshow(np.ma.masked_where(~significant, values), cmap=HEATMAP_CMAP,
+                   vmin=-limit, vmax=limit, aspect='auto')
+
+    fontsize = 9 if k <= 30 else 6
+    ax.set_xticks(range(k))
+    ax.set_xticklabels(diff.columns, rotation=90, fontsize=fontsize)
+    ax.set_yticks(range(k))
+    ax.set_yticklabels(diff.index, fontsize=fontsize)
+
+    cbar = fig.colorbar(im, ax=ax, shrink=0.6)
+    cbar.set_label("Écart (ligne − colonne)", fontsize=9)
+    ax.set_title(title, fontsize=11, fontweight='bold', color='#1A1A2E', pad=12)
+
+    fig.tight_layout()
+    return fig
+
+
+# ─── ONGLET 4 ────────────────────────────────────────────────────────────────
+def profile_chart(profile_df, focus_country):
+    """Barres appariées : pays analysé vs moyenne des autres pays sélectionnés."""
+    fig, ax = _new_figure((10, max(5, len(profile_df) * 0.6)))
+
+    y = np.arange(len(profile_df))
+    h = 0.35
+    ax.barh(y + h/2, profile_df[focus_country], h,
+            color='#E63946', alpha=0.85, label=focus_country, zorder=3)
+    ax.barh(y - h/2, profile_df['Autres pays (moy.)'], h,
+            color='#457B9D', alpha=0.7, label='Autres pays (moy.)', zorder=3)
+
+    ax.set_yticks(y)
+    ax.set_yticklabels(profile_df['Variable'], fontsize=9)
+    ax.set_xlabel('Moyenne', fontsize=9, color='#555')
+    ax.set_title(f"Profil de {focus_country} vs. autres pays", fontsize=13,
+                 fontweight='bold', color='#1A1A2E', pad=14)
+    ax.legend(fontsize=9, loc='lower right')
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='x', alpha=0.25, zorder=0)
+
+    fig.tight_layout()
+    return fig
+
+
+# ─── ONGLET 5 ────────────────────────────────────────────────────────────────
+def value_counts_chart(value_counts, var_label):
+    """Barres horizontales du volume (et %) par valeur de réponse d'un pays."""
+    total_resp = value_counts.sum()
+    fig, ax = _new_figure((8, max(3, len(value_counts) * 0.4)))
+
+    colors_d = matplotlib.colormaps['viridis'](np.linspace(0.2, 0.9, len(value_counts)))
+    bars_d = ax.barh(range(len(value_counts)), value_counts.values,
+                     color=colors_d, alpha=0.85, height=0.6)
+
+    ax.set_yticks(range(len(value_counts)))
+    ax.set_yticklabels([f"Valeur {int(v)}" for v in value_counts.index], fontsize=9)
+    ax.set_xlabel('Nombre de répondants', fontsize=9)
+    ax.set_title(f'{var_label}', fontsize=10, fontweight='bold')
+
+    # Ajouter les valeurs sur les barres
+    for bar, val, pct_val in zip(bars_d, value_counts.values, value_counts.values / total_resp * 100):
+        ax.text(bar.get_width() + ax.get_xlim()[1] * 0.02, bar.get_y() + bar.get_height() / 2,
+                f"{int(val):,} ({pct_val:.1f}%)",
+                va='center', fontsize=8, color='#000', fontweight='600')
+
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.grid(axis='x', alpha=0.2)
+    fig.tight_layout()
+    return fig
+
+
+def histogram_chart(value_counts, var_label):
+    """Histogramme d'une variable continue à partir de ses volumes par valeur."""
+    fig, ax = _new_figure((10, 4))
+
+    ax.hist(value_counts.index, bins=30, weights=value_counts.values,
+            color='steelblue', alpha=0.7, edgecolor='black')
+    ax.set_xlabel('Valeur', fontsize=9)
+    ax.set_ylabel('Fréquence', fontsize=9)
+    ax.set_title(f'{var_label}', fontsize=11, fontweight='bold')
+    ax.grid(axis='y', alpha=0.2)
+    fig.tight_layout()
+    return fig
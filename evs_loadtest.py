@@ -0,0 +1,202 @@
+"""
+EVS/WVS 2017-2022 — Test de charge multi-sessions
+Simule N sessions utilisateurs simultanées sur evs_stats_app.py (Streamlit
+AppTest, même processus : caches partagés comme sur un vrai serveur) et
+mesure la latence des reruns et la mémoire résidente.
+
+Usage :
+    python evs_loadtest.py --sessions 1,2,4,8 --interactions 10
+    python evs_loadtest.py --data data_evs_mapped.csv --sessions 4
+
+Sans --data, un jeu synthétique au format du dataset mappé est généré
+(--rows lignes) : aucun téléchargement depuis la release GitHub.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from evs_stats_core import synthetic_dataset
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evs_stats_app.py')
+
+
+# ─── MÉMOIRE ─────────────────────────────────────────────────────────────────
+def resident_memory_mb():
+    """Mémoire résidente du processus (psutil si disponible, sinon pic ru_maxrss)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ─── INTERACTIONS ────────────────────────────────────────────────────────────
+def _by_label(widgets, label):
+    return next((w for w in widgets if w.label.startswith(label)), None)
+
+
+def _pick(widget, rng):
+    if widget is not None and len(widget.options) > 1:
+        widget.set_value(rng.choice(widget.options))
+
+
+def _sidebar_countries(at, rng):
+    countries = _by_label(at.sidebar.multiselect, "Pays à comparer")
+    if countries is not None:
+        countries.set_value(rng.sample(countries.options, rng.randint(2, 12)))
+
+
+def _sidebar_preset(at, rng):
+    _pick(_by_label(at.sidebar.selectbox, "Présélection rapide"), rng)
+
+
+def _sidebar_toggle(at, rng):
+    toggle = rng.choice(list(at.sidebar.toggle))
+    toggle.set_value(not toggle.value)
+
+
+def _sidebar_apply(at, rng):
+    """Formulaire de la sidebar : 1 à 3 changements groupés, un seul rerun via « Appliquer »."""
+    for stage in rng.choices([_sidebar_countries, _sidebar_preset, _sidebar_toggle], [2, 1, 2],
+                             k=rng.randint(1, 3)):
+        stage(at, rng)
+    apply = _by_label(at.sidebar.button, "Appliquer")
+    if apply is not None:
+        apply.click()
+
+
+def _tab1_variable(at, rng):
+    tab = at.tabs[0]
+    _pick(_by_label(tab.selectbox, "Thème"), rng)
+    _pick(_by_label(tab.selectbox, "Variable"), rng)
+
+
+def _tab2_heatmap(at, rng):
+    tab = at.tabs[1]
+    variables = _by_label(tab.multiselect, "Variables à inclure")
+    if variables is not None:
+        variables.set_value(rng.sample(variables.options, rng.randint(2, len(variables.options))))
+    toggle = rng.choice(list(tab.toggle))
+    toggle.set_value(not toggle.value)
+
+
+def _tab3_table(at, rng):
+    tab = at.tabs[2]
+    _pick(_by_label(tab.selectbox, "Thème"), rng)
+    _pick(_by_label(tab.selectbox, "Trier par variable"), rng)
+
+
+def _tab4_focus(at, rng):
+    _pick(_by_label(at.tabs[3].selectbox, "Pays à analyser"), rng)
+
+
+def _tab5_profile(at, rng):
+    tab = at.tabs[4]
+    _pick(_by_label(tab.selectbox, "Pays à analyser en détail"), rng)
+    _pick(_by_label(tab.selectbox, "📂 Thème"), rng)
+
+
+# (action, poids) : les changements de variable dominent, la sélection de pays suit
+INTERACTIONS = [
+    (_tab1_variable, 5),
+    (_sidebar_apply, 5),
+    (_tab2_heatmap, 2),
+    (_tab3_table, 2),
+    (_tab4_focus, 1),
+    (_tab5_profile, 2),
+]
+
+
+# ─── SESSIONS ────────────────────────────────────────────────────────────────
+def run_session(seed, interactions, timeout, latencies, errors, lock):
+    """Une session : chargement initial puis `interactions` reruns tirés au hasard."""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    actions, weights = zip(*INTERACTIONS)
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    for step in range(interactions + 1):
+        if step:
+            rng.choices(actions, weights)[0](at, rng)
+        start = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if at.exception:
+                errors.append(at.exception[0].value)
+
+
+def run_level(n_sessions, interactions, timeout, seed):
+    latencies, errors, lock = [], [], threading.Lock()
+    threads = [
+        threading.Thread(target=run_session,
+                         args=(seed * 1000 + i, interactions, timeout, latencies, errors, lock))
+        for i in range(n_sessions)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    lat = np.array(latencies)
+    return {
+        'sessions': n_sessions,
+        'reruns': len(lat),
+        'p50': float(np.percentile(lat, 50)),
+        'p95': float(np.percentile(lat, 95)),
+        'max': float(lat.max()),
+        'throughput': len(lat) / wall,
+        'rss_mb': resident_memory_mb(),
+        'errors': errors,
+    }
+
+
+def run_levels(args, data_path):
+    """Paliers de sessions simultanées sur `data_path` ; renvoie True si un rerun a échoué."""
+    os.environ['EVS_DATA_PATH'] = data_path
+    os.environ.pop('EVS_AGGREGATES', None)
+
+    print(f"Mémoire de départ : {resident_memory_mb():,.0f} Mo\n")
+    print(f"{'sessions':>8} {'reruns':>7} {'p50 (s)':>8} {'p95 (s)':>8} {'max (s)':>8} "
+          f"{'reruns/s':>9} {'RSS (Mo)':>9}")
+    failed = False
+    for n in [int(x) for x in args.sessions.split(',')]:
+        r = run_level(n, args.interactions, args.timeout, args.seed)
+        print(f"{r['sessions']:>8} {r['reruns']:>7} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['max']:>8.2f} "
+              f"{r['throughput']:>9.2f} {r['rss_mb']:>9,.0f}")
+        for err in r['errors'][:3]:
+            print(f"   ⚠️ {err}")
+        failed |= bool(r['errors'])
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge multi-sessions de l'application Streamlit")
+    parser.add_argument('--sessions', default='1,2,4,8', help="Paliers de sessions simultanées")
+    parser.add_argument('--interactions', type=int, default=10, help="Interactions par session")
+    parser.add_argument('--data', help="CSV local (défaut : jeu synthétique)")
+    parser.add_argument('--rows', type=int, default=157_000, help="Lignes du jeu synthétique")
+    parser.add_argument('--timeout', type=float, default=300, help="Délai max d'un rerun (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Jeu synthétique écrit dans un dossier temporaire, supprimé en fin de test
+    with tempfile.TemporaryDirectory(prefix='evs_loadtest_') as workdir:
+        data_path = args.data
+        if not data_path:
+            data_path = os.path.join(workdir, 'data_evs_mapped.csv')
+            print(f"🧪 Jeu synthétique : {args.rows:,} lignes → {data_path}")
+            synthetic_dataset(args.rows, seed=args.seed).to_csv(data_path, index=False)
+        failed = run_levels(args, data_path)
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
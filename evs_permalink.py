@@ -0,0 +1,109 @@
+"""
+EVS/WVS 2017-2022 — Permaliens
+L'état de la vue (pays, variable, options, vagues, pondération) est encodé dans les
+paramètres d'URL sous une forme canonique : pays triés et dédoublonnés,
+variable désignée par sa colonne, options en 0/1. Deux liens équivalents
+donnent les mêmes paramètres, donc les mêmes clés dans les caches serveur.
+
+    ?c=DE,FR,IT&var=Feeling+of+happiness&n=1&ci=0&sort=1&w=1
+
+Un indice composite est désigné par sa colonne (composite_column) et
+retrouvé parmi les définitions connues (COMPOSITE_PRESETS par défaut).
+"""
+from urllib.parse import parse_qs, urlsplit
+
+from evs_stats_core import (
+    THEMES, COMPOSITE_THEME, COMPOSITE_PREFIX, COMPOSITE_PRESETS,
+    composite_column, composite_label, resolve_variable,
+)
+
+# Options de la barre latérale : paramètre → valeur par défaut
+TOGGLES = {'n': True, 'ci': False, 'sort': True}
+# Statistiques pondérées : paramètre présent seulement si activé (liens non pondérés inchangés)
+WEIGHTED_PARAM = 'w'
+
+_TRUE = {'1', 'true', 'on', 'yes', 'oui'}
+_FALSE = {'0', 'false', 'off', 'no', 'non'}
+
+
+def _first(params, name):
+    """Valeur d'un paramètre (st.query_params → str, parse_qs → liste)."""
+    value = params.get(name)
+    if isinstance(value, (list, tuple)):
+        value = value[-1] if value else None
+    return value.strip() if isinstance(value, str) else None
+
+
+def _codes(raw):
+    return sorted({c.strip().upper() for c in raw.split(',') if c.strip()})
+
+
+def theme_of(var_label):
+    return next((theme for theme, theme_vars in THEMES.items() if var_label in theme_vars), None)
+
+
+def _composite(col_name, composites):
+    """(nom, items) de l'indice dont `col_name` est la colonne, ou None."""
+    return next(((name, tuple(items)) for name, items in composites.items()
+                 if composite_column(name, items) == col_name), None)
+
+
+def parse_view(params, composites=COMPOSITE_PRESETS):
+    """Vue décrite par des paramètres d'URL, normalisée ; les valeurs invalides sont ignorées.
+
+    Renvoie un dict avec tout ou partie des clés 'countries', 'theme', 'var'
+    (libellé), 'column' (colonne hors THEMES), 'composite' (nom, items d'un
+    indice de `composites`), 'waves', 'weighted' et celles de TOGGLES.
+    """
+    view = {}
+    countries = _codes(_first(params, 'c') or '')
+    if countries:
+        view['countries'] = countries
+
+    var = _first(params, 'var')
+    resolved = resolve_variable(var) if var else None
+    # Indice composite : retrouvé parmi `composites`, ignoré s'il est inconnu (défini dans
+    # une autre session), jamais pris pour une colonne du catalogue
+    composite = _composite(var, composites) if var and var.startswith(COMPOSITE_PREFIX) else None
+    if resolved is not None:
+        view['var'] = resolved[0]
+        view['theme'] = theme_of(resolved[0])
+    elif composite is not None:
+        view['composite'] = composite
+        view['var'] = composite_label(composite[0])
+        view['theme'] = COMPOSITE_THEME
+    elif var and not var.startswith(COMPOSITE_PREFIX):
+        # Colonne hors THEMES (catalogue) : validée par l'application
+        view['column'] = var
+
+    for name in TOGGLES:
+        flag = (_first(params, name) or '').lower()
+        if flag in _TRUE or flag in _FALSE:
+            view[name] = flag in _TRUE
+
+    waves = sorted({w.strip() for w in (_first(params, 'waves') or '').split(',') if w.strip()})
+    if waves:
+        view['waves'] = waves
+    if (_first(params, WEIGHTED_PARAM) or '').lower() in _TRUE:
+        view['weighted'] = True
+    return view
+
+
+def parse_view_url(url):
+    """parse_view d'une URL complète ou d'une simple chaîne de requête (« ?c=FR,DE&… »)."""
+    query = urlsplit(url).query if '?' in url or '://' in url else url
+    return parse_view(parse_qs(query.lstrip('?')))
+
+
+def view_params(countries, col_name, show_n, show_ci, sort_bars, waves=None, weighted=False):
+    """Paramètres d'URL canoniques d'une vue (dict str → str, ordre fixe)."""
+    params = {'c': ','.join(sorted(set(countries)))}
+    if col_name:
+        params['var'] = col_name
+    for name, flag in zip(TOGGLES, (show_n, show_ci, sort_bars)):
+        params[name] = '1' if flag else '0'
+    if waves:
+        params['waves'] = ','.join(sorted(waves))
+    if weighted:
+        params[WEIGHTED_PARAM] = '1'
+    return params
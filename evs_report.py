@@ -0,0 +1,218 @@
+"""
+EVS/WVS 2017-2022 — Rapport imprimable par lot de pays
+Rend, pour une liste de pays, les graphiques de l'onglet 1 (moyennes,
+distributions en % et en volume) de chaque variable de THEMES, puis la
+heatmap de chaque thème (onglet 2) : PDF multi-pages ou dossier de PNG.
+
+Le rendu matplotlib est mono-thread : il est réparti sur un pool de
+processus. Le processus principal calcule les agrégats (petits tableaux
+par variable) et les envoie aux workers. Ceux-ci renvoient les PNG des
+graphiques, ou pour le PDF des pages A4 déjà composées : le processus
+principal ne fait que les concaténer.
+
+Usage :
+    python evs_report.py --countries FR,DE,IT,ES --out rapport.pdf
+    python evs_report.py --countries FR,DE --out rapport_png/ --workers 8
+    python evs_report.py --countries FR,DE --aggregates evs_aggregates.json.gz --out rapport.pdf
+    python evs_report.py --countries FR,DE,IT --weight-col Weight --out rapport_pondere.pdf
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from io import BytesIO
+
+import numpy as np
+from matplotlib.figure import Figure
+from PIL import Image
+
+from evs_stats_core import (
+    COUNTRY_NAMES, THEMES, WEIGHT_COL,
+    load_dataset, load_aggregates, RowBackend, CountsBackend, SqlBackend,
+)
+from evs_figures import (
+    figure_png, stats_bar_chart, distribution_pct_chart, distribution_volume_chart, heatmap_chart,
+)
+
+A4_PORTRAIT = (8.27, 11.69)
+
+
+# ─── CONTENU DU RAPPORT ──────────────────────────────────────────────────────
+def report_plan(backend, codes, show_ci=False, show_n=True, sort_bars=True):
+    """Pages du rapport : [(titre, [(clé, fonction evs_figures, arguments)])].
+
+    Les arguments ne contiennent que des agrégats : ils sont envoyés tels
+    quels aux workers.
+    """
+    pages = []
+    for t, (theme, theme_vars) in enumerate(THEMES.items()):
+        for v, (var_label, (col, scale)) in enumerate(theme_vars.items()):
+            if not backend.has_variable(col):
+                continue
+            stats = backend.stats(col, codes)
+            if stats.empty:
+                continue
+            pivot, pivot_pct = backend.distribution(col, codes)
+            if sort_bars:
+                # Même ordre que l'onglet 1 : barres triées par moyenne
+                stats = stats.sort_values('Moyenne', ascending=True)
+                order = stats['Pays'].tolist()[::-1]
+                pivot, pivot_pct = pivot.loc[order], pivot_pct.loc[order]
+            key = f"{t + 1:02d}-{v + 1:02d}_{_slug(var_label)}"
+            pages.append((f"{_plain(theme)} — {var_label}\n{scale}", [
+                (f"{key}_moyennes", stats_bar_chart, (stats, var_label, show_ci, show_n)),
+                (f"{key}_distribution_pct", distribution_pct_chart, (pivot_pct, var_label)),
+                (f"{key}_distribution_volume", distribution_volume_chart, (pivot, var_label)),
+            ]))
+
+    for t, (theme, theme_vars) in enumerate(THEMES.items()):
+        columns = {label: col for label, (col, _) in theme_vars.items() if backend.has_variable(col)}
+        means = backend.means(columns, codes).dropna(how='all') if columns else None
+        if means is None or means.empty:
+            continue
+        # Onglet 2 : z-score par variable si au moins deux pays
+        if len(means) > 1:
+            means, cmap_label = (means - means.mean()) / means.std(), "Score standardisé"
+        else:
+            cmap_label = "Moyenne brute"
+        key = f"{len(THEMES) + t + 1:02d}_heatmap_{_slug(theme)}"
+        pages.append((f"{_plain(theme)} — comparaison pays × variables",
+                      [(key, heatmap_chart, (means, cmap_label, True))]))
+    return pages
+
+
+def _plain(text):
+    """Texte sans émojis (absents des polices du PDF)."""
+    return re.sub(r'[\U00010000-\U0010FFFF\uFE0F]', '', text).strip()
+
+
+def _slug(text):
+    return re.sub(r'[^0-9A-Za-z]+', '_', text).strip('_').lower()[:60] or 'x'
+
+
+# ─── RENDU EN PARALLÈLE ──────────────────────────────────────────────────────
+# Fonctions exécutées dans les workers (niveau module : sérialisables)
+def _render_chart(task, dpi):
+    key, chart, args = task
+    return key, figure_png(chart(*args), dpi=dpi)
+
+
+def _render_page(page, dpi):
+    """Page A4 composée (JPEG) : titre puis graphiques empilés, hauteurs proportionnelles."""
+    title, tasks = page
+    images = [np.asarray(Image.open(BytesIO(png)).convert('RGB'))
+              for _, png in (_render_chart(task, dpi) for task in tasks)]
+    fig = Figure(figsize=A4_PORTRAIT)
+    fig.patch.set_facecolor('white')
+    fig.suptitle(title, fontsize=11, fontweight='bold', color='#1A1A2E')
+    ratios = [img.shape[0] / img.shape[1] for img in images]
+    axes = fig.subplots(len(images), 1, squeeze=False,
+                        gridspec_kw={'height_ratios': ratios, 'top': 0.93, 'bottom': 0.03,
+                                     'left': 0.04, 'right': 0.96, 'hspace': 0.08})
+    for ax, img in zip(axes[:, 0], images):
+        ax.imshow(img)
+        ax.set_axis_off()
+    return _page_jpeg(fig, dpi)
+
+
+def _page_jpeg(fig, dpi):
+    buffer = BytesIO()
+    fig.savefig(buffer, format='jpeg', dpi=dpi, pil_kwargs={'quality': 90})
+    return buffer.getvalue()
+
+
+def render_parallel(func, items, workers=None, dpi=150):
+    """[func(item, dpi)] dans l'ordre, sur `workers` processus (1 = dans ce processus)."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [func(item, dpi) for item in items]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items, [dpi] * len(items)))
+
+
+# ─── SORTIES ─────────────────────────────────────────────────────────────────
+def write_pngs(pages, out_dir, workers=None, dpi=150):
+    """Un PNG par graphique dans `out_dir` ; renvoie le nombre de fichiers."""
+    tasks = [task for _, page_tasks in pages for task in page_tasks]
+    os.makedirs(out_dir, exist_ok=True)
+    for key, png in render_parallel(_render_chart, tasks, workers, dpi):
+        with open(os.path.join(out_dir, f"{key}.png"), 'wb') as f:
+            f.write(png)
+    return len(tasks)
+
+
+def _cover_page(backend, codes):
+    fig = Figure(figsize=A4_PORTRAIT)
+    fig.patch.set_facecolor('white')
+    sizes = backend.n_respondents(codes)
+    fig.text(0.08, 0.88, "EVS / WVS 2017-2022", fontsize=24, fontweight='bold', color='#1A1A2E')
+    fig.text(0.08, 0.84, f"Dossier comparatif · {len(codes)} pays · {date.today():%d/%m/%Y}",
+             fontsize=12, color='#555')
+    if backend.weight_col:
+        fig.text(0.08, 0.815, f"Statistiques pondérées (« {backend.weight_col} ») · n eff. = effectif efficace",
+                 fontsize=10, color='#555')
+    lines = [f"{c} – {COUNTRY_NAMES.get(c, c)} : {sizes[c]:,} répondants" for c in codes]
+    fig.text(0.08, 0.78, "\n".join(lines[:60]), fontsize=9, va='top', color='#333', linespacing=1.6)
+    return fig
+
+
+def write_pdf(pages, path, backend, codes, workers=None, dpi=150):
+    """PDF multi-pages : couverture puis une page par variable et par heatmap de thème.
+
+    Les pages arrivent des workers en JPEG ; Pillow les concatène sans
+    repasser par matplotlib. Renvoie le nombre de pages.
+    """
+    jpegs = [_page_jpeg(_cover_page(backend, codes), dpi)]
+    jpegs += render_parallel(_render_page, pages, workers, dpi)
+    images = [Image.open(BytesIO(jpeg)) for jpeg in jpegs]
+    images[0].save(path, 'PDF', save_all=True, append_images=images[1:], resolution=dpi)
+    return len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapport PDF / PNG de toutes les variables pour une liste de pays")
+    parser.add_argument('--countries', required=True, help="Codes pays séparés par des virgules (ex. FR,DE,IT)")
+    parser.add_argument('--out', default='rapport_evs.pdf', help="Fichier .pdf, sinon dossier de PNG")
+    parser.add_argument('--data', help="CSV ou ZIP local (défaut : release GitHub)")
+    parser.add_argument('--aggregates', help="Artefact evs_build_aggregates.py")
+    parser.add_argument('--database', help="Base SQL evs_build_database.py")
+    parser.add_argument('--weight-col', help=f"Colonne de poids : statistiques pondérées (ex. {WEIGHT_COL})")
+    parser.add_argument('--workers', type=int, help="Processus de rendu (défaut : nombre de cœurs)")
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--ci', action='store_true', help="Intervalles de confiance à 95 %%")
+    parser.add_argument('--no-n', action='store_true', help="Masquer N répondants")
+    parser.add_argument('--no-sort', action='store_true', help="Barres dans l'ordre alphabétique")
+    args = parser.parse_args()
+
+    print("📥 Chargement des données…")
+    if args.aggregates:
+        backend = CountsBackend(load_aggregates(args.aggregates))
+    elif args.database:
+        backend = SqlBackend(args.database)
+    else:
+        df_full = load_dataset(args.data)
+        if args.weight_col and args.weight_col not in df_full.columns:
+            raise SystemExit(f"Colonne de poids absente du dataset : {args.weight_col}")
+        backend = RowBackend(df_full, args.weight_col)
+
+    codes = sorted({c.strip().upper() for c in args.countries.split(',') if c.strip()})
+    unknown = [c for c in codes if not backend.n_respondents([c])[c]]
+    if unknown:
+        raise SystemExit(f"Pays absents du dataset : {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    pages = report_plan(backend, codes, args.ci, not args.no_n, not args.no_sort)
+    print(f"🧮 Agrégats de {len(pages)} pages : {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    if args.out.lower().endswith('.pdf'):
+        count = f"{write_pdf(pages, args.out, backend, codes, args.workers, args.dpi)} pages"
+    else:
+        count = f"{write_pngs(pages, args.out, args.workers, args.dpi)} PNG"
+    print(f"✅ {args.out} : {count} en {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,24 +5,56 @@ Application Streamlit pour statistiques comparatives agrégées
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.colors import LinearSegmentedColormap
 import requests 
-from io import BytesIO 
-import zipfile     
+import os
 import warnings
+from functools import partial
+from streamlit.errors import StreamlitAPIException
 warnings.filterwarnings("ignore")
 
-@st.cache_data(show_spinner=False)
+from evs_stats_core import (
+    DATA_URL, THEMES, COUNTRY_NAMES, WEIGHT_COL,
+    read_csv_zip, sanitize_missing_codes, flat_variables, stratified_sample,
+    microdata_columns, microdata_bytes, ColumnCatalog, CATALOG_MAX_DISTINCT,
+    RowBackend, CountsBackend, load_aggregates, SqlBackend,
+    PartitionBackend, MultiWaveBackend, load_manifest,
+    PAIRWISE_TESTS, CORRECTIONS, is_binary_scale, pairwise_tests, scale_bounds,
+    DIVERGENCES, distribution_divergence, polarisation_index,
+    COMPOSITE_THEME, COMPOSITE_SCALE, COMPOSITE_PRESETS, composite_column, composite_label,
+)
+from evs_cache import cached, cache_stats, start_warmup, forget_warmup
+from evs_permalink import TOGGLES, WEIGHTED_PARAM, parse_view, parse_view_url, view_params
+from evs_figures import (
+    figure_png, stats_bar_chart, distribution_pct_chart, distribution_volume_chart,
+    heatmap_chart, heatmap_tiles, significance_chart, divergence_chart, profile_chart, value_counts_chart, histogram_chart,
+)
+
+# Mode agrégats seuls : chemin de l'artefact produit par evs_build_aggregates.py
+AGGREGATES_PATH = os.environ.get("EVS_AGGREGATES", "")
+# Fichier local (CSV) à la place de la release GitHub : développement, tests de charge
+DATA_PATH = os.environ.get("EVS_DATA_PATH", "")
+# Base SQL embarquée (evs_build_database.py) : SQLite, ou DuckDB si le fichier finit par .duckdb
+DATABASE_PATH = os.environ.get("EVS_DATABASE", "")
+# Dataset partitionné par vague × pays (evs_build_partitions.py) : plusieurs vagues, lecture à la demande
+PARTITIONS_PATH = os.environ.get("EVS_PARTITIONS", "")
+# Colonne des poids d'enquête (mode pondéré proposé si elle existe dans les lignes répondants)
+WEIGHT_COLUMN = os.environ.get("EVS_WEIGHT_COL", WEIGHT_COL)
+# Préchauffage des agrégats en arrière-plan pendant le choix des pays (EVS_WARMUP=0 pour désactiver)
+WARMUP_ENABLED = os.environ.get("EVS_WARMUP", "1") != "0"
+WARMUP_WORKERS = int(os.environ.get("EVS_WARMUP_WORKERS", "4"))
+# Affichage progressif : résultats d'un échantillon stratifié par pays, puis résultats exacts
+# (lignes répondants seulement ; EVS_PROGRESSIVE=0 pour désactiver par défaut)
+PROGRESSIVE_DEFAULT = os.environ.get("EVS_PROGRESSIVE", "1") != "0"
+SAMPLE_FRACTION = float(os.environ.get("EVS_SAMPLE_FRACTION", "0.1"))
+# Permaliens à préchauffer (un lien ou une chaîne « ?c=…&var=… » par ligne), ex. ceux d'une newsletter
+WARM_LINKS_PATH = os.environ.get("EVS_WARM_LINKS", "")
+
 def load_data_from_github():
     """Télécharge et décompresse le CSV depuis GitHub Release (fichier ZIP)"""
     
-    url = "https://github.com/felixat13/evs_stats/releases/download/v1.0/data_evs_mapped.csv.zip"
-    
     try:
         st.info("📥 Téléchargement des données...")
-        response = requests.get(url, timeout=60)
+        response = requests.get(DATA_URL, timeout=60)
         
         if response.status_code != 200:
             st.error(f"Erreur HTTP {response.status_code}")
@@ -30,19 +62,16 @@ def load_data_from_github():
         
         st.info("📦 Décompression...")
         
-        # Décompresser le ZIP
-        with zipfile.ZipFile(BytesIO(response.content)) as z:
-            # Trouver le fichier CSV dans le ZIP
-            csv_files = [f for f in z.namelist() if f.endswith('.csv') and not f.startswith('__MACOSX')]
-            
-            if not csv_files:
-                st.error("Aucun fichier CSV trouvé dans le ZIP")
-                st.stop()
-            
-            # Lire le premier CSV trouvé
-            with z.open(csv_files[0]) as csvfile:
-                df = pd.read_csv(csvfile)
+        # Décompresser le ZIP et lire le premier CSV trouvé
+        try:
+            df = read_csv_zip(response.content)
+        except FileNotFoundError as e:
+            st.error(str(e))
+            st.stop()
         
+        # Codes de non-réponse (-1 à -5) → NaN, une seule fois
+        df = sanitize_missing_codes(df)
+
         st.success(f"✅ {len(df):,} lignes chargées")
         return df
         
@@ -443,118 +472,482 @@ table td div {
 </style>
 """, unsafe_allow_html=True)
 
-# ─── VARIABLES THÉMATIQUES ───────────────────────────────────────────────────
-THEMES = {
-    "😊 Bien-être": {
-        "Satisfaction de vie": ("Satisfaction with your life", "1=Insatisfait → 10=Satisfait"),
-        "Bonheur": ("Feeling of happiness", "1=Très heureux → 4=Pas du tout heureux"),
-        "Santé subjective": ("State of health (subjective)", "1=Très bonne → 5=Très mauvaise"),
-        "Liberté de choix": ("How much freedom of choice and control", "1=Aucune → 10=Totale"),
-    },
-    "🤝 Confiance": {
-        "Confiance générale": ("Most people can be trusted", "1=Oui → 2=Non (% qui font confiance)"),
-        "Confiance: Famille": ("How much you trust: Your family (B)", "1=Totale → 4=Aucune"),
-        "Confiance: Voisinage": ("Trust: Your neighborhood (B)", "1=Totale → 4=Aucune"),
-        "Confiance: Inconnus": ("Trust: People you meet for the first time (B)", "1=Totale → 4=Aucune"),
-        "Confiance: Autre religion": ("Trust: People of another religion (B)", "1=Totale → 4=Aucune"),
-        "Confiance: Autre nationalité": ("Trust: People of another nationality (B)", "1=Totale → 4=Aucune"),
-    },
-    "🏛️ Institutions & Démocratie": {
-        "Importance démocratie": ("Importance of democracy", "1=Pas important → 10=Essentiel"),
-        "Qualité démocratie nationale": ("Democraticness in own country", "1=Non démocratique → 10=Complètement"),
-        "Satisfaction système politique": ("Satisfaction with the political system", "1=Très satisfait → 4=Pas du tout"),
-        "Confiance: Gouvernement": ("Confidence: The Government", "1=Beaucoup → 4=Aucune"),
-        "Confiance: Parlement": ("Confidence: Parliament", "1=Beaucoup → 4=Aucune"),
-        "Confiance: Police": ("Confidence: The Police", "1=Beaucoup → 4=Aucune"),
-        "Confiance: Justice": ("Confidence: Justice System/Courts", "1=Beaucoup → 4=Aucune"),
-        "Confiance: Presse": ("Confidence: The Press", "1=Beaucoup → 4=Aucune"),
-        "Confiance: UE": ("Confidence: The European Union", "1=Beaucoup → 4=Aucune"),
-    },
-    "📣 Politique": {
-        "Intérêt politique": ("Interest in politics", "1=Très intéressé → 4=Pas du tout"),
-        "Échelle politique (Gauche-Droite)": ("Self positioning in political scale", "1=Gauche → 10=Droite"),
-        "Égalité des revenus": ("Income equality", "1=Égalité totale → 10=Inégalité totale"),
-        "Rôle de l'État": ("Government responsibility", "1=État → 10=Individu"),
-        "Pétition": ("Political action: signing a petition", "1=Déjà fait → 3=Jamais"),
-        "Manifestation": ("Political action: attending lawful/peaceful demonstrations", "1=Déjà fait → 3=Jamais"),
-    },
-    "🙏 Religion": {
-        "Importance de Dieu": ("How important is God in your life", "1=Pas important → 10=Très important"),
-        "Pratique religieuse": ("How often do you attend religious services", "1=+ d'une fois/sem → 7=Jamais"),
-        "Prière": ("How often do you pray (WVS7)", "1=Plusieurs fois/j → 8=Jamais"),
-        "Se dit religieux": ("Religious person", "1=Religieux → 3=Athée convaincu"),
-        "Croyance: Dieu": ("Believe in: God", "0=Non → 1=Oui (% croyants)"),
-        "Croyance: Au-delà": ("Believe in: life after death", "0=Non → 1=Oui"),
-    },
-    "👥 Valeurs sociales": {
-        "Homophobie (homosexualité justifiable)": ("Justifiable: Homosexuality", "1=Jamais → 10=Toujours"),
-        "Avortement (justifiable)": ("Justifiable: Abortion", "1=Jamais → 10=Toujours"),
-        "Divorce (justifiable)": ("Justifiable: Divorce", "1=Jamais → 10=Toujours"),
-        "Euthanasie (justifiable)": ("Justifiable: Euthanasia", "1=Jamais → 10=Toujours"),
-        "Leaders politiques hommes": ("Men make better political leaders than women do", "1=Fortement d'accord → 4=Pas du tout"),
-        "Dirigeants d'entreprise hommes": ("Men make better business executives than women do", "1=Fortement d'accord → 4=Pas du tout"),
-        "Impact immigration": ("Evaluate the impact of immigrants on the development of [your country]", "1=Positif → 3=Négatif (dans certains pays)"),
-    },
-    "👨‍👩‍👧 Famille & Travail": {
-        "Importance famille": ("Important in life: Family", "1=Très important → 4=Pas du tout"),
-        "Importance travail": ("Important in life: Work", "1=Très important → 4=Pas du tout"),
-        "Importance religion": ("Important in life: Religion", "1=Très important → 4=Pas du tout"),
-        "Importance politique": ("Important in life: Politics", "1=Très important → 4=Pas du tout"),
-        "Importance amis": ("Important in life: Friends", "1=Très important → 4=Pas du tout"),
-        "Le travail avant tout": ("Work should come first even if it means less spare time", "1=D'accord → 5=Pas d'accord"),
-    },
+# ─── CHARGEMENT DONNÉES ──────────────────────────────────────────────────────
+# Le dataset n'est lu qu'une fois (cache 'dataset' de evs_cache) : pas de
+# seconde copie sérialisée par st.cache_data. Backends pondéré et non pondéré,
+# échantillon et catalogue sont construits sur ce même DataFrame.
+def load_data(path):
+    return sanitize_missing_codes(pd.read_csv(path))
+
+@cached('dataset')
+def load_frame(data_path):
+    """Lignes répondants : fichier local, sinon release GitHub (téléchargée une fois)."""
+    return load_data(data_path) if data_path else load_data_from_github()
+
+@cached('dataset')
+def load_backend(aggregates_path, data_path, database_path="", weight_col=""):
+    """Backend d'agrégation : artefact de volumes, base SQL, sinon lignes répondants.
+
+    `weight_col` : statistiques pondérées (lignes répondants seulement, et si
+    la colonne existe). Seul le moteur de comptage diffère du backend non
+    pondéré : le DataFrame (load_frame) est partagé.
+    """
+    if aggregates_path:
+        return CountsBackend(load_aggregates(aggregates_path))
+    if database_path:
+        if not os.path.exists(database_path):
+            raise FileNotFoundError(database_path)
+        return SqlBackend(database_path)
+    df_full = load_frame(data_path)
+    return RowBackend(df_full, weight_col if weight_col in df_full.columns else None)
+
+@cached('dataset')
+def load_sample_frame(data_path, fraction):
+    """Échantillon stratifié par pays des lignes répondants (affichage progressif)."""
+    return stratified_sample(load_frame(data_path), fraction)
+
+@cached('dataset')
+def load_sample_backend(data_path, weight_col, fraction):
+    return RowBackend(load_sample_frame(data_path, fraction), weight_col or None)
+
+@cached('dataset')
+def load_catalog(data_path):
+    """Catalogue de toutes les colonnes des lignes répondants (indépendant de la pondération)."""
+    return ColumnCatalog.from_frame(load_frame(data_path))
+
+@cached('dataset')
+def load_partition_manifest(partitions_path):
+    return load_manifest(partitions_path)
+
+@cached('dataset')
+def load_wave_backend(partitions_path, wave, weight_col=""):
+    """Backend d'une vague : manifeste seulement, partitions pays lues à la demande."""
+    manifest = load_partition_manifest(partitions_path)
+    weighted = weight_col in manifest['waves'][wave]['columns']
+    return PartitionBackend(partitions_path, wave, manifest, weight_col if weighted else None)
+
+# ─── AGRÉGATS EN CACHE ───────────────────────────────────────────────────────
+# Clés : version du backend + arguments (pays triés) ; limites dans evs_cache.CACHE_POLICY
+@cached('aggregates')
+def get_stats(backend, col_name, codes):
+    return backend.stats(col_name, list(codes))
+
+@cached('aggregates')
+def get_distribution(backend, col_name, codes):
+    return backend.distribution(col_name, list(codes))
+
+@cached('aggregates')
+def get_means(backend, columns, codes):
+    return backend.means(columns, list(codes))
+
+@cached('aggregates')
+def get_pooled_mean(backend, col_name, codes):
+    return backend.pooled_mean(col_name, list(codes))
+
+@cached('aggregates')
+def get_value_counts(backend, col_name, code):
+    return backend.value_counts(col_name, code)
+
+def sorted_stats(backend, col_name, codes, sort_bars):
+    stats = get_stats(backend, col_name, codes)
+    return stats.sort_values('Moyenne', ascending=True) if sort_bars else stats
+
+@cached('aggregates')
+def get_heatmap_matrix(backend, columns, codes, normalize, cluster):
+    """Matrice pays × variables de l'onglet 2 (z-score et clustering optionnels)."""
+    heatmap_df = get_means(backend, columns, codes).dropna(how='all')
+    # Normaliser chaque variable (z-score) pour comparer sur même échelle
+    if normalize:
+        heatmap_df = (heatmap_df - heatmap_df.mean()) / heatmap_df.std()
+    if cluster:
+        from scipy.cluster.hierarchy import linkage, leaves_list
+        df_clean = heatmap_df.dropna()
+        if len(df_clean) > 2:
+            Z = linkage(df_clean.values, method='ward')
+            heatmap_df = df_clean.iloc[leaves_list(Z)]
+    return heatmap_df
+
+@cached('aggregates')
+def get_pairwise(backend, col_name, codes, test, correction, scale):
+    """Onglet 3 : (écarts, p-valeurs corrigées) pays × pays, pays classés par moyenne."""
+    stats = get_stats(backend, col_name, codes).sort_values('Moyenne', ascending=False)
+    return pairwise_tests(stats, test, correction, scale)
+
+@cached('aggregates')
+def get_divergence(backend, col_name, codes, method):
+    """Divergence de toutes les paires de pays, ordonnée du plus polarisé au plus consensuel."""
+    pivot, _ = get_distribution(backend, col_name, codes)
+    order = get_polarisation(backend, col_name, codes, None).sort_values(ascending=False).index
+    return distribution_divergence(pivot, method).loc[order, order]
+
+@cached('aggregates')
+def get_polarisation(backend, col_name, codes, bounds):
+    pivot, _ = get_distribution(backend, col_name, codes)
+    return polarisation_index(pivot, bounds)
+
+@cached('aggregates')
+def get_profile(backend, focus_code, codes, variables):
+    """Onglet 4 : moyennes du pays analysé vs autres pays sélectionnés."""
+    focus_country = COUNTRY_NAMES.get(focus_code, focus_code)
+    other_codes = [c for c in codes if c != focus_code]
+    profile_rows = []
+    for label, col in variables.items():
+        if backend.has_variable(col):
+            val_focus = get_pooled_mean(backend, col, (focus_code,))
+            val_others = get_pooled_mean(backend, col, tuple(other_codes))
+            profile_rows.append({
+                'Variable': label,
+                focus_country: round(val_focus, 3),
+                'Autres pays (moy.)': round(val_others, 3),
+                'Écart': round(val_focus - val_others, 3),
+            })
+    return pd.DataFrame(profile_rows)
+
+# ─── GRAPHIQUES EN CACHE (PNG) ───────────────────────────────────────────────
+@cached('figures')
+def stats_chart_png(backend, col_name, codes, var_label, sort_bars, show_ci, show_n):
+    stats = sorted_stats(backend, col_name, codes, sort_bars)
+    return figure_png(stats_bar_chart(stats, var_label, show_ci, show_n))
+
+@cached('figures')
+def distribution_pngs(backend, col_name, codes, var_label, sort_bars):
+    pivot, pivot_pct = get_distribution(backend, col_name, codes)
+    if sort_bars:
+        order = sorted_stats(backend, col_name, codes, sort_bars)['Pays'].tolist()[::-1]
+        pivot, pivot_pct = pivot.loc[order], pivot_pct.loc[order]
+    return (figure_png(distribution_pct_chart(pivot_pct, var_label)),
+            figure_png(distribution_volume_chart(pivot, var_label)))
+
+@cached('figures')
+def heatmap_png(backend, columns, codes, normalize, cluster, annotate, tile):
+    """Tuile `tile` (voir heatmap_tiles) de la matrice, échelle de couleurs commune."""
+    matrix = get_heatmap_matrix(backend, columns, codes, normalize, cluster)
+    values = matrix.to_numpy(dtype=float)
+    limits = (np.nanmin(values), np.nanmax(values)) if np.isfinite(values).any() else None
+    tiles = heatmap_tiles(len(matrix))
+    start, stop = tiles[tile]
+    part = matrix.iloc[start:stop]
+    title = "Comparaison pays × variables"
+    if len(tiles) > 1:
+        title += f" — pays {start + 1} à {stop} sur {len(matrix)}"
+    cmap_label = "Score standardisé" if normalize else "Moyenne brute"
+    return figure_png(heatmap_chart(part, cmap_label, annotate, limits, title))
+
+@cached('figures')
+def significance_png(backend, col_name, codes, test, correction, scale, alpha, var_label):
+    diff, pvalues = get_pairwise(backend, col_name, codes, test, correction, scale)
+    title = f"{var_label} — {PAIRWISE_TESTS[test]}, {CORRECTIONS[correction]}, α = {alpha:g}"
+    return figure_png(significance_chart(diff, pvalues, alpha, title))
+
+@cached('figures')
+def divergence_png(backend, col_name, codes, method, var_label):
+    return figure_png(divergence_chart(get_divergence(backend, col_name, codes, method), DIVERGENCES[method],
+                                       f"Divergence des distributions — {var_label}"))
+
+@cached('figures')
+def profile_png(backend, focus_code, codes, variables):
+    focus_country = COUNTRY_NAMES.get(focus_code, focus_code)
+    return figure_png(profile_chart(get_profile(backend, focus_code, codes, variables), focus_country))
+
+@cached('figures')
+def value_counts_png(backend, col_name, code, var_label, continuous):
+    value_counts = get_value_counts(backend, col_name, code)
+    chart = histogram_chart if continuous else value_counts_chart
+    return figure_png(chart(value_counts, var_label))
+
+# ─── EXPORTS EN CACHE ────────────────────────────────────────────────────────
+def stats_display_table(backend, col_name, codes):
+    stats = get_stats(backend, col_name, codes)
+    # Mode pondéré : effectif efficace à côté de N
+    columns = ['Pays', 'N', *(['N effectif'] if 'N effectif' in stats else []), 'Moyenne', 'Médiane', 'Écart-type']
+    display_stats = stats[columns].copy()
+    display_stats['N'] = display_stats['N'].astype(int)
+    if 'N effectif' in display_stats:
+        display_stats['N effectif'] = display_stats['N effectif'].round().astype(int)
+    display_stats['Moyenne'] = display_stats['Moyenne'].round(3)
+    display_stats['Médiane'] = display_stats['Médiane'].round(1)
+    display_stats['Écart-type'] = display_stats['Écart-type'].round(3)
+    return display_stats.sort_values('Moyenne', ascending=False).reset_index(drop=True)
+
+@cached('exports')
+def stats_csv(backend, col_name, codes):
+    return stats_display_table(backend, col_name, codes).to_csv(index=False).encode('utf-8')
+
+@cached('exports')
+def table_exports(backend, columns, codes, sort_col):
+    """Onglet 3 : (CSV, Excel ou None) du tableau comparatif trié."""
+    table_df = sorted_table(backend, columns, codes, sort_col)
+    csv_t = table_df.to_csv().encode('utf-8')
+    try:
+        import io
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            table_df.to_excel(writer, sheet_name='Comparaison')
+        return csv_t, buffer.getvalue()
+    except ImportError:
+        return csv_t, None
+
+def sorted_table(backend, columns, codes, sort_col):
+    table_df = get_means(backend, columns, codes).round(3)
+    if sort_col == "(Pays)":
+        return table_df.sort_index()
+    return table_df.sort_values(sort_col, ascending=False)
+
+@cached('exports')
+def profile_csv(backend, focus_code, codes, variables):
+    focus_country = COUNTRY_NAMES.get(focus_code, focus_code)
+    profile_df = get_profile(backend, focus_code, codes, variables)
+    profile_display = profile_df[['Variable', focus_country, 'Autres pays (moy.)', 'Écart']]
+    return profile_display.to_csv(index=False).encode('utf-8')
+
+def volume_value(count):
+    """Volume affiché : entier, ou poids cumulé arrondi en mode pondéré."""
+    count = float(count)
+    return int(count) if count.is_integer() else round(count, 1)
+
+@cached('exports')
+def country_profile_csv(backend, code, theme_vars):
+    """Onglet 5 : une ligne par variable × valeur de réponse du thème."""
+    export_rows = []
+    for var_lbl, (col, scale) in theme_vars.items():
+        if backend.has_variable(col):
+            value_counts_exp = get_value_counts(backend, col, code)
+            n_exp = value_counts_exp.sum()
+            if n_exp > 0:
+                # Une ligne par valeur possible
+                for val, count in value_counts_exp.items():
+                    export_rows.append({
+                        'Variable': var_lbl,
+                        'Échelle': scale,
+                        'Valeur': val,
+                        'Volume': volume_value(count),
+                        'Pourcentage': f"{(count / n_exp) * 100:.2f}%"
+                    })
+    if not export_rows:
+        return None
+    return pd.DataFrame(export_rows).to_csv(index=False).encode('utf-8')
+
+# Radar-like (onglet 4) : comparaison sur variables-clés
+KEY_PROFILE_VARS = {
+    "Satisfaction vie": "Satisfaction with your life",
+    "Bonheur": "Feeling of happiness",
+    "Confiance générale": "Most people can be trusted",
+    "Intérêt politique": "Interest in politics",
+    "Importance démocratie": "Importance of democracy",
+    "Importance Dieu": "How important is God in your life",
+    "Homosexualité justifiable": "Justifiable: Homosexuality",
+    "Importance famille": "Important in life: Family",
+    "Confiance gouvernement": "Confidence: The Government",
 }
 
-# Noms complets des pays
-COUNTRY_NAMES = {
-    'AL': 'Albanie', 'AM': 'Arménie', 'AT': 'Autriche', 'AZ': 'Azerbaïdjan',
-    'BA': 'Bosnie', 'BE': 'Belgique', 'BG': 'Bulgarie', 'BY': 'Biélorussie',
-    'CH': 'Suisse', 'CY': 'Chypre', 'CZ': 'Tchéquie', 'DE': 'Allemagne',
-    'DK': 'Danemark', 'EE': 'Estonie', 'ES': 'Espagne', 'FI': 'Finlande',
-    'FR': 'France', 'GB': 'Royaume-Uni', 'GE': 'Géorgie', 'GR': 'Grèce',
-    'HR': 'Croatie', 'HU': 'Hongrie', 'IE': 'Irlande', 'IS': 'Islande',
-    'IT': 'Italie', 'LT': 'Lituanie', 'LU': 'Luxembourg', 'LV': 'Lettonie',
-    'ME': 'Monténégro', 'MK': 'Macédoine', 'MT': 'Malte', 'NL': 'Pays-Bas',
-    'NO': 'Norvège', 'PL': 'Pologne', 'PT': 'Portugal', 'RO': 'Roumanie',
-    'RS': 'Serbie', 'RU': 'Russie', 'SE': 'Suède', 'SI': 'Slovénie',
-    'SK': 'Slovaquie', 'TR': 'Turquie', 'UA': 'Ukraine',
-    # WVS
-    'AR': 'Argentine', 'AU': 'Australie', 'BD': 'Bangladesh', 'BO': 'Bolivie',
-    'BR': 'Brésil', 'CA': 'Canada', 'CL': 'Chili', 'CN': 'Chine',
-    'CO': 'Colombie', 'EC': 'Équateur', 'EG': 'Égypte', 'ET': 'Éthiopie',
-    'GT': 'Guatemala', 'ID': 'Indonésie', 'IN': 'Inde', 'IQ': 'Irak',
-    'IR': 'Iran', 'JP': 'Japon', 'KE': 'Kenya', 'KR': 'Corée du Sud',
-    'KZ': 'Kazakhstan', 'LB': 'Liban', 'LY': 'Libye', 'MA': 'Maroc',
-    'MM': 'Myanmar', 'MX': 'Mexique', 'NG': 'Nigeria', 'NI': 'Nicaragua',
-    'NZ': 'Nouvelle-Zélande', 'PH': 'Philippines', 'PK': 'Pakistan',
-    'PR': 'Porto Rico', 'PW': 'Palaos', 'QA': 'Qatar', 'SG': 'Singapour',
-    'TH': 'Thaïlande', 'TJ': 'Tadjikistan', 'TN': 'Tunisie', 'TW': 'Taïwan',
-    'TZ': 'Tanzanie', 'US': 'États-Unis', 'UZ': 'Ouzbékistan',
-    'VN': 'Vietnam', 'ZA': 'Afrique du Sud', 'ZW': 'Zimbabwe',
-    'AD': 'Andorre', 'KG': 'Kirghizistan', 'MN': 'Mongolie',
-}
+# ─── INDICES COMPOSITES ──────────────────────────────────────────────────────
+def composite_variables(backend, definitions):
+    """Indices composites calculables sur ce backend : libellé → (colonne, échelle).
+
+    Chaque indice est calculé une fois par définition dans le backend (lignes
+    répondants nécessaires : indisponible en mode agrégats).
+    """
+    variables = {}
+    if not backend.row_level:
+        return variables
+    for name, items in definitions.items():
+        col = composite_column(name, items)
+        if backend.add_composite(col, items):
+            variables[composite_label(name)] = (col, COMPOSITE_SCALE)
+    return variables
+
+# Colonnes du catalogue proposées par une recherche (onglet 1) ou détaillées (onglet 5)
+CATALOG_SEARCH_LIMIT = 200
+CATALOG_DETAIL_LIMIT = 20
+
+def catalog_variables(catalog, query, limit=CATALOG_SEARCH_LIMIT):
+    """Colonnes numériques dont le nom contient `query` : libellé → (colonne, échelle).
+
+    Les colonnes continues (plus de CATALOG_MAX_DISTINCT valeurs) ne sont pas
+    proposées. Les variables de THEMES gardent leur libellé et leur échelle.
+    """
+    known = {col: (label, scale) for label, (col, scale) in flat_variables().items()}
+    variables = {}
+    for col in catalog.search(query, numeric=True, limit=limit, max_distinct=CATALOG_MAX_DISTINCT):
+        label, scale = known.get(col, (col, catalog.describe(col)))
+        variables[label] = (col, scale)
+    return variables
+
+def profile_variables(composites):
+    """Variables de l'onglet 4 : variables-clés puis indices composites."""
+    return {**KEY_PROFILE_VARS, **{label: col for label, (col, _) in composites.items()}}
+
+# ─── PRÉCHAUFFAGE ────────────────────────────────────────────────────────────
+def warm_default_views(backend, codes):
+    """Vues par défaut de chaque onglet pour une sélection (valeurs initiales des widgets)."""
+    theme, theme_vars = next(iter(THEMES.items()))
+    var_label, (col_name, _) = next(iter(theme_vars.items()))
+    if backend.has_variable(col_name):
+        stats_chart_png(backend, col_name, codes, var_label, True, False, True)
+        distribution_pngs(backend, col_name, codes, var_label, True)
+    available_vars = {k: v for k, (v, _) in flat_variables().items() if backend.has_variable(v)}
+    overview_vars = {k: available_vars[k] for k in list(available_vars)[:15]}
+    if len(overview_vars) >= 2:
+        heatmap_png(backend, overview_vars, codes, True, False, False, 0)
+    available_table = {k: v for k, (v, _) in theme_vars.items() if backend.has_variable(v)}
+    if available_table:
+        table_exports(backend, available_table, codes, "(Pays)")
+    focus_code = min(codes, key=lambda c: COUNTRY_NAMES.get(c, c))
+    profile_png(backend, focus_code, codes, profile_variables(composite_variables(backend, COMPOSITE_PRESETS)))
+    country_profile_csv(backend, focus_code, theme_vars)
+    for var_lbl, (col, _) in theme_vars.items():
+        if backend.has_variable(col):
+            value_counts = get_value_counts(backend, col, focus_code)
+            if len(value_counts):
+                value_counts_png(backend, col, focus_code, var_lbl, len(value_counts) > 15)
+
+def warm_link_view(backend, view):
+    """Vue d'un permalien : graphiques de l'onglet 1 avec ses options, puis vues par défaut."""
+    codes = tuple(c for c, n in backend.n_respondents(view.get('countries', [])).items() if n)
+    if not codes:
+        return
+    if 'var' in view or 'column' in view:
+        # Colonne du catalogue : libellé = nom de colonne, comme dans l'onglet 1
+        var_label = view.get('var', view.get('column'))
+        if 'composite' in view:
+            name, items = view['composite']
+            col_name = composite_column(name, items)
+            backend.add_composite(col_name, items)
+        else:
+            col_name = THEMES[view['theme']][var_label][0] if 'var' in view else var_label
+        if backend.has_variable(col_name):
+            show_n, show_ci, sort_bars = (view.get(name, default) for name, default in TOGGLES.items())
+            stats_chart_png(backend, col_name, codes, var_label, sort_bars, show_ci, show_n)
+            distribution_pngs(backend, col_name, codes, var_label, sort_bars)
+    warm_default_views(backend, codes)
+
+def read_warm_links(path):
+    with open(path, encoding='utf-8') as f:
+        return [parse_view_url(line.strip()) for line in f if line.strip() and not line.startswith('#')]
+
+def warmup_tasks(backend, selections, links=()):
+    """Agrégats de toutes les variables de THEMES, vues par défaut des présélections, permaliens."""
+    columns = {col for col, _ in flat_variables().values() if backend.has_variable(col)}
+    tasks = [partial(backend.warm, col) for col in sorted(columns)]
+    tasks += [partial(warm_default_views, backend, codes) for codes in selections if codes]
+    tasks += [partial(warm_link_view, backend, view) for view in links]
+    return tasks
+
+def warmup_status(warmup):
+    if warmup.finished:
+        failed = f" · ⚠️ {warmup.errors} tâche(s) en échec" if warmup.errors else ""
+        st.caption(f"🔥 Préchargement terminé en {warmup.elapsed:.0f} s{failed}")
+    else:
+        st.progress(warmup.progress, text=f"🔥 Préchargement… {warmup.done}/{warmup.total}")
+
+def refine_status(refine, key):
+    """Calcul exact des vues provisoires : relance la page dès qu'il est terminé.
+
+    Une variable en échec n'est pas relancée : ses onglets passent au backend
+    complet, qui affiche l'erreur.
+    """
+    if refine.finished:
+        failed = st.session_state.setdefault('refine_failed', set())
+        failed.update((key[0], key[2][index]) for index, _ in refine.failures)
+        forget_warmup(key)
+        st.rerun()
+    st.caption(f"⏳ Calcul exact en cours… {refine.done}/{refine.total} variables")
+
+if hasattr(st, "fragment"):
+    # Rafraîchi seul chaque seconde, sans relancer le script entier
+    warmup_status_live = st.fragment(run_every=1)(warmup_status)
+    refine_status_live = st.fragment(run_every=1)(refine_status)
+else:
+    warmup_status_live, refine_status_live = warmup_status, refine_status
+
+# ─── AFFICHAGE PROGRESSIF ────────────────────────────────────────────────────
+# Variables dont l'onglet affiché attend les agrégats exacts (calculés en fin de script)
+refine_columns = set()
+
+
+def view_backend(full, columns):
+    """Backend d'un onglet : `full` si ses agrégats sont prêts, sinon l'échantillon.
+
+    Les variables manquantes sont calculées en arrière-plan puis la page est
+    relancée : les résultats exacts remplacent les résultats provisoires.
+    """
+    if sample_backend is None or full is not backend:
+        return full
+    failed = st.session_state.get('refine_failed', ())
+    pending = [col for col in columns if full.has_variable(col) and not full.warmed(col)
+               and (full.version, col) not in failed]
+    if not pending:
+        return full
+    refine_columns.update(pending)
+    st.caption(f"≈ Résultats provisoires : échantillon stratifié par pays ({SAMPLE_FRACTION:.0%} des "
+               "répondants, N et IC de l'échantillon) · calcul exact en cours")
+    return sample_backend
+
+# ─── SÉLECTION PAR LOT ───────────────────────────────────────────────────────
+NO_PRESET = "— Choisir —"
+
+
+def apply_selection(preset_valid):
+    """Rappel du bouton « Appliquer » : fige les valeurs du formulaire de la sidebar.
+
+    Une présélection choisie remplace la liste des pays, puis revient à
+    « — Choisir — » (action ponctuelle, la liste reste modifiable).
+    """
+    state = st.session_state
+    if state["sel_preset"] in preset_valid:
+        state["sel_countries"] = preset_valid[state["sel_preset"]][:12]
+        state["sel_preset"] = NO_PRESET
+    state["applied_view"] = {
+        'labels': list(state["sel_countries"]),
+        **{name: state[f"sel_{name}"] for name in TOGGLES},
+        'weighted': state.get("sel_weighted", False),
+        'progressive': state.get("sel_progressive", PROGRESSIVE_DEFAULT),
+    }
 
-PALETTE = ['#E63946', '#457B9D', '#2A9D8F', '#E9C46A', '#F4A261',
-           '#264653', '#A8DADC', '#6D6875', '#B5838D', '#FFAFCC',
-           '#80B918', '#FF6B6B', '#4CC9F0', '#F72585', '#7209B7']
-
-# ─── CHARGEMENT DONNÉES ──────────────────────────────────────────────────────
-@st.cache_data(show_spinner=False)
-def load_data(path):
-    return pd.read_csv(path)
 
 # ─── UI SIDEBAR ───────────────────────────────────────────────────────────────
 with st.sidebar:
     st.markdown("### 🌍 EVS/WVS Explorer")
     st.markdown("<div style='font-size:0.75rem;color:#AAB4C8;margin-bottom:1.5rem'>European & World Values Survey<br>2017–2022 · 157 000 répondants</div>", unsafe_allow_html=True)
 
+    # Vue d'un permalien : lue une fois par session, sert de valeurs initiales aux widgets
+    if "permalink_view" not in st.session_state:
+        st.session_state["permalink_view"] = parse_view(
+            st.query_params.to_dict(), {**COMPOSITE_PRESETS, **st.session_state.get("composites", {})})
+    link_view = st.session_state["permalink_view"]
+    # Pondération appliquée (formulaire ci-dessous) : choisit le backend à charger
+    weighted = st.session_state.get("applied_view", {}).get('weighted', link_view.get('weighted', False))
+    weight_col = WEIGHT_COLUMN if weighted else ""
+
     try:
-        with st.spinner("Chargement…"):
-            df_full = load_data_from_github()
-        all_countries_raw = sorted(df_full['Country (ISO 3166-1 Alpha-2 code)'].dropna().unique())
+        if PARTITIONS_PATH:
+            wave_options = list(load_partition_manifest(PARTITIONS_PATH)['waves'])
+            link_waves = [w for w in link_view.get('waves', []) if w in wave_options]
+            chosen_waves = st.multiselect("Vagues", wave_options, default=link_waves or wave_options[-1:])
+            selected_waves = [w for w in wave_options if w in chosen_waves] or wave_options[-1:]
+            wave_backends = {w: load_wave_backend(PARTITIONS_PATH, w, weight_col) for w in selected_waves}
+            # Vague de référence (la plus récente choisie) pour les onglets 3 à 5
+            backend = wave_backends[selected_waves[-1]]
+            # Onglets 1 et 2 : une ligne par pays × vague si plusieurs vagues sont choisies
+            compare_backend = MultiWaveBackend(wave_backends) if len(wave_backends) > 1 else backend
+        else:
+            with st.spinner("Chargement…"):
+                backend = compare_backend = load_backend(AGGREGATES_PATH, DATA_PATH, DATABASE_PATH, weight_col)
+        all_countries_raw = compare_backend.countries()
         all_countries = [f"{c} – {COUNTRY_NAMES.get(c, c)}" for c in all_countries_raw]
         code_map = {f"{c} – {COUNTRY_NAMES.get(c, c)}": c for c in all_countries_raw}
-        st.success(f"✅ {len(df_full):,} réponses · {len(all_countries_raw)} pays")
+        st.success(f"✅ {compare_backend.n_rows:,} réponses · {len(all_countries_raw)} pays")
+        if not backend.row_level:
+            st.caption("⚡ Mode agrégats : données précalculées, aucune ligne répondant chargée")
+        if isinstance(backend, SqlBackend):
+            st.caption(f"🗄️ Base SQL ({backend.engine}) : agrégats calculés par requêtes, données sur disque")
+        if PARTITIONS_PATH:
+            st.caption("🗂️ Partitions vague × pays : seules celles des pays sélectionnés sont lues")
+        if backend.weight_col:
+            st.caption(f"⚖️ Statistiques pondérées par « {backend.weight_col} » · "
+                       "N effectif = (Σ poids)² / Σ poids²")
+        # Catalogue de toutes les colonnes (construit une fois par dataset) : recherche dans les onglets 1 et 5
+        catalog = load_catalog(DATA_PATH) if isinstance(backend, RowBackend) else None
     except FileNotFoundError:
         st.error("Fichier introuvable. Vérifiez le chemin.")
         st.stop()
@@ -581,27 +974,95 @@ with st.sidebar:
         if valid:
             preset_valid[label] = valid
 
-    preset_choice = st.selectbox("Présélection rapide", ["— Choisir —"] + list(preset_valid.keys()))
-
-    default_sel = preset_valid.get(preset_choice, [])
-    if not default_sel:
-        # fallback: 8 premiers pays dispo
-        default_sel = all_countries[:8]
-
-    selected_labels = st.multiselect(
-        "Pays à comparer",
-        options=all_countries,
-        default=[c for c in default_sel if c in all_countries][:12],
-    )
-
-    selected_codes = [code_map[l] for l in selected_labels if l in code_map]
-
-    st.markdown("---")
-    st.markdown("<div class='section-label'>Options</div>", unsafe_allow_html=True)
+    # Progression du préchauffage (lancé en fin de script, voir plus bas)
+    warmup_slot = st.empty()
+
+    # Sélection appliquée (pays + options) : les widgets du formulaire ne
+    # déclenchent aucun rerun, tout est appliqué d'un coup par « Appliquer »
+    if "applied_view" not in st.session_state:
+        # pays du permalien, sinon les 8 premiers pays dispo
+        link_labels = [l for l, c in code_map.items() if c in link_view.get('countries', [])]
+        st.session_state["applied_view"] = {
+            'labels': link_labels or all_countries[:8],
+            **{name: link_view.get(name, default) for name, default in TOGGLES.items()},
+            'weighted': weighted,
+            'progressive': PROGRESSIVE_DEFAULT,
+        }
+        st.session_state["sel_countries"] = st.session_state["applied_view"]['labels']
+        for name in TOGGLES:
+            st.session_state[f"sel_{name}"] = st.session_state["applied_view"][name]
+        st.session_state["sel_weighted"] = weighted
+        st.session_state["sel_progressive"] = PROGRESSIVE_DEFAULT
+    # Pays absents du dataset courant (autres vagues) : retirés de la sélection
+    st.session_state["sel_countries"] = [l for l in st.session_state["sel_countries"] if l in all_countries]
+
+    with st.form("selection_form", border=False):
+        st.selectbox("Présélection rapide", [NO_PRESET] + list(preset_valid.keys()), key="sel_preset",
+                     help="Remplace la liste des pays à l'application")
+        st.multiselect("Pays à comparer", options=all_countries, key="sel_countries")
 
-    show_n = st.toggle("Afficher N répondants", value=True)
-    show_ci = st.toggle("Intervalle de confiance (95%)", value=False)
-    sort_bars = st.toggle("Trier les barres", value=True)
+        st.markdown("---")
+        st.markdown("<div class='section-label'>Options</div>", unsafe_allow_html=True)
+        st.toggle("Afficher N répondants", key="sel_n")
+        st.toggle("Intervalle de confiance (95%)", key="sel_ci")
+        st.toggle("Trier les barres", key="sel_sort")
+        # Poids d'enquête : lignes répondants avec une colonne de poids seulement
+        if backend.has_variable(WEIGHT_COLUMN):
+            st.toggle("Pondérer (poids d'enquête)", key="sel_weighted",
+                      help=f"Moyennes, médianes, IC et distributions pondérés par « {WEIGHT_COLUMN} »")
+        # Échantillon puis résultats exacts : lignes répondants chargées en mémoire seulement
+        if isinstance(backend, RowBackend):
+            st.toggle("Affichage progressif (échantillon puis exact)", key="sel_progressive",
+                      help=f"Premiers résultats sur {SAMPLE_FRACTION:.0%} des répondants de chaque pays, "
+                           "remplacés par les résultats exacts dès qu'ils sont calculés")
+
+        st.form_submit_button("Appliquer", type="primary", use_container_width=True,
+                              on_click=apply_selection, args=(preset_valid,))
+
+    applied = st.session_state["applied_view"]
+    selected_codes = [code_map[l] for l in applied['labels'] if l in code_map]
+    show_n, show_ci, sort_bars = (applied[name] for name in TOGGLES)
+    progressive = isinstance(backend, RowBackend) and applied.get('progressive', PROGRESSIVE_DEFAULT)
+    sample_backend = load_sample_backend(DATA_PATH, backend.weight_col, SAMPLE_FRACTION) if progressive else None
+    st.caption("🔗 L'adresse de la page décrit la vue affichée : copiez-la pour la partager")
+
+    # Indices composites : présélections + indices créés dans la session, utilisables
+    # comme des variables ordinaires dans tous les onglets
+    if backend.row_level:
+        with st.expander("🧮 Indices composites"):
+            flat_vars = flat_variables()
+            index_name = st.text_input("Nom de l'indice", key="composite_name")
+            index_items = st.multiselect("Items", list(flat_vars), key="composite_items")
+            for label in index_items:
+                st.caption(f"{label} : {flat_vars[label][1]}")
+            reversed_items = st.multiselect("Items à inverser (pour que 10 = « plus »)", index_items,
+                                            key="composite_reverse")
+            if st.button("Créer l'indice", disabled=not index_name or len(index_items) < 2):
+                st.session_state.setdefault("composites", {})[index_name.strip()] = tuple(
+                    (flat_vars[label][0], label in reversed_items) for label in index_items)
+            session_composites = st.session_state.get("composites", {})
+            st.caption("Indices : " + ", ".join([*COMPOSITE_PRESETS, *session_composites]))
+    else:
+        session_composites = {}
+    composites = composite_variables(compare_backend, {**COMPOSITE_PRESETS, **session_composites})
+    if sample_backend is not None:
+        composite_variables(sample_backend, {**COMPOSITE_PRESETS, **session_composites})
+    themes = {**THEMES, COMPOSITE_THEME: composites} if composites else THEMES
+    profile_vars = profile_variables(composites)
+
+    # Lecture des caches (taille, taux de succès) : ?admin=1 ou EVS_SHOW_CACHE_STATS=1
+    if st.query_params.get("admin") == "1" or os.environ.get("EVS_SHOW_CACHE_STATS") == "1":
+        with st.expander("⚙️ Caches"):
+            cache_rows = []
+            for c in cache_stats():
+                cache_rows.append({
+                    'Cache': c['label'],
+                    'Entrées': f"{c['entries']}/{c['max_entries'] or '∞'}",
+                    'Mo': f"{c['bytes'] / 1024 ** 2:,.1f}" + (f"/{c['max_bytes'] / 1024 ** 2:,.0f}" if c['max_bytes'] else ""),
+                    'Succès': f"{c['hit_rate'] * 100:.0f}%" if c['hit_rate'] is not None else "—",
+                    'TTL': f"{c['ttl'] / 60:.0f} min" if c['ttl'] else "—",
+                })
+            html_table(pd.DataFrame(cache_rows))
 
 # ─── MAIN ─────────────────────────────────────────────────────────────────────
 st.markdown("# 🌍 EVS / WVS — Comparateur de pays")
@@ -611,13 +1072,19 @@ if not selected_codes:
     st.info("👈 Sélectionnez au moins deux pays dans la barre latérale pour commencer.")
     st.stop()
 
-# Filtrer les données
-df = df_full[df_full['Country (ISO 3166-1 Alpha-2 code)'].isin(selected_codes)].copy()
-df['Pays'] = df['Country (ISO 3166-1 Alpha-2 code)'].map(lambda x: COUNTRY_NAMES.get(x, x))
+n_by_country = backend.n_respondents(selected_codes)
+# Clé canonique de la sélection pour les caches (l'ordre de clic n'importe pas)
+sel_codes = tuple(sorted(selected_codes))
 
-st.markdown(f"**{len(df):,}** répondants · **{len(selected_codes)}** pays sélectionnés")
+n_compared = sum(compare_backend.n_respondents(selected_codes).values())
+st.markdown(f"**{n_compared:,}** répondants · **{len(selected_codes)}** pays sélectionnés")
+if compare_backend is not backend:
+    st.caption(f"Onglets 1 et 2 : une ligne par pays × vague ({', '.join(selected_waves)}) · "
+               f"onglets 3 à 5 : vague {selected_waves[-1]}")
 pays_badges = " ".join([f'<span class="country-badge">{COUNTRY_NAMES.get(c, c)}</span>' for c in selected_codes])
 st.markdown(pays_badges, unsafe_allow_html=True)
+# Progression du calcul exact des vues provisoires (lancé en fin de script)
+refine_slot = st.empty()
 
 # ─── ONGLETS ──────────────────────────────────────────────────────────────────
 tab_names = ["📊 Analyse par variable", "🗺️ Vue d'ensemble", "📋 Tableau comparatif", "🔍 Profil détaillé", "🔬 Profil pays complet"]
@@ -630,160 +1097,100 @@ with tabs[0]:
     col_theme, col_var = st.columns([1, 2])
 
     with col_theme:
-        theme = st.selectbox("Thème", list(THEMES.keys()))
+        theme_options = list(themes.keys())
+        link_theme = link_view.get('theme')
+        theme = st.selectbox("Thème", theme_options,
+                             index=theme_options.index(link_theme) if link_theme in theme_options else 0)
+        # Toutes les colonnes du dataset, au-delà de THEMES
+        column_query = st.text_input("🔎 Rechercher parmi toutes les colonnes", value=link_view.get('column', ''),
+                                     key="catalog_query", placeholder="ex. trust, religion…") if catalog else ""
 
     with col_var:
-        vars_in_theme = THEMES[theme]
-        var_label = st.selectbox("Variable", list(vars_in_theme.keys()))
+        vars_in_theme = themes[theme]
+        if column_query:
+            matches = catalog_variables(catalog, column_query)
+            if matches:
+                vars_in_theme = matches
+            else:
+                st.caption(f"Aucune colonne numérique (au plus {CATALOG_MAX_DISTINCT} valeurs distinctes) "
+                           f"ne contient « {column_query} » : variables du thème")
+        var_options = list(vars_in_theme.keys())
+        preferred = link_view.get('var', link_view.get('column'))
+        var_label = st.selectbox("Variable", var_options,
+                                 index=var_options.index(preferred) if preferred in var_options else 0)
 
     col_name, scale_desc = vars_in_theme[var_label]
 
+    if column_query and catalog is not None:
+        with st.expander(f"🗂️ Catalogue : colonnes contenant « {column_query} »"):
+            found = catalog.search(column_query, limit=CATALOG_SEARCH_LIMIT)
+            html_table(catalog.table.loc[found].reset_index().round(2))
+            st.caption(f"{len(catalog.table):,} colonnes au total · Pays : nombre de pays avec au moins une réponse")
+
     # Vérifier disponibilité
-    if col_name not in df.columns:
+    if not compare_backend.has_variable(col_name):
         st.warning(f"Variable `{col_name}` non disponible dans le dataset.")
     else:
-        data_var = df[['Pays', 'Country (ISO 3166-1 Alpha-2 code)', col_name]].dropna(subset=[col_name])
-
         st.markdown(f"<div class='info-box'>📐 <b>Échelle :</b> {scale_desc}</div>", unsafe_allow_html=True)
+        missing = catalog.missing_countries(col_name, selected_codes) if catalog is not None else []
+        if missing:
+            st.caption("Aucune réponse pour : " + ", ".join(COUNTRY_NAMES.get(c, c) for c in missing))
 
-        # ── Calcul des stats ──
-        def compute_stats(grp):
-            vals = grp[col_name].dropna()
-            n = len(vals)
-            mean = vals.mean()
-            std = vals.std()
-            ci = 1.96 * std / np.sqrt(n) if n > 1 else 0
-            pct_top = (vals == vals.max()).mean() * 100  # % à la valeur max
-            return pd.Series({'Moyenne': mean, 'Écart-type': std, 'IC95': ci,
-                               'N': n, 'Médiane': vals.median()})
-
-        stats = data_var.groupby('Pays').apply(compute_stats).reset_index()
-
-        if sort_bars:
-            stats = stats.sort_values('Moyenne', ascending=True)
+        var_backend = view_backend(compare_backend, [col_name])
 
         # ── Graphique en barres ──
-        fig, ax = plt.subplots(figsize=(10, max(4, len(stats) * 0.55)))
-        fig.patch.set_facecolor('#FAFAF8')
-        ax.set_facecolor('#FAFAF8')
-
-        colors = [PALETTE[i % len(PALETTE)] for i in range(len(stats))]
-        bars = ax.barh(stats['Pays'], stats['Moyenne'],
-                       color=colors, alpha=0.85, height=0.6, zorder=3)
-
-        if show_ci:
-            ax.errorbar(stats['Moyenne'], stats['Pays'],
-                        xerr=stats['IC95'], fmt='none', color='#333',
-                        capsize=3, linewidth=1.2, zorder=4)
-
-        # Labels valeurs
-        for bar, (_, row) in zip(bars, stats.iterrows()):
-            label = f"{row['Moyenne']:.2f}"
-            if show_n:
-                label += f"  (n={int(row['N']):,})"
-            ax.text(bar.get_width() + ax.get_xlim()[1] * 0.01, bar.get_y() + bar.get_height() / 2,
-                    label, va='center', fontsize=8.5, color='#333', fontfamily='monospace')
-
-        ax.set_xlabel('Moyenne', fontsize=9, color='#555')
-        ax.set_title(var_label, fontsize=13, fontweight='bold', color='#1A1A2E', pad=14)
-        ax.tick_params(axis='both', labelsize=9)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_color('#DDD')
-        ax.spines['bottom'].set_color('#DDD')
-        ax.grid(axis='x', alpha=0.25, zorder=0)
-        ax.set_xlim(0, stats['Moyenne'].max() * 1.22)
-
-        plt.tight_layout()
-        st.pyplot(fig)
-        plt.close()
+        st.image(stats_chart_png(var_backend, col_name, sel_codes, var_label, sort_bars, show_ci, show_n))
 
         # ── Distribution détaillée ──
         with st.expander("📊 Distribution des réponses par pays (% et volume)"):
-            unique_vals = sorted(data_var[col_name].dropna().unique())
+            pivot, pivot_pct = get_distribution(var_backend, col_name, sel_codes)
+            unique_vals = list(pivot.columns)
 
             if len(unique_vals) <= 12:
                 col_pct, col_vol = st.columns(2)
-                
-                # Calcul pivot
-                pivot = (data_var.groupby(['Pays', col_name])
-                         .size()
-                         .unstack(fill_value=0))
-                pivot_pct = pivot.div(pivot.sum(axis=1), axis=0) * 100
-
-                if sort_bars:
-                    pivot = pivot.loc[stats['Pays'].tolist()[::-1]]
-                    pivot_pct = pivot_pct.loc[stats['Pays'].tolist()[::-1]]
+                png_pct, png_vol = distribution_pngs(var_backend, col_name, sel_codes, var_label, sort_bars)
 
                 with col_pct:
                     st.markdown("**Distribution en pourcentages**")
-                    fig2, ax2 = plt.subplots(figsize=(10, max(4, len(pivot_pct) * 0.55)))
-                    fig2.patch.set_facecolor('#FAFAF8')
-                    ax2.set_facecolor('#FAFAF8')
-
-                    cmap_colors = plt.cm.RdYlGn(np.linspace(0.1, 0.9, len(unique_vals)))
-                    left = np.zeros(len(pivot_pct))
-
-                    for i, val in enumerate(pivot_pct.columns):
-                        widths = pivot_pct[val].values
-                        ax2.barh(pivot_pct.index, widths, left=left,
-                                 color=cmap_colors[i], label=f"{int(val)}", height=0.6, zorder=3)
-                        for j, (w, l) in enumerate(zip(widths, left)):
-                            if w > 5:
-                                ax2.text(l + w / 2, j, f"{w:.0f}%",
-                                         ha='center', va='center', fontsize=7.5, color='white', fontweight='bold')
-                        left += widths
-
-                    ax2.set_xlabel('% des répondants', fontsize=9, color='#555')
-                    ax2.set_title(f'Distribution % — {var_label}', fontsize=10, fontweight='bold', color='#1A1A2E')
-                    ax2.legend(title='Valeur', bbox_to_anchor=(1.01, 1), loc='upper left', fontsize=8)
-                    ax2.set_xlim(0, 100)
-                    ax2.spines['top'].set_visible(False)
-                    ax2.spines['right'].set_visible(False)
-                    ax2.grid(axis='x', alpha=0.2, zorder=0)
-                    plt.tight_layout()
-                    st.pyplot(fig2)
-                    plt.close()
+                    st.image(png_pct)
 
                 with col_vol:
                     st.markdown("**Distribution en volume (nombre de répondants)**")
-                    fig3, ax3 = plt.subplots(figsize=(10, max(4, len(pivot) * 0.55)))
-                    fig3.patch.set_facecolor('#FAFAF8')
-                    ax3.set_facecolor('#FAFAF8')
-
-                    left_vol = np.zeros(len(pivot))
-                    for i, val in enumerate(pivot.columns):
-                        widths_vol = pivot[val].values
-                        ax3.barh(pivot.index, widths_vol, left=left_vol,
-                                 color=cmap_colors[i], label=f"{int(val)}", height=0.6, zorder=3)
-                        for j, (w, l) in enumerate(zip(widths_vol, left_vol)):
-                            if w > pivot[val].max() * 0.08:  # Affiche si > 8% du max
-                                ax3.text(l + w / 2, j, f"{int(w):,}",
-                                         ha='center', va='center', fontsize=7.5, color='white', fontweight='bold')
-                        left_vol += widths_vol
-
-                    ax3.set_xlabel('Nombre de répondants', fontsize=9, color='#555')
-                    ax3.set_title(f'Distribution volume — {var_label}', fontsize=10, fontweight='bold', color='#1A1A2E')
-                    ax3.legend(title='Valeur', bbox_to_anchor=(1.01, 1), loc='upper left', fontsize=8)
-                    ax3.spines['top'].set_visible(False)
-                    ax3.spines['right'].set_visible(False)
-                    ax3.grid(axis='x', alpha=0.2, zorder=0)
-                    plt.tight_layout()
-                    st.pyplot(fig3)
-                    plt.close()
+                    st.image(png_vol)
+
+        # ── Polarisation et divergence ──
+        # Même moyenne, distributions différentes : réponses groupées ou en deux camps
+        with st.expander("↔️ Polarisation et divergence des distributions entre pays"):
+            bounds = scale_bounds(scale_desc) if '=' in scale_desc else None
+            polarisation = get_polarisation(var_backend, col_name, sel_codes, bounds).sort_values(ascending=False)
+            means = get_stats(var_backend, col_name, sel_codes).set_index('Pays')['Moyenne']
+            col_pol, col_cons = st.columns(2)
+            with col_pol:
+                st.markdown("**🧲 Plus polarisés**")
+                for pays, value in polarisation.head(5).items():
+                    st.markdown(f"**{pays}** — {value:.2f} · moy. {means.get(pays, np.nan):.2f}")
+            with col_cons:
+                st.markdown("**🤝 Plus consensuels**")
+                for pays, value in polarisation.tail(5).iloc[::-1].items():
+                    st.markdown(f"**{pays}** — {value:.2f} · moy. {means.get(pays, np.nan):.2f}")
+            st.caption("Polarisation : écart moyen entre deux répondants rapporté à la demi-étendue de l'échelle "
+                       "(0 = tous la même réponse, 1 = deux camps aux extrêmes)")
+
+            if len(polarisation) >= 2:
+                method = st.radio("Divergence", list(DIVERGENCES), format_func=DIVERGENCES.get,
+                                  horizontal=True, key="divergence_method")
+                st.image(divergence_png(var_backend, col_name, sel_codes, method, var_label))
+                divergence = get_divergence(var_backend, col_name, sel_codes, method)
+                pairs = divergence.where(np.triu(np.ones(divergence.shape, dtype=bool), k=1)).stack()
+                (far_a, far_b), (near_a, near_b) = pairs.idxmax(), pairs.idxmin()
+                st.caption(f"Distributions les plus éloignées : {far_a} / {far_b} ({pairs.max():.3f}) · "
+                           f"les plus proches : {near_a} / {near_b} ({pairs.min():.3f})")
 
         # ── Tableau stats ──
         with st.expander("📋 Tableau des statistiques"):
-            display_stats = stats[['Pays', 'N', 'Moyenne', 'Médiane', 'Écart-type']].copy()
-            display_stats['N'] = display_stats['N'].astype(int)
-            display_stats['Moyenne'] = display_stats['Moyenne'].round(3)
-            display_stats['Médiane'] = display_stats['Médiane'].round(1)
-            display_stats['Écart-type'] = display_stats['Écart-type'].round(3)
-            display_stats = display_stats.sort_values('Moyenne', ascending=False).reset_index(drop=True)
-            html_table(display_stats, gradient_col='Moyenne')
-
-            csv_dl = display_stats.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 Télécharger ce tableau", csv_dl,
+            html_table(stats_display_table(var_backend, col_name, sel_codes), gradient_col='Moyenne')
+
+            st.download_button("📥 Télécharger ce tableau", stats_csv(var_backend, col_name, sel_codes),
                                f"stats_{var_label[:30]}.csv", "text/csv")
 
 # ════════════════════════════════════════════════════════════════════════════
@@ -793,80 +1200,41 @@ with tabs[1]:
     st.markdown("## Vue d'ensemble — Carte de chaleur")
 
     # Sélectionner les variables à inclure
-    all_flat_vars = {}
-    for theme_name, theme_vars in THEMES.items():
-        for var_label_k, (col, scale) in theme_vars.items():
-            short = var_label_k
-            all_flat_vars[short] = col
+    all_flat_vars = {label: col for theme_vars in themes.values() for label, (col, scale) in theme_vars.items()}
 
-    available_vars = {k: v for k, v in all_flat_vars.items() if v in df.columns}
+    available_vars = {k: v for k, v in all_flat_vars.items() if compare_backend.has_variable(v)}
 
+    # Vue monde : matrice complète, tous les pays du dataset × toutes les variables
+    world = st.toggle("🌐 Vue monde (tous les pays × toutes les variables)", value=False)
     selected_overview_vars = st.multiselect(
         "Variables à inclure dans la carte de chaleur",
         options=list(available_vars.keys()),
         default=list(available_vars.keys())[:15],
+        disabled=world,
     )
+    if world:
+        selected_overview_vars = list(available_vars)
+    heatmap_codes = tuple(sorted(compare_backend.countries())) if world else sel_codes
 
     if len(selected_overview_vars) < 2:
         st.info("Sélectionnez au moins 2 variables.")
     else:
         cols_to_agg = {v: available_vars[v] for v in selected_overview_vars}
 
-        # Agréger moyennes par pays
-        agg_data = {}
-        for label, col in cols_to_agg.items():
-            means = df.groupby('Pays')[col].mean()
-            agg_data[label] = means
+        normalize = st.toggle("Normaliser (z-score, pour rendre comparables)", value=True)
+        cluster = st.toggle("Regrouper les pays similaires (clustering)", value=False)
+        annotate = st.toggle("Afficher les valeurs dans les cellules", value=False)
 
-        heatmap_df = pd.DataFrame(agg_data).dropna(how='all')
+        # Grandes matrices : une seule tuile (30 pays au plus) rendue par affichage
+        heat_backend = view_backend(compare_backend, cols_to_agg.values())
+        tiles = heatmap_tiles(len(get_heatmap_matrix(heat_backend, cols_to_agg, heatmap_codes,
+                                                     normalize, cluster)))
+        tile = 0
+        if len(tiles) > 1:
+            tile = st.radio("Pays affichés", range(len(tiles)), horizontal=True,
+                            format_func=lambda t: f"{tiles[t][0] + 1}–{tiles[t][1]}")
 
-        # Normaliser chaque variable (z-score) pour comparer sur même échelle
-        normalize = st.toggle("Normaliser (z-score, pour rendre comparables)", value=True)
-        if normalize:
-            heatmap_df_plot = (heatmap_df - heatmap_df.mean()) / heatmap_df.std()
-            cmap_label = "Score standardisé"
-        else:
-            heatmap_df_plot = heatmap_df
-            cmap_label = "Moyenne brute"
-
-        if st.toggle("Regrouper les pays similaires (clustering)", value=False):
-            from scipy.cluster.hierarchy import linkage, dendrogram, leaves_list
-            from scipy.spatial.distance import pdist
-            df_clean = heatmap_df_plot.dropna()
-            if len(df_clean) > 2:
-                Z = linkage(df_clean.values, method='ward')
-                order = leaves_list(Z)
-                heatmap_df_plot = df_clean.iloc[order]
-
-        fig3, ax3 = plt.subplots(figsize=(max(10, len(selected_overview_vars) * 0.7),
-                                          max(6, len(heatmap_df_plot) * 0.45)))
-        fig3.patch.set_facecolor('#FAFAF8')
-
-        cmap = LinearSegmentedColormap.from_list('evs', ['#D62828', '#F7F7F7', '#2A9D8F'])
-        im = ax3.imshow(heatmap_df_plot.values, cmap=cmap, aspect='auto')
-
-        ax3.set_xticks(range(len(heatmap_df_plot.columns)))
-        ax3.set_xticklabels(heatmap_df_plot.columns, rotation=45, ha='right', fontsize=8.5)
-        ax3.set_yticks(range(len(heatmap_df_plot.index)))
-        ax3.set_yticklabels(heatmap_df_plot.index, fontsize=9)
-
-        # Valeurs dans les cellules
-        if st.toggle("Afficher les valeurs dans les cellules", value=False):
-            for i in range(len(heatmap_df_plot.index)):
-                for j in range(len(heatmap_df_plot.columns)):
-                    val = heatmap_df.iloc[i, j] if not normalize else heatmap_df_plot.iloc[i, j]
-                    if not np.isnan(val):
-                        ax3.text(j, i, f"{val:.1f}", ha='center', va='center',
-                                 fontsize=7, color='#111')
-
-        cbar = fig3.colorbar(im, ax=ax3, shrink=0.6)
-        cbar.set_label(cmap_label, fontsize=9)
-        ax3.set_title("Comparaison pays × variables", fontsize=13, fontweight='bold',
-                      color='#1A1A2E', pad=14)
-
-        plt.tight_layout()
-        st.pyplot(fig3)
-        plt.close()
+        st.image(heatmap_png(heat_backend, cols_to_agg, heatmap_codes, normalize, cluster, annotate, tile))
 
         st.markdown("""
         <div class='info-box'>
@@ -881,68 +1249,114 @@ with tabs[1]:
 with tabs[2]:
     st.markdown("## Tableau comparatif multi-variables")
 
-    theme_table = st.selectbox("Thème", list(THEMES.keys()), key="table_theme")
+    theme_table = st.selectbox("Thème", list(themes.keys()), key="table_theme")
 
-    vars_table = THEMES[theme_table]
-    available_table = {k: v for k, (v, _) in vars_table.items() if v in df.columns}
+    vars_table = themes[theme_table]
+    available_table = {k: v for k, (v, _) in vars_table.items() if backend.has_variable(v)}
 
     if not available_table:
         st.warning("Aucune variable disponible pour ce thème.")
     else:
-        agg_rows = {}
-        for var_lbl, col in available_table.items():
-            means = df.groupby('Pays')[col].mean().round(3)
-            agg_rows[var_lbl] = means
-
-        table_df = pd.DataFrame(agg_rows)
+        table_backend = view_backend(backend, available_table.values())
 
         # Tri par pays
-        sort_col = st.selectbox("Trier par variable", ["(Pays)"] + list(table_df.columns))
-        if sort_col == "(Pays)":
-            table_df = table_df.sort_index()
-        else:
-            table_df = table_df.sort_values(sort_col, ascending=False)
+        sort_col = st.selectbox("Trier par variable", ["(Pays)"] + list(available_table))
+        table_df = sorted_table(table_backend, available_table, sel_codes, sort_col)
 
         # Tableau HTML avec gradient sur la colonne de tri
         grad = sort_col if sort_col != "(Pays)" else None
         table_display = table_df.reset_index().rename(columns={'index': 'Pays'})
         html_table(table_display.round(3), gradient_col=grad)
 
+        csv_t, xlsx_t = table_exports(table_backend, available_table, sel_codes, sort_col)
         col_dl1, col_dl2 = st.columns(2)
         with col_dl1:
-            csv_t = table_df.to_csv().encode('utf-8')
             st.download_button("📥 Télécharger CSV", csv_t,
                                f"comparaison_{theme_table[:20]}.csv", "text/csv")
         with col_dl2:
             # Export Excel
-            try:
-                import io
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    table_df.to_excel(writer, sheet_name='Comparaison')
-                st.download_button("📥 Télécharger Excel", buffer.getvalue(),
+            if xlsx_t is not None:
+                st.download_button("📥 Télécharger Excel", xlsx_t,
                                    f"comparaison_{theme_table[:20]}.xlsx",
                                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            except ImportError:
-                pass
 
         # ── Top / Flop ──
         st.markdown("---")
         st.markdown("### 🏆 Classements")
         rank_var = st.selectbox("Variable à classer", list(table_df.columns), key="rank_var")
+        rank_col, rank_scale = vars_table[rank_var]
+
+        # Tests par paires : proportions pour les échelles à deux valeurs, t de Welch sinon
+        col_test, col_corr, col_alpha = st.columns(3)
+        with col_test:
+            tests = {v: k for k, v in PAIRWISE_TESTS.items()}
+            if not is_binary_scale(rank_scale):
+                tests = {PAIRWISE_TESTS['welch']: 'welch'}
+            pair_test = tests[st.selectbox("Test", list(tests), index=len(tests) - 1, key="pair_test")]
+        with col_corr:
+            corrections = {v: k for k, v in CORRECTIONS.items()}
+            correction = corrections[st.selectbox("Correction (comparaisons multiples)", list(corrections),
+                                                  key="pair_correction")]
+        with col_alpha:
+            alpha = st.select_slider("Seuil α", [0.01, 0.05, 0.10], value=0.05, key="pair_alpha")
 
-        col_top, col_bot = st.columns(2)
         ranked = table_df[rank_var].dropna().sort_values(ascending=False)
+        pvalues = None
+        if len(ranked) >= 2:
+            _, pvalues = get_pairwise(table_backend, rank_col, sel_codes, pair_test, correction, rank_scale)
+
+        def rank_mark(pays):
+            """≠ / ≈ : écart significatif ou non avec le pays classé juste en dessous."""
+            pos = ranked.index.get_loc(pays)
+            if pvalues is None or pos + 1 >= len(ranked):
+                return ""
+            p = pvalues.loc[pays, ranked.index[pos + 1]]
+            return " · ≠" if p < alpha else " · ≈"
+
+        col_top, col_bot = st.columns(2)
 
         with col_top:
             st.markdown(f"**🥇 Top 5 — {rank_var}**")
             for i, (pays, val) in enumerate(ranked.head(5).items(), 1):
-                st.markdown(f"`{i}.` **{pays}** — {val:.3f}")
+                st.markdown(f"`{i}.` **{pays}** — {val:.3f}{rank_mark(pays)}")
 
         with col_bot:
             st.markdown(f"**🔻 Bas de classement — {rank_var}**")
             for i, (pays, val) in enumerate(ranked.tail(5).iloc[::-1].items(), 1):
-                st.markdown(f"`{i}.` **{pays}** — {val:.3f}")
+                st.markdown(f"`{i}.` **{pays}** — {val:.3f}{rank_mark(pays)}")
+
+        st.caption("≠ : écart significatif avec le pays classé juste en dessous · ≈ : écart non significatif")
+
+        # ── Matrice de significativité ──
+        if pvalues is not None:
+            with st.expander("🔬 Écarts significatifs entre toutes les paires de pays"):
+                st.image(significance_png(table_backend, rank_col, sel_codes, pair_test, correction,
+                                          rank_scale, alpha, rank_var))
+                n_pairs = len(pvalues) * (len(pvalues) - 1) // 2
+                n_signif = int((pvalues.to_numpy() < alpha).sum() // 2)
+                st.caption(f"{n_signif} paires significatives sur {n_pairs} · "
+                           f"cases grises : écart non significatif après correction")
+
+    # ── Microdonnées ──
+    # Lignes répondants des pays sélectionnés, générées au clic seulement (le fichier
+    # final, compressé par défaut, est ensuite gardé en mémoire par Streamlit pour l'envoi)
+    if backend.row_level:
+        with st.expander("📦 Microdonnées (lignes répondants des pays sélectionnés)"):
+            micro_themes = st.multiselect("Thèmes exportés", list(themes), default=[theme_table], key="micro_themes")
+            micro_gzip = st.toggle("Compresser (gzip)", value=True, key="micro_gzip")
+            micro_cols = tuple(microdata_columns(
+                backend, [col for t in micro_themes for col, _ in themes[t].values()]))
+            st.caption(f"{sum(n_by_country.values()):,} lignes · {len(micro_cols)} colonnes "
+                       "(code pays, année, poids le cas échéant, variables des thèmes)")
+            micro_name = f"microdonnees_evs_{len(sel_codes)}_pays.csv" + (".gz" if micro_gzip else "")
+            micro_mime = "application/gzip" if micro_gzip else "text/csv"
+            micro_data = partial(microdata_bytes, backend, micro_cols, sel_codes, micro_gzip)
+            try:
+                st.download_button("📥 Télécharger les microdonnées", micro_data, micro_name, micro_mime)
+            except StreamlitAPIException:
+                # Streamlit sans génération différée au clic : préparation explicite
+                if st.button("Préparer les microdonnées"):
+                    st.download_button("📥 Télécharger les microdonnées", micro_data(), micro_name, micro_mime)
 
 # ════════════════════════════════════════════════════════════════════════════
 # ONGLET 4 — PROFIL D'UN PAYS
@@ -955,77 +1369,27 @@ with tabs[3]:
 
     # Récupérer code ISO
     focus_code = next((c for c in selected_codes if COUNTRY_NAMES.get(c, c) == focus_country), None)
-    df_focus = df[df['Pays'] == focus_country]
-    df_others = df[df['Pays'] != focus_country]
+    n_focus = n_by_country.get(focus_code, 0)
 
-    if focus_code and len(df_focus) > 0:
-        st.metric("Répondants", f"{len(df_focus):,}")
-        st.markdown(f"**ISO :** `{focus_code}` · **Année :** {int(df_focus['Year survey'].mode()[0]) if 'Year survey' in df_focus.columns else 'N/A'}")
+    if focus_code and n_focus > 0:
+        st.metric("Répondants", f"{n_focus:,}")
+        focus_year = backend.survey_year(focus_code)
+        st.markdown(f"**ISO :** `{focus_code}` · **Année :** {focus_year if focus_year is not None else 'N/A'}")
 
         st.markdown("---")
         st.markdown("### Comparaison avec les autres pays sélectionnés")
 
-        # Radar-like : comparaison sur variables-clés
-        key_profile_vars = {
-            "Satisfaction vie": "Satisfaction with your life",
-            "Bonheur": "Feeling of happiness",
-            "Confiance générale": "Most people can be trusted",
-            "Intérêt politique": "Interest in politics",
-            "Importance démocratie": "Importance of democracy",
-            "Importance Dieu": "How important is God in your life",
-            "Homosexualité justifiable": "Justifiable: Homosexuality",
-            "Importance famille": "Important in life: Family",
-            "Confiance gouvernement": "Confidence: The Government",
-        }
-
-        profile_rows = []
-        for label, col in key_profile_vars.items():
-            if col in df.columns:
-                val_focus = df_focus[col].mean()
-                val_others = df_others[col].mean()
-                val_all = df[col].mean()
-                profile_rows.append({
-                    'Variable': label,
-                    focus_country: round(val_focus, 3),
-                    'Autres pays (moy.)': round(val_others, 3),
-                    'Écart': round(val_focus - val_others, 3),
-                })
-
-        profile_df = pd.DataFrame(profile_rows)
-
         # Graphique comparatif
-        fig4, ax4 = plt.subplots(figsize=(10, max(5, len(profile_df) * 0.6)))
-        fig4.patch.set_facecolor('#FAFAF8')
-        ax4.set_facecolor('#FAFAF8')
-
-        y = np.arange(len(profile_df))
-        h = 0.35
-        bars1 = ax4.barh(y + h/2, profile_df[focus_country], h,
-                         color='#E63946', alpha=0.85, label=focus_country, zorder=3)
-        bars2 = ax4.barh(y - h/2, profile_df['Autres pays (moy.)'], h,
-                         color='#457B9D', alpha=0.7, label='Autres pays (moy.)', zorder=3)
-
-        ax4.set_yticks(y)
-        ax4.set_yticklabels(profile_df['Variable'], fontsize=9)
-        ax4.set_xlabel('Moyenne', fontsize=9, color='#555')
-        ax4.set_title(f"Profil de {focus_country} vs. autres pays", fontsize=13,
-                      fontweight='bold', color='#1A1A2E', pad=14)
-        ax4.legend(fontsize=9, loc='lower right')
-        ax4.spines['top'].set_visible(False)
-        ax4.spines['right'].set_visible(False)
-        ax4.grid(axis='x', alpha=0.25, zorder=0)
-
-        plt.tight_layout()
-        st.pyplot(fig4)
-        plt.close()
+        focus_backend = view_backend(backend, profile_vars.values())
+        st.image(profile_png(focus_backend, focus_code, sel_codes, profile_vars))
 
         st.markdown("### Écarts par rapport aux autres pays sélectionnés")
-        profile_display = profile_df[['Variable', focus_country, 'Autres pays (moy.)', 'Écart']].copy()
+        profile_df = get_profile(focus_backend, focus_code, sel_codes, profile_vars)
+        profile_display = profile_df[['Variable', focus_country, 'Autres pays (moy.)', 'Écart']]
         html_table(profile_display.round(3), gradient_col='Écart')
 
-        csv_profile = profile_display.to_csv(index=False).encode('utf-8')
         st.download_button(f"📥 Télécharger le profil de {focus_country}",
-                           csv_profile, f"profil_{focus_code}.csv", "text/csv")
+                           profile_csv(focus_backend, focus_code, sel_codes, profile_vars), f"profil_{focus_code}.csv", "text/csv")
 
 # ════════════════════════════════════════════════════════════════════════════
 # ONGLET 5 — PROFIL PAYS COMPLET (toutes variables avec détail volume/%)
@@ -1041,51 +1405,62 @@ with tabs[4]:
     country_code_full = next((c for c in selected_codes if COUNTRY_NAMES.get(c, c) == country_full), None)
     
     if country_code_full:
-        df_country = df[df['Country (ISO 3166-1 Alpha-2 code)'] == country_code_full].copy()
-        
-        st.metric("Nombre de répondants", f"{len(df_country):,}")
+        st.metric("Nombre de répondants", f"{n_by_country.get(country_code_full, 0):,}")
         st.markdown(f"**Code ISO :** `{country_code_full}`")
         
         st.markdown("---")
         
-        # Sélection du thème
-        theme_full = st.selectbox("📂 Thème", list(THEMES.keys()), key="theme_full")
-        
-        vars_in_theme_full = THEMES[theme_full]
-        
+        # Sélection du thème, ou recherche parmi toutes les colonnes (catalogue)
+        col_theme_full, col_query_full = st.columns(2)
+        with col_theme_full:
+            theme_full = st.selectbox("📂 Thème", list(themes.keys()), key="theme_full")
+        with col_query_full:
+            query_full = st.text_input("🔎 Ou colonnes contenant…", key="catalog_query_full") if catalog else ""
+
+        vars_in_theme_full = themes[theme_full]
+        if query_full:
+            vars_in_theme_full = catalog_variables(catalog, query_full, CATALOG_DETAIL_LIMIT)
+            theme_full = f"🔎 {query_full}"
+            st.caption(f"{len(vars_in_theme_full)} colonnes numériques (au plus {CATALOG_DETAIL_LIMIT}, "
+                       f"colonnes continues exclues)")
+        unavailable = [label for label, (col, _) in vars_in_theme_full.items() if not backend.has_variable(col)]
+        if unavailable:
+            st.caption("Absentes du dataset : " + ", ".join(unavailable))
+
         # Parcourir toutes les variables du thème
         st.markdown(f"### {theme_full}")
+        detail_backend = view_backend(backend, [col for col, _ in vars_in_theme_full.values()])
         
         for var_label_full, (col_name_full, scale_desc_full) in vars_in_theme_full.items():
-            if col_name_full not in df_country.columns:
+            if not backend.has_variable(col_name_full):
                 continue
                 
             with st.expander(f"📌 {var_label_full}"):
                 st.markdown(f"<div style='font-size:0.8rem;color:#666;margin-bottom:0.8rem'><b>Échelle :</b> {scale_desc_full}</div>", unsafe_allow_html=True)
                 
-                data_country_var = df_country[col_name_full].dropna()
+                value_counts = get_value_counts(detail_backend, col_name_full, country_code_full)
                 
-                if len(data_country_var) == 0:
+                if len(value_counts) == 0:
                     st.warning("Aucune donnée disponible pour cette variable")
                     continue
                 
-                # Stats générales
+                # Stats générales (tableaux par pays du backend, pondérés le cas échéant)
+                country_stats = get_stats(detail_backend, col_name_full, (country_code_full,)).iloc[0]
                 col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
                 with col_stat1:
-                    st.metric("N répondants", f"{len(data_country_var):,}")
+                    st.metric("N répondants", f"{int(country_stats['N']):,}")
+                    if 'N effectif' in country_stats:
+                        st.caption(f"N effectif : {country_stats['N effectif']:,.0f}")
                 with col_stat2:
-                    st.metric("Moyenne", f"{data_country_var.mean():.2f}")
+                    st.metric("Moyenne", f"{country_stats['Moyenne']:.2f}")
                 with col_stat3:
-                    st.metric("Médiane", f"{data_country_var.median():.1f}")
+                    st.metric("Médiane", f"{country_stats['Médiane']:.1f}")
                 with col_stat4:
-                    st.metric("Écart-type", f"{data_country_var.std():.2f}")
+                    st.metric("Écart-type", f"{country_stats['Écart-type']:.2f}")
                 
                 # Distribution
-                unique_vals_full = sorted(data_country_var.unique())
-                
-                if len(unique_vals_full) <= 15:
+                if len(value_counts) <= 15:
                     # Distribution détaillée pour variables catégorielles
-                    value_counts = data_country_var.value_counts().sort_index()
                     total_resp = value_counts.sum()
                     
                     # Tableau volume + %
@@ -1095,7 +1470,7 @@ with tabs[4]:
                         pct = (count / total_resp) * 100
                         distrib_data.append({
                             'Valeur': int(val) if val == int(val) else val,
-                            'Volume': int(count),
+                            'Volume': volume_value(count),
                             'Pourcentage': f"{pct:.1f}%"
                         })
                     
@@ -1109,72 +1484,19 @@ with tabs[4]:
                     
                     with col_chart:
                         st.markdown("**Visualisation**")
-                        fig_d, ax_d = plt.subplots(figsize=(8, max(3, len(value_counts) * 0.4)))
-                        fig_d.patch.set_facecolor('#FAFAF8')
-                        ax_d.set_facecolor('#FAFAF8')
-                        
-                        colors_d = plt.cm.viridis(np.linspace(0.2, 0.9, len(value_counts)))
-                        bars_d = ax_d.barh(range(len(value_counts)), value_counts.values, 
-                                           color=colors_d, alpha=0.85, height=0.6)
-                        
-                        ax_d.set_yticks(range(len(value_counts)))
-                        ax_d.set_yticklabels([f"Valeur {int(v)}" for v in value_counts.index], fontsize=9)
-                        ax_d.set_xlabel('Nombre de répondants', fontsize=9)
-                        ax_d.set_title(f'{var_label_full}', fontsize=10, fontweight='bold')
-                        
-                        # Ajouter les valeurs sur les barres
-                        for i, (bar, val, pct_val) in enumerate(zip(bars_d, value_counts.values, 
-                                                                      value_counts.values / total_resp * 100)):
-                            ax_d.text(bar.get_width() + ax_d.get_xlim()[1] * 0.02, bar.get_y() + bar.get_height() / 2,
-                                     f"{int(val):,} ({pct_val:.1f}%)", 
-                                     va='center', fontsize=8, color='#000', fontweight='600')
-                        
-                        ax_d.spines['top'].set_visible(False)
-                        ax_d.spines['right'].set_visible(False)
-                        ax_d.grid(axis='x', alpha=0.2)
-                        plt.tight_layout()
-                        st.pyplot(fig_d)
-                        plt.close()
+                        st.image(value_counts_png(detail_backend, col_name_full, country_code_full, var_label_full, False))
                 
                 else:
                     # Variable continue : histogramme
-                    fig_h, ax_h = plt.subplots(figsize=(10, 4))
-                    fig_h.patch.set_facecolor('#FAFAF8')
-                    ax_h.set_facecolor('#FAFAF8')
-                    
-                    ax_h.hist(data_country_var, bins=30, color='steelblue', alpha=0.7, edgecolor='black')
-                    ax_h.set_xlabel('Valeur', fontsize=9)
-                    ax_h.set_ylabel('Fréquence', fontsize=9)
-                    ax_h.set_title(f'{var_label_full}', fontsize=11, fontweight='bold')
-                    ax_h.grid(axis='y', alpha=0.2)
-                    plt.tight_layout()
-                    st.pyplot(fig_h)
-                    plt.close()
+                    st.image(value_counts_png(detail_backend, col_name_full, country_code_full, var_label_full, True))
         
         # Export complet du profil pays
         st.markdown("---")
         st.markdown("### 💾 Export complet")
         
         # Générer un CSV avec toutes les stats du pays pour le thème
-        export_rows = []
-        for var_lbl, (col, scale) in vars_in_theme_full.items():
-            if col in df_country.columns:
-                vals = df_country[col].dropna()
-                if len(vals) > 0:
-                    value_counts_exp = vals.value_counts().sort_index()
-                    # Une ligne par valeur possible
-                    for val, count in value_counts_exp.items():
-                        export_rows.append({
-                            'Variable': var_lbl,
-                            'Échelle': scale,
-                            'Valeur': val,
-                            'Volume': int(count),
-                            'Pourcentage': f"{(count / len(vals)) * 100:.2f}%"
-                        })
-        
-        if export_rows:
-            export_df = pd.DataFrame(export_rows)
-            csv_export = export_df.to_csv(index=False).encode('utf-8')
+        csv_export = country_profile_csv(detail_backend, country_code_full, vars_in_theme_full)
+        if csv_export is not None:
             st.download_button(
                 f"📥 Télécharger le profil complet de {country_full} — {theme_full}",
                 csv_export,
@@ -1190,3 +1512,39 @@ st.markdown(
     "</div>",
     unsafe_allow_html=True
 )
+
+# ─── PERMALIEN ───────────────────────────────────────────────────────────────
+# L'URL suit la vue affichée, sous forme canonique (mêmes clés de cache pour
+# deux liens équivalents) ; les autres paramètres (?admin=1…) sont conservés.
+permalink = view_params(selected_codes, col_name, show_n, show_ci, sort_bars,
+                        selected_waves if PARTITIONS_PATH else None, bool(backend.weight_col))
+current_params = st.query_params.to_dict()
+extra_params = {k: v for k, v in current_params.items()
+                if k not in ('c', 'var', 'waves', WEIGHTED_PARAM, *TOGGLES)}
+if current_params != {**permalink, **extra_params}:
+    st.query_params.from_dict({**permalink, **extra_params})
+
+# ─── PRÉCHAUFFAGE EN ARRIÈRE-PLAN ────────────────────────────────────────────
+# Lancé une fois par dataset, après le premier rendu (pas de concurrence avec
+# lui), pendant que l'utilisateur choisit ses pays.
+if WARMUP_ENABLED:
+    def startup_tasks():
+        """Tâches du préchauffage, construites seulement à son lancement (pas à chaque rerun)."""
+        selections = {tuple(sorted(code_map[l] for l in labels[:12]))
+                      for labels in [all_countries[:8], *preset_valid.values()]}
+        links = read_warm_links(WARM_LINKS_PATH) if WARM_LINKS_PATH else []
+        # Colonnes du catalogue : seulement celles que l'onglet 1 propose (pas de colonne continue)
+        links = [view for view in links
+                 if 'column' not in view or (catalog is not None and catalog.categorical(view['column']))]
+        return warmup_tasks(backend, sorted(selections), links)
+
+    warmup = start_warmup(backend.version, startup_tasks, WARMUP_WORKERS)
+    with warmup_slot.container():
+        (warmup_status if warmup.finished else warmup_status_live)(warmup)
+
+# Vues provisoires affichées : agrégats exacts de leurs variables, puis relance de la page
+if refine_columns:
+    refine_key = (backend.version, 'refine', tuple(sorted(refine_columns)))
+    refine = start_warmup(refine_key, lambda: [partial(backend.warm, col) for col in refine_key[2]], 1)
+    with refine_slot.container():
+        refine_status_live(refine, refine_key)
@@ -0,0 +1,1735 @@
+"""
+EVS/WVS 2017-2022 — Agrégations partagées
+Logique de calcul commune à l'application Streamlit et au serveur d'API
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import zipfile
+import zlib
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from evs_cache import MB, get_cache
+
+DATA_URL = "https://github.com/felixat13/evs_stats/releases/download/v1.0/data_evs_mapped.csv.zip"
+COUNTRY_COL = 'Country (ISO 3166-1 Alpha-2 code)'
+# Poids d'enquête (plan de sondage × post-stratification) : mode pondéré
+WEIGHT_COL = 'Weight'
+# Lignes par bloc de l'export des microdonnées (mémoire bornée, voir microdata_chunks)
+MICRODATA_CHUNK_ROWS = 20_000
+
+# Codes EVS/WVS de non-réponse : -1 NSP, -2 sans réponse, -3 non applicable,
+# -4 non posé, -5 manquant / erreur
+MISSING_CODES = (-1, -2, -3, -4, -5)
+
+# ─── VARIABLES THÉMATIQUES ───────────────────────────────────────────────────
+THEMES = {
+    "😊 Bien-être": {
+        "Satisfaction de vie": ("Satisfaction with your life", "1=Insatisfait → 10=Satisfait"),
+        "Bonheur": ("Feeling of happiness", "1=Très heureux → 4=Pas du tout heureux"),
+        "Santé subjective": ("State of health (subjective)", "1=Très bonne → 5=Très mauvaise"),
+        "Liberté de choix": ("How much freedom of choice and control", "1=Aucune → 10=Totale"),
+    },
+    "🤝 Confiance": {
+        "Confiance générale": ("Most people can be trusted", "1=Oui → 2=Non (% qui font confiance)"),
+        "Confiance: Famille": ("How much you trust: Your family (B)", "1=Totale → 4=Aucune"),
+        "Confiance: Voisinage": ("Trust: Your neighborhood (B)", "1=Totale → 4=Aucune"),
+        "Confiance: Inconnus": ("Trust: People you meet for the first time (B)", "1=Totale → 4=Aucune"),
+        "Confiance: Autre religion": ("Trust: People of another religion (B)", "1=Totale → 4=Aucune"),
+        "Confiance: Autre nationalité": ("Trust: People of another nationality (B)", "1=Totale → 4=Aucune"),
+    },
+    "🏛️ Institutions & Démocratie": {
+        "Importance démocratie": ("Importance of democracy", "1=Pas important → 10=Essentiel"),
+        "Qualité démocratie nationale": ("Democraticness in own country", "1=Non démocratique → 10=Complètement"),
+        "Satisfaction système politique": ("Satisfaction with the political system", "1=Très satisfait → 4=Pas du tout"),
+        "Confiance: Gouvernement": ("Confidence: The Government", "1=Beaucoup → 4=Aucune"),
+        "Confiance: Parlement": ("Confidence: Parliament", "1=Beaucoup → 4=Aucune"),
+        "Confiance: Police": ("Confidence: The Police", "1=Beaucoup → 4=Aucune"),
+        "Confiance: Justice": ("Confidence: Justice System/Courts", "1=Beaucoup → 4=Aucune"),
+        "Confiance: Presse": ("Confidence: The Press", "1=Beaucoup → 4=Aucune"),
+        "Confiance: UE": ("Confidence: The European Union", "1=Beaucoup → 4=Aucune"),
+    },
+    "📣 Politique": {
+        "Intérêt politique": ("Interest in politics", "1=Très intéressé → 4=Pas du tout"),
+        "Échelle politique (Gauche-Droite)": ("Self positioning in political scale", "1=Gauche → 10=Droite"),
+        "Égalité des revenus": ("Income equality", "1=Égalité totale → 10=Inégalité totale"),
+        "Rôle de l'État": ("Government responsibility", "1=État → 10=Individu"),
+        "Pétition": ("Political action: signing a petition", "1=Déjà fait → 3=Jamais"),
+        "Manifestation": ("Political action: attending lawful/peaceful demonstrations", "1=Déjà fait → 3=Jamais"),
+    },
+    "🙏 Religion": {
+        "Importance de Dieu": ("How important is God in your life", "1=Pas important → 10=Très important"),
+        "Pratique religieuse": ("How often do you attend religious services", "1=+ d'une fois/sem → 7=Jamais"),
+        "Prière": ("How often do you pray (WVS7)", "1=Plusieurs fois/j → 8=Jamais"),
+        "Se dit religieux": ("Religious person", "1=Religieux → 3=Athée convaincu"),
+        "Croyance: Dieu": ("Believe in: God", "0=Non → 1=Oui (% croyants)"),
+        "Croyance: Au-delà": ("Believe in: life after death", "0=Non → 1=Oui"),
+    },
+    "👥 Valeurs sociales": {
+        "Homophobie (homosexualité justifiable)": ("Justifiable: Homosexuality", "1=Jamais → 10=Toujours"),
+        "Avortement (justifiable)": ("Justifiable: Abortion", "1=Jamais → 10=Toujours"),
+        "Divorce (justifiable)": ("Justifiable: Divorce", "1=Jamais → 10=Toujours"),
+        "Euthanasie (justifiable)": ("Justifiable: Euthanasia", "1=Jamais → 10=Toujours"),
+        "Leaders politiques hommes": ("Men make better political leaders than women do", "1=Fortement d'accord → 4=Pas du tout"),
+        "Dirigeants d'entreprise hommes": ("Men make better business executives than women do", "1=Fortement d'accord → 4=Pas du tout"),
+        "Impact immigration": ("Evaluate the impact of immigrants on the development of [your country]", "1=Positif → 3=Négatif (dans certains pays)"),
+    },
+    "👨‍👩‍👧 Famille & Travail": {
+        "Importance famille": ("Important in life: Family", "1=Très important → 4=Pas du tout"),
+        "Importance travail": ("Important in life: Work", "1=Très important → 4=Pas du tout"),
+        "Importance religion": ("Important in life: Religion", "1=Très important → 4=Pas du tout"),
+        "Importance politique": ("Important in life: Politics", "1=Très important → 4=Pas du tout"),
+        "Importance amis": ("Important in life: Friends", "1=Très important → 4=Pas du tout"),
+        "Le travail avant tout": ("Work should come first even if it means less spare time", "1=D'accord → 5=Pas d'accord"),
+    },
+}
+
+# Noms complets des pays
+COUNTRY_NAMES = {
+    'AL': 'Albanie', 'AM': 'Arménie', 'AT': 'Autriche', 'AZ': 'Azerbaïdjan',
+    'BA': 'Bosnie', 'BE': 'Belgique', 'BG': 'Bulgarie', 'BY': 'Biélorussie',
+    'CH': 'Suisse', 'CY': 'Chypre', 'CZ': 'Tchéquie', 'DE': 'Allemagne',
+    'DK': 'Danemark', 'EE': 'Estonie', 'ES': 'Espagne', 'FI': 'Finlande',
+    'FR': 'France', 'GB': 'Royaume-Uni', 'GE': 'Géorgie', 'GR': 'Grèce',
+    'HR': 'Croatie', 'HU': 'Hongrie', 'IE': 'Irlande', 'IS': 'Islande',
+    'IT': 'Italie', 'LT': 'Lituanie', 'LU': 'Luxembourg', 'LV': 'Lettonie',
+    'ME': 'Monténégro', 'MK': 'Macédoine', 'MT': 'Malte', 'NL': 'Pays-Bas',
+    'NO': 'Norvège', 'PL': 'Pologne', 'PT': 'Portugal', 'RO': 'Roumanie',
+    'RS': 'Serbie', 'RU': 'Russie', 'SE': 'Suède', 'SI': 'Slovénie',
+    'SK': 'Slovaquie', 'TR': 'Turquie', 'UA': 'Ukraine',
+    # WVS
+    'AR': 'Argentine', 'AU': 'Australie', 'BD': 'Bangladesh', 'BO': 'Bolivie',
+    'BR': 'Brésil', 'CA': 'Canada', 'CL': 'Chili', 'CN': 'Chine',
+    'CO': 'Colombie', 'EC': 'Équateur', 'EG': 'Égypte', 'ET': 'Éthiopie',
+    'GT': 'Guatemala', 'ID': 'Indonésie', 'IN': 'Inde', 'IQ': 'Irak',
+    'IR': 'Iran', 'JP': 'Japon', 'KE': 'Kenya', 'KR': 'Corée du Sud',
+    'KZ': 'Kazakhstan', 'LB': 'Liban', 'LY': 'Libye', 'MA': 'Maroc',
+    'MM': 'Myanmar', 'MX': 'Mexique', 'NG': 'Nigeria', 'NI': 'Nicaragua',
+    'NZ': 'Nouvelle-Zélande', 'PH': 'Philippines', 'PK': 'Pakistan',
+    'PR': 'Porto Rico', 'PW': 'Palaos', 'QA': 'Qatar', 'SG': 'Singapour',
+    'TH': 'Thaïlande', 'TJ': 'Tadjikistan', 'TN': 'Tunisie', 'TW': 'Taïwan',
+    'TZ': 'Tanzanie', 'US': 'États-Unis', 'UZ': 'Ouzbékistan',
+    'VN': 'Vietnam', 'ZA': 'Afrique du Sud', 'ZW': 'Zimbabwe',
+    'AD': 'Andorre', 'KG': 'Kirghizistan', 'MN': 'Mongolie',
+}
+
+# ─── CHARGEMENT DONNÉES ──────────────────────────────────────────────────────
+def _zip_csv_member(z):
+    csv_files = [f for f in z.namelist() if f.endswith('.csv') and not f.startswith('__MACOSX')]
+    if not csv_files:
+        raise FileNotFoundError("Aucun fichier CSV trouvé dans le ZIP")
+    return csv_files[0]
+
+
+def read_csv_zip(raw):
+    """Lit le premier CSV d'une archive ZIP (octets bruts)."""
+    with zipfile.ZipFile(BytesIO(raw)) as z:
+        with z.open(_zip_csv_member(z)) as csvfile:
+            return pd.read_csv(csvfile)
+
+
+def _download_zip(url=DATA_URL, timeout=60):
+    import requests
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def download_dataset(url=DATA_URL, timeout=60):
+    """Télécharge le ZIP de la release GitHub et renvoie le DataFrame."""
+    return read_csv_zip(_download_zip(url, timeout))
+
+
+@contextmanager
+def open_csv(path=None):
+    """Source CSV pour pd.read_csv sans tout décompresser en mémoire.
+
+    Fichier local (CSV, éventuellement compressé, ou ZIP) ou release GitHub si
+    `path` est vide : le CSV d'un ZIP est lu au fil de la décompression.
+    """
+    if path and not str(path).endswith('.zip'):
+        yield path
+        return
+    archive = BytesIO(_download_zip()) if not path else path
+    with zipfile.ZipFile(archive) as z:
+        with z.open(_zip_csv_member(z)) as csvfile:
+            yield csvfile
+
+
+def load_dataset(path=None):
+    """Charge un fichier local (CSV ou ZIP), ou la release GitHub si `path` est vide."""
+    if not path:
+        df = download_dataset()
+    elif str(path).endswith('.zip'):
+        with open(path, 'rb') as f:
+            df = read_csv_zip(f.read())
+    else:
+        df = pd.read_csv(path)
+    return sanitize_missing_codes(df)
+
+
+def sanitize_missing_codes(df):
+    """Remplace (en place) les codes de non-réponse EVS par NaN, une fois au chargement."""
+    for col in df.select_dtypes('number').columns:
+        is_code = df[col].isin(MISSING_CODES)
+        if is_code.any():
+            df[col] = df[col].mask(is_code)
+    return df
+
+
+def stratified_sample(df_full, fraction=0.1, min_rows=30, seed=0):
+    """Échantillon aléatoire stratifié par pays : `fraction` des lignes de chaque pays.
+
+    Au moins `min_rows` lignes par pays (toutes si le pays en a moins), pour
+    que les petits pays restent représentés. Ordre des lignes conservé.
+    """
+    rng = np.random.default_rng(seed)
+    picked = []
+    for rows in df_full.groupby(COUNTRY_COL, sort=True).indices.values():
+        size = min(len(rows), max(min_rows, int(np.ceil(fraction * len(rows)))))
+        picked.append(rng.choice(rows, size, replace=False))
+    rows = np.sort(np.concatenate(picked)) if picked else np.array([], dtype=int)
+    return df_full.iloc[rows].reset_index(drop=True)
+
+
+# ─── VARIABLES ───────────────────────────────────────────────────────────────
+def flat_variables():
+    """{libellé: (colonne, échelle)} pour toutes les variables de THEMES."""
+    flat = {}
+    for theme_vars in THEMES.values():
+        flat.update(theme_vars)
+    return flat
+
+
+def scale_bounds(scale):
+    """(min, max) d'une échelle décrite dans THEMES, ex. "1=Jamais → 10=Toujours" → (1, 10)."""
+    bounds = [int(v) for v in re.findall(r'(-?\d+)=', scale)]
+    return bounds[0], bounds[-1]
+
+
+def resolve_variable(name):
+    """Retrouve (libellé, colonne, échelle) à partir d'un libellé ou d'un nom de colonne."""
+    for label, (col, scale) in flat_variables().items():
+        if name in (label, col):
+            return label, col, scale
+    return None
+
+
+def country_frame(df_full, codes):
+    """Filtre les pays sélectionnés et ajoute la colonne 'Pays' (nom complet)."""
+    df = df_full[df_full[COUNTRY_COL].isin(codes)].copy()
+    df['Pays'] = df[COUNTRY_COL].map(lambda x: COUNTRY_NAMES.get(x, x))
+    return df
+
+
+# ─── CATALOGUE DES COLONNES ──────────────────────────────────────────────────
+CATALOG_COLUMNS = ['Type', 'Valeurs distinctes', 'Min', 'Max', 'Manquants (%)', 'Pays']
+# Au-delà, une colonne est continue (poids, identifiants) : sa distribution par valeur
+# (tableau pays × valeur) serait aussi grande que les données, elle n'est pas proposée
+CATALOG_MAX_DISTINCT = 100
+
+
+class ColumnCatalog:
+    """Catalogue de toutes les colonnes d'un dataset, construit une fois au chargement.
+
+    `table` : une ligne par colonne (CATALOG_COLUMNS, 'Libellé' THEMES le cas
+    échéant) ; `availability` : matrice booléenne colonnes × pays (au moins
+    une réponse valide). La recherche par sous-chaîne parcourt une seule
+    chaîne (noms et libellés en minuscules, un par ligne) : aucune lecture
+    des données à la sélection.
+    """
+
+    def __init__(self, table, availability, codes):
+        self.table = table
+        self.availability = availability
+        self.codes = np.asarray(codes)
+        keys = [f"{col} {label}".casefold() for col, label in zip(table.index, table['Libellé'])]
+        self._text = "\n".join(keys)
+        self._starts = np.cumsum([0] + [len(k) + 1 for k in keys[:-1]])
+
+    @classmethod
+    def from_rows(cls, df_full, country_idx, codes, valid_masks=None):
+        """Catalogue des lignes répondants (`country_idx` : indice du pays de chaque ligne, -1 sinon)."""
+        labels = {col: label for label, (col, _) in flat_variables().items()}
+        valid_masks = valid_masks or {}
+        known = country_idx >= 0
+        rows, availability = [], []
+        for col in df_full.columns:
+            series = df_full[col]
+            numeric = pd.api.types.is_numeric_dtype(series)
+            if numeric:
+                values = series.to_numpy(dtype=float)
+                valid = valid_masks.get(col)
+                valid = ~np.isnan(values) if valid is None else valid
+                present = values[valid]
+                distinct = len(pd.unique(present))
+                low, high = (present.min(), present.max()) if len(present) else (np.nan, np.nan)
+            else:
+                valid = series.notna().to_numpy()
+                distinct = series.nunique()
+                low = high = np.nan
+            countries = np.bincount(country_idx[valid & known], minlength=len(codes)) > 0
+            availability.append(countries)
+            rows.append((labels.get(col, ''), str(series.dtype) if not numeric else 'numérique',
+                         distinct, low, high, 100 * (1 - valid.mean()) if len(valid) else 0.0,
+                         int(countries.sum())))
+        table = pd.DataFrame(rows, index=pd.Index(df_full.columns, name='Colonne'),
+                             columns=['Libellé', *CATALOG_COLUMNS])
+        return cls(table, np.array(availability, dtype=bool).reshape(len(rows), len(codes)), codes)
+
+    @classmethod
+    def from_frame(cls, df_full):
+        """Catalogue d'un DataFrame de lignes répondants (sans backend)."""
+        country = df_full[COUNTRY_COL].astype('category')
+        return cls.from_rows(df_full, country.cat.codes.to_numpy(), np.asarray(country.cat.categories))
+
+    def memory_bytes(self):
+        return (int(self.table.memory_usage(index=True, deep=True).sum())
+                + self.availability.nbytes + len(self._text))
+
+    def categorical(self, col_name, max_distinct=CATALOG_MAX_DISTINCT):
+        """Colonne numérique connue d'au plus `max_distinct` valeurs distinctes (analysable par valeur)."""
+        if col_name not in self.table.index:
+            return False
+        info = self.table.loc[col_name]
+        return info['Type'] == 'numérique' and info['Valeurs distinctes'] <= max_distinct
+
+    def search(self, query, numeric=False, limit=None, max_distinct=None):
+        """Colonnes dont le nom ou le libellé contient `query` (casse ignorée), dans l'ordre du dataset.
+
+        `numeric` : colonnes numériques seulement ; `max_distinct` : et au plus autant
+        de valeurs distinctes.
+        """
+        needle = query.strip().casefold()
+        if not needle or "\n" in needle:
+            return []
+        hits = [self._starts.searchsorted(m.start(), side='right') - 1
+                for m in re.finditer(re.escape(needle), self._text)]
+        columns = [self.table.index[i] for i in dict.fromkeys(hits)]
+        if numeric:
+            columns = [col for col in columns if self.table.at[col, 'Type'] == 'numérique']
+        if max_distinct is not None:
+            columns = [col for col in columns if self.table.at[col, 'Valeurs distinctes'] <= max_distinct]
+        return columns[:limit]
+
+    def missing_countries(self, col_name, codes):
+        """Pays de `codes` sans aucune réponse valide pour la colonne (aucun si elle est inconnue)."""
+        if col_name not in self.table.index:
+            return []
+        available = set(self.codes[self.availability[self.table.index.get_loc(col_name)]])
+        return [c for c in codes if c not in available]
+
+    def describe(self, col_name):
+        """Échelle d'une colonne hors THEMES, d'après le catalogue."""
+        info = self.table.loc[col_name]
+        if info['Type'] != 'numérique':
+            return f"Colonne texte · {info['Valeurs distinctes']:,} valeurs distinctes"
+        return (f"Colonne hors thèmes · valeurs {info['Min']:g} à {info['Max']:g} · "
+                f"{info['Valeurs distinctes']:,} valeurs distinctes · {info['Manquants (%)']:.1f} % manquants")
+
+
+# ─── INDICES COMPOSITES ──────────────────────────────────────────────────────
+# Un indice = moyenne d'items ramenés sur [0, 1] d'après les bornes de leur
+# échelle (THEMES), inversés si besoin pour que « plus haut » ait le même sens,
+# puis exprimée sur 0-10. Définition : tuple de (colonne, inverser).
+COMPOSITE_THEME = "🧮 Indices composites"
+COMPOSITE_SCALE = "0=Faible → 10=Élevé (indice composite)"
+# Part minimale d'items renseignés pour qu'un répondant reçoive un score
+COMPOSITE_MIN_SHARE = 0.5
+
+def _theme_items(theme, labels, reverse):
+    return tuple((THEMES[theme][label][0], reverse) for label in labels)
+
+
+# Sens : tous les items orientés pour que 10 = davantage de confiance / de libéralisme
+COMPOSITE_PRESETS = {
+    "Confiance interpersonnelle": _theme_items("🤝 Confiance", list(THEMES["🤝 Confiance"]), True),
+    "Confiance institutionnelle": _theme_items(
+        "🏛️ Institutions & Démocratie", [l for l in THEMES["🏛️ Institutions & Démocratie"] if l.startswith("Confiance:")], True),
+    "Libéralisme moral": _theme_items(
+        "👥 Valeurs sociales",
+        ["Homophobie (homosexualité justifiable)", "Avortement (justifiable)",
+         "Divorce (justifiable)", "Euthanasie (justifiable)"], False),
+}
+
+
+COMPOSITE_PREFIX = "Indice: "
+
+
+def composite_column(name, items):
+    """Nom de colonne d'un indice : unique par définition (nom + items + sens)."""
+    return f"{COMPOSITE_PREFIX}{name} #{_fingerprint(tuple(items))[:8]}"
+
+
+def composite_label(name):
+    """Libellé d'un indice dans le thème COMPOSITE_THEME."""
+    return f"Indice : {name}"
+
+
+def composite_scores(columns, items, min_share=COMPOSITE_MIN_SHARE):
+    """Score 0-10 par ligne, calculé en une passe vectorisée sur les items.
+
+    `columns` : colonne → tableau numpy des réponses (NaN = manquant).
+    """
+    scales = {col: scale for col, scale in flat_variables().values()}
+    rescaled = []
+    for col, reverse in items:
+        lo, hi = scale_bounds(scales[col])
+        unit = (np.asarray(columns[col], dtype=float) - lo) / (hi - lo)
+        rescaled.append(1 - unit if reverse else unit)
+    stacked = np.vstack(rescaled)
+    answered = (~np.isnan(stacked)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = np.nansum(stacked, axis=0) / answered * 10
+    return np.where(answered >= min_share * len(items), scores, np.nan)
+
+
+# ─── AGRÉGATIONS ─────────────────────────────────────────────────────────────
+def compute_stats(data_var, col_name):
+    """Moyenne, écart-type, IC95, N et médiane par pays (lignes sans NaN)."""
+    grouped = data_var.groupby('Pays')[col_name].agg(['mean', 'std', 'count', 'median'])
+    n = grouped['count'].astype(float)
+    ci = (1.96 * grouped['std'] / np.sqrt(n)).where(n > 1, 0.0)
+    stats = pd.DataFrame({
+        'Moyenne': grouped['mean'],
+        'Écart-type': grouped['std'],
+        'IC95': ci,
+        'N': n,
+        'Médiane': grouped['median'],
+    })
+    return stats.reset_index()
+
+
+def distribution_pivot(data_var, col_name):
+    """Tableau croisé pays × valeur : (volumes, pourcentages)."""
+    pivot = (data_var.groupby(['Pays', col_name])
+             .size()
+             .unstack(fill_value=0))
+    pivot_pct = pivot.div(pivot.sum(axis=1), axis=0) * 100
+    return pivot, pivot_pct
+
+
+def country_means(df, columns):
+    """Moyennes par pays pour plusieurs variables : {libellé: colonne} → DataFrame."""
+    return pd.DataFrame({label: df.groupby('Pays')[col].mean() for label, col in columns.items()})
+
+
+def weighted_counts(group_idx, values, weights, n_groups):
+    """Poids cumulés par groupe × valeur, en un np.bincount sur les codes de réponse.
+
+    Renvoie (valeurs distinctes triées, Σw [groupes × valeurs], N [groupes],
+    Σw² [groupes]) : tout ce qu'il faut pour les moyennes, quantiles,
+    distributions et effectifs efficaces pondérés.
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    group_idx = group_idx.astype(np.int64)
+    shape = (n_groups, len(uniques))
+    volume = np.bincount(group_idx * len(uniques) + inverse, weights=weights,
+                         minlength=shape[0] * shape[1]).reshape(shape)
+    n = np.bincount(group_idx, minlength=n_groups)
+    sum_w2 = np.bincount(group_idx, weights=weights ** 2, minlength=n_groups)
+    return uniques, volume, n, sum_w2
+
+
+def weighted_stats(uniques, volume, n, sum_w2):
+    """Colonnes de compute_stats pondérées, plus 'N effectif' (Kish : (Σw)² / Σw²).
+
+    N reste le nombre de répondants. L'écart-type est corrigé en N effectif
+    (même estimateur que compute_stats pour des poids égaux à 1) et l'IC95 de
+    la moyenne vaut 1,96 · σ / √N effectif. Médiane : première valeur où le
+    poids cumulé atteint la moitié du total, moyennée avec la suivante si la
+    moitié tombe exactement entre deux valeurs (comme pour N pair).
+    """
+    n = n.astype(float)
+    total = volume.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = volume @ uniques / total
+        n_eff = total ** 2 / sum_w2
+        dev2 = ((uniques[None, :] - mean[:, None]) ** 2 * volume).sum(axis=1)
+        std = np.sqrt(np.where(n > 1, dev2 / total * n_eff / (n_eff - 1), np.nan))
+        ci = np.where(n > 1, 1.96 * std / np.sqrt(n_eff), 0.0)
+
+    cum = np.cumsum(volume, axis=1)
+    half, tol = (total / 2)[:, None], (total * 1e-12)[:, None]
+    median = np.full(len(n), np.nan)
+    if len(uniques):
+        lo = np.argmax(cum >= half - tol, axis=1)
+        hi = np.argmax(cum > half + tol, axis=1)
+        median = np.where(total > 0, (uniques[lo] + uniques[hi]) / 2, np.nan)
+    return pd.DataFrame({
+        'Moyenne': mean,
+        'Écart-type': std,
+        'IC95': ci,
+        'N': n,
+        'Médiane': median,
+        'N effectif': n_eff,
+    })
+
+
+def stats_from_counts(counts):
+    """Même résultat que compute_stats, à partir de volumes par valeur.
+
+    `counts` : colonnes 'Pays', 'Valeur', 'Volume' (une ligne par pays × valeur).
+    """
+    counts = counts[counts['Volume'] > 0].sort_values(['Pays', 'Valeur'])
+    by_country = counts.groupby('Pays')
+    n = by_country['Volume'].sum().astype(float)
+    mean = (counts['Valeur'] * counts['Volume']).groupby(counts['Pays']).sum() / n
+    dev = counts['Valeur'] - counts['Pays'].map(mean)
+    var = (dev ** 2 * counts['Volume']).groupby(counts['Pays']).sum() / (n - 1)
+    std = np.sqrt(var.where(n > 1))
+    ci = (1.96 * std / np.sqrt(n)).where(n > 1, 0.0)
+
+    # Médiane : moyenne des valeurs aux rangs (n-1)//2 et n//2 de la série triée
+    cum = by_country['Volume'].cumsum()
+    rank_lo = counts['Pays'].map((n - 1) // 2)
+    rank_hi = counts['Pays'].map(n // 2)
+    lo = counts['Valeur'][cum > rank_lo].groupby(counts['Pays']).first()
+    hi = counts['Valeur'][cum > rank_hi].groupby(counts['Pays']).first()
+
+    stats = pd.DataFrame({
+        'Moyenne': mean,
+        'Écart-type': std,
+        'IC95': ci,
+        'N': n,
+        'Médiane': (lo + hi) / 2,
+    })
+    stats.index.name = 'Pays'
+    return stats.reset_index()
+
+
+# ─── TESTS PAR PAIRES DE PAYS ────────────────────────────────────────────────
+PAIRWISE_TESTS = {'welch': "t de Welch (moyennes)", 'proportion': "Test de proportions"}
+CORRECTIONS = {'holm': "Holm", 'bonferroni': "Bonferroni", 'fdr_bh': "Benjamini-Hochberg (FDR)"}
+
+
+def is_binary_scale(scale):
+    lo, hi = scale_bounds(scale)
+    return hi - lo == 1
+
+
+def _two_sided_p(stat, df=None):
+    """P-valeur bilatérale (loi de Student si `df`, sinon normale), vectorisée."""
+    stat = np.abs(stat)
+    try:
+        from scipy import stats as sp_stats
+        return 2 * (sp_stats.t.sf(stat, df) if df is not None else sp_stats.norm.sf(stat))
+    except ImportError:
+        # Sans scipy : approximation normale (N de plusieurs centaines par pays)
+        from math import erfc
+        return np.frompyfunc(lambda z: erfc(z / np.sqrt(2)), 1, 1)(stat).astype(float)
+
+
+def adjust_pvalues(pvalues, method='holm'):
+    """Correction pour comparaisons multiples (les NaN sont ignorés)."""
+    p = np.asarray(pvalues, dtype=float)
+    adjusted = np.full_like(p, np.nan)
+    valid = ~np.isnan(p)
+    m = int(valid.sum())
+    if m == 0:
+        return adjusted
+    order = np.argsort(p[valid])
+    ranked = p[valid][order]
+    if method == 'bonferroni':
+        out = ranked * m
+    elif method == 'holm':
+        out = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == 'fdr_bh':
+        out = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"Correction inconnue : {method}")
+    result = np.empty(m)
+    result[order] = np.minimum(out, 1.0)
+    adjusted[valid] = result
+    return adjusted
+
+
+def pairwise_tests(stats, test='welch', correction='holm', scale=None):
+    """Écarts et p-valeurs corrigées pour toutes les paires de pays.
+
+    Calcul en une diffusion numpy sur les statistiques suffisantes par pays
+    (N, moyenne, écart-type de compute_stats ; N effectif en mode pondéré) :
+    pas de boucle sur les paires.
+    'welch' compare les moyennes (t de Welch, ddl de Welch-Satterthwaite) ;
+    'proportion' compare la part de réponses à la borne haute d'une échelle
+    à deux valeurs (test z à variance poolée).
+
+    Renvoie (écarts ligne − colonne, p-valeurs corrigées), deux DataFrames
+    pays × pays dans l'ordre de `stats`.
+    """
+    names = stats['Pays'].to_numpy()
+    # Mode pondéré : l'effectif efficace remplace N dans les erreurs types
+    n = stats['N effectif' if 'N effectif' in stats else 'N'].to_numpy(dtype=float)
+    mean = stats['Moyenne'].to_numpy(dtype=float)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if test == 'welch':
+            se2 = stats['Écart-type'].to_numpy(dtype=float) ** 2 / n
+            diff = mean[:, None] - mean[None, :]
+            pair_se2 = se2[:, None] + se2[None, :]
+            df = pair_se2 ** 2 / (se2[:, None] ** 2 / (n[:, None] - 1) + se2[None, :] ** 2 / (n[None, :] - 1))
+            pvalues = _two_sided_p(diff / np.sqrt(pair_se2), df)
+        elif test == 'proportion':
+            lo, hi = scale_bounds(scale)
+            share = (mean - lo) / (hi - lo)
+            diff = share[:, None] - share[None, :]
+            pooled = (share * n)[:, None] + (share * n)[None, :]
+            pooled /= n[:, None] + n[None, :]
+            se = np.sqrt(pooled * (1 - pooled) * (1 / n[:, None] + 1 / n[None, :]))
+            pvalues = _two_sided_p(diff / se)
+        else:
+            raise ValueError(f"Test inconnu : {test}")
+
+    # Correction sur les k(k-1)/2 paires distinctes, puis matrice symétrique
+    upper = np.triu_indices(len(names), 1)
+    adjusted = np.full((len(names), len(names)), np.nan)
+    adjusted[upper] = adjust_pvalues(pvalues[upper], correction)
+    adjusted.T[upper] = adjusted[upper]
+    np.fill_diagonal(diff, np.nan)
+
+    index = pd.Index(names, name='Pays')
+    return pd.DataFrame(diff, index=index, columns=names), pd.DataFrame(adjusted, index=index, columns=names)
+
+
+# ─── DIVERGENCE DES DISTRIBUTIONS ────────────────────────────────────────────
+# Deux pays de même moyenne peuvent répondre de façon consensuelle (réponses
+# groupées) ou polarisée (deux camps aux extrêmes) : comparaison des
+# distributions entières, à partir des histogrammes pays × valeur (volumes,
+# pondérés le cas échéant), toutes les paires en une opération vectorisée.
+DIVERGENCES = {'jensen_shannon': "Jensen-Shannon", 'wasserstein': "Wasserstein (points d'échelle)"}
+# Taille maximale (pays × pays × valeurs) d'un bloc de calcul : mémoire bornée
+# pour les variables continues à nombreuses valeurs distinctes
+DIVERGENCE_BLOCK_CELLS = 4_000_000
+
+
+def _histogram_shares(pivot):
+    """(parts par pays × valeur, valeurs) des pays ayant au moins une réponse."""
+    volume = pivot.to_numpy(dtype=float)
+    total = volume.sum(axis=1, keepdims=True)
+    return volume / np.where(total > 0, total, 1), pivot.columns.to_numpy(dtype=float)
+
+
+def _p_log_ratio(p, q):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(p > 0, p * np.log2(p / q), 0.0).sum(axis=-1)
+
+
+def distribution_divergence(pivot, method='jensen_shannon'):
+    """Matrice pays × pays de divergence entre distributions de réponses.
+
+    `pivot` : volumes pays × valeur (distribution_pivot, backend.distribution).
+    'jensen_shannon' : divergence de Jensen-Shannon en bits, de 0 (mêmes
+    distributions) à 1 (aucune réponse en commun), indépendante de l'ordre
+    des valeurs. 'wasserstein' : distance de transport optimal (aire entre
+    les fonctions de répartition), en points de l'échelle.
+    """
+    pivot = pivot[pivot.sum(axis=1) > 0]
+    shares, values = _histogram_shares(pivot)
+    n, k = shares.shape
+    if method == 'wasserstein':
+        shares, steps = np.cumsum(shares, axis=1)[:, :-1], np.diff(values)
+    divergence = np.zeros((n, n))
+    block = max(1, DIVERGENCE_BLOCK_CELLS // max(1, n * k))
+    for start in range(0, n, block):
+        p = shares[start:start + block, None, :]
+        q = shares[None, :, :]
+        if method == 'wasserstein':
+            divergence[start:start + block] = (np.abs(p - q) * steps).sum(axis=2)
+        else:
+            m = (p + q) / 2
+            divergence[start:start + block] = (_p_log_ratio(p, m) + _p_log_ratio(q, m)) / 2
+    divergence = np.clip(divergence, 0, None)
+    np.fill_diagonal(divergence, 0)
+    return pd.DataFrame(divergence, index=pivot.index, columns=pivot.index)
+
+
+def polarisation_index(pivot, bounds=None):
+    """Polarisation des réponses par pays : 0 = consensus, 1 = deux camps aux extrêmes.
+
+    Écart moyen entre deux répondants (différence moyenne de Gini, 2 Σ F(1 − F) Δv)
+    rapporté à la demi-étendue de l'échelle : `bounds` (min, max) de l'échelle
+    THEMES, sinon valeurs observées.
+    """
+    pivot = pivot[pivot.sum(axis=1) > 0]
+    shares, values = _histogram_shares(pivot)
+    cdf = np.cumsum(shares, axis=1)[:, :-1]
+    mean_difference = 2 * (cdf * (1 - cdf) * np.diff(values)).sum(axis=1)
+    low, high = bounds if bounds is not None else (values.min(initial=0), values.max(initial=0))
+    index = mean_difference / ((high - low) / 2) if high > low else np.zeros(len(pivot))
+    return pd.Series(index, index=pivot.index, name='Polarisation')
+
+
+# ─── BACKENDS ────────────────────────────────────────────────────────────────
+def _fingerprint(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _frame_digest(df):
+    """Empreinte des valeurs d'un DataFrame (deux datasets de même forme restent distincts)."""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()[:16]
+
+
+def _file_stamp(path):
+    """Taille et date de modification : change dès que le fichier est réécrit."""
+    info = os.stat(path)
+    return info.st_size, info.st_mtime_ns
+
+
+def _select_countries(table, codes):
+    """Lignes (index 'Pays') des pays choisis, dans l'ordre du tableau."""
+    names = {COUNTRY_NAMES.get(c, c) for c in codes}
+    return table[table.index.isin(names)]
+
+
+def _select_distribution(pivot, codes):
+    """Sous-tableau pays × valeur : seules les valeurs observées dans la sélection."""
+    pivot = _select_countries(pivot, codes)
+    pivot = pivot.loc[:, (pivot != 0).any()]
+    pivot_pct = pivot.div(pivot.sum(axis=1), axis=0) * 100
+    return pivot, pivot_pct
+
+
+def _row_value_counts(pivot, code):
+    name = COUNTRY_NAMES.get(code, code)
+    if name not in pivot.index:
+        return pd.Series(dtype='int64', name='count')
+    row = pivot.loc[name]
+    row = row[row > 0]
+    return pd.Series(row.values, index=row.index.values, name='count')
+
+
+# Les onglets interrogent un backend plutôt que le DataFrame directement :
+#   RowBackend       → lignes répondants (dataset complet en mémoire)
+#   CountsBackend    → volumes par pays × variable × valeur (artefact d'agrégats)
+#   SqlBackend       → requêtes sur une base SQL embarquée (SQLite / DuckDB)
+#   PartitionBackend → partitions pays d'une vague, lues à la demande
+#   MultiWaveBackend → plusieurs vagues juxtaposées (une ligne par pays × vague)
+# Pour une même vague, RowBackend, CountsBackend, SqlBackend et PartitionBackend
+# renvoient exactement les mêmes tableaux (vérifié par evs_equivalence.py) ;
+# MultiWaveBackend réétiquette ceux de chaque vague.
+
+class RowBackend:
+    """Agrégats calculés sur les lignes répondants.
+
+    Le dataset doit déjà être passé par sanitize_missing_codes. Les masques de
+    validité (réponse non manquante) sont calculés une fois par colonne, ainsi
+    que les sommes et volumes par pays : les moyennes ne recopient plus les
+    lignes filtrées à chaque rerun.
+
+    Avec `weight_col`, tous les agrégats sont pondérés par cette colonne
+    (poids manquants ou négatifs comptés 0) : les distributions sont des
+    poids cumulés et les stats ont une colonne 'N effectif'.
+    """
+
+    row_level = True
+
+    def __init__(self, df_full, weight_col=None):
+        self.df_full = df_full
+        self.n_rows = len(df_full)
+        self.weight_col = weight_col
+        self._weights = None
+        if weight_col:
+            if weight_col not in df_full.columns:
+                raise ValueError(f"Colonne de poids absente du dataset : {weight_col}")
+            weights = df_full[weight_col].to_numpy(dtype=float)
+            self._weights = np.where(weights > 0, weights, 0.0)
+        country = df_full[COUNTRY_COL].astype('category')
+        self._codes = np.asarray(country.cat.categories)
+        self._names = np.array([COUNTRY_NAMES.get(c, c) for c in self._codes], dtype=object)
+        self._country_idx = country.cat.codes.to_numpy()
+        self._sizes = np.bincount(self._country_idx[self._country_idx >= 0], minlength=len(self._codes))
+        self._valid = {}
+        self._sums = {}
+        self._tables = {}
+        self._derived = {}   # indices composites : colonne → scores par ligne
+        for col, _ in flat_variables().values():
+            if col in df_full.columns:
+                self.valid_mask(col)
+        # Identifie le dataset (contenu compris) dans les clés de cache, y compris sur disque
+        self.version = _fingerprint('rows', self.n_rows, list(df_full.columns), self._sizes.tolist(),
+                                    _frame_digest(df_full), *([weight_col] if weight_col else []))
+
+    def memory_bytes(self):
+        masks = sum(m.nbytes for m in self._valid.values())
+        derived = sum(v.nbytes for v in self._derived.values())
+        sums = sum(a.nbytes for pair in self._sums.values() for a in pair)
+        # Tableaux par pays déjà calculés (stats, pays × valeur) : grandissent à chaque variable
+        tables = sum(int(t.memory_usage(index=True, deep=False).sum())
+                     for pair in list(self._tables.values()) for t in pair)
+        return int(self.df_full.memory_usage(index=True, deep=False).sum()) + masks + derived + sums + tables
+
+    def countries(self):
+        return [c for c, n in zip(self._codes, self._sizes) if n > 0]
+
+    def n_respondents(self, codes):
+        sizes = dict(zip(self._codes, self._sizes))
+        return {c: int(sizes.get(c, 0)) for c in codes}
+
+    def has_variable(self, col_name):
+        return col_name in self.df_full.columns or col_name in self._derived
+
+    def _values(self, col_name):
+        derived = self._derived.get(col_name)
+        return derived if derived is not None else self.df_full[col_name].to_numpy()
+
+    def add_composite(self, col_name, items):
+        """Ajoute un indice composite comme variable (calculé une fois par définition).
+
+        Renvoie False si un item manque dans le dataset.
+        """
+        if col_name in self._derived:
+            return True
+        if not all(col in self.df_full.columns for col, _ in items):
+            return False
+        self._derived[col_name] = composite_scores({col: self._values(col) for col, _ in items}, items)
+        return True
+
+    def valid_mask(self, col_name):
+        """Masque booléen des réponses valides (calculé une fois par colonne)."""
+        mask = self._valid.get(col_name)
+        if mask is None:
+            mask = ~pd.isna(self._values(col_name))
+            self._valid[col_name] = mask
+        return mask
+
+    def valid_counts(self):
+        """Nombre de réponses valides par colonne déjà indexée."""
+        return {col: int(mask.sum()) for col, mask in self._valid.items()}
+
+    def survey_year(self, code):
+        if 'Year survey' not in self.df_full.columns:
+            return None
+        years = self.df_full.loc[self._country_rows([code]), 'Year survey'].mode()
+        return int(years[0]) if len(years) else None
+
+    def _country_rows(self, codes):
+        wanted = np.flatnonzero(np.isin(self._codes, codes))
+        return np.isin(self._country_idx, wanted)
+
+    def _valid_rows(self, col_name, codes):
+        return np.flatnonzero(self._country_rows(codes) & self.valid_mask(col_name))
+
+    def _country_sums(self, col_name):
+        """(sommes, volumes) des réponses valides par pays, mis en cache par colonne.
+
+        En mode pondéré : (Σ poids × valeur, Σ poids).
+        """
+        sums = self._sums.get(col_name)
+        if sums is None:
+            mask = self.valid_mask(col_name) & (self._country_idx >= 0)
+            idx = self._country_idx[mask]
+            values = self._values(col_name).astype(float)[mask]
+            weights = None if self._weights is None else self._weights[mask]
+            sums = (np.bincount(idx, weights=values if weights is None else values * weights,
+                                minlength=len(self._codes)),
+                    np.bincount(idx, weights=weights, minlength=len(self._codes)))
+            self._sums[col_name] = sums
+        return sums
+
+    def variable_frame(self, col_name, codes):
+        """Lignes ['Pays', code, variable] des pays choisis, sans valeur manquante."""
+        rows = self._valid_rows(col_name, codes)
+        idx = self._country_idx[rows]
+        return pd.DataFrame({
+            'Pays': self._names[idx],
+            COUNTRY_COL: self._codes[idx],
+            col_name: self._values(col_name)[rows],
+        })
+
+    def _country_tables(self, col_name):
+        """(stats, volumes par valeur) de tous les pays pour une variable, calculés une fois.
+
+        Les statistiques d'un pays ne dépendent pas des autres pays sélectionnés :
+        toute sélection se lit ensuite dans ces tableaux.
+        """
+        tables = self._tables.get(col_name)
+        if tables is None:
+            if self._weights is not None:
+                tables = self._weighted_tables(col_name)
+            else:
+                data_var = self.variable_frame(col_name, self._codes)
+                pivot, _ = distribution_pivot(data_var, col_name)
+                tables = (compute_stats(data_var, col_name).set_index('Pays'), pivot)
+            self._tables[col_name] = tables
+        return tables
+
+    def _weighted_tables(self, col_name):
+        """_country_tables pondéré : une table pays × valeur de poids cumulés (weighted_counts)."""
+        rows = self._valid_rows(col_name, self._codes)
+        uniques, volume, n, sum_w2 = weighted_counts(
+            self._country_idx[rows], self._values(col_name)[rows].astype(float),
+            self._weights[rows], len(self._codes))
+        present = np.flatnonzero(n > 0)
+        order = present[np.argsort(self._names[present], kind='stable')]
+        index = pd.Index(self._names[order], name='Pays')
+        stats = weighted_stats(uniques, volume[order], n[order], sum_w2[order]).set_axis(index)
+        pivot = pd.DataFrame(volume[order], index=index, columns=pd.Index(uniques, name=col_name))
+        return stats, pivot
+
+    def warm(self, col_name):
+        """Précalcule les agrégats par pays d'une variable (préchauffage)."""
+        self._country_sums(col_name)
+        self._country_tables(col_name)
+
+    def catalog(self):
+        """Catalogue de toutes les colonnes du dataset (ColumnCatalog)."""
+        return ColumnCatalog.from_rows(self.df_full, self._country_idx, self._codes, self._valid)
+
+    def warmed(self, col_name):
+        """Agrégats par pays de la variable déjà calculés : toute sélection est instantanée."""
+        return col_name in self._sums and col_name in self._tables
+
+    def stats(self, col_name, codes):
+        stats, _ = self._country_tables(col_name)
+        return _select_countries(stats, codes).reset_index()
+
+    def distribution(self, col_name, codes):
+        _, pivot = self._country_tables(col_name)
+        return _select_distribution(pivot, codes)
+
+    def means(self, columns, codes):
+        present = [i for i in np.flatnonzero(np.isin(self._codes, codes)) if self._sizes[i] > 0]
+        agg = {}
+        for label, col in columns.items():
+            sums, counts = self._country_sums(col)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                agg[label] = sums[present] / counts[present]
+        means = pd.DataFrame(agg, index=pd.Index(self._names[present], name='Pays'), columns=list(columns))
+        return means.sort_index()
+
+    def pooled_mean(self, col_name, codes):
+        sums, counts = self._country_sums(col_name)
+        wanted = np.isin(self._codes, codes)
+        n = counts[wanted].sum()
+        return sums[wanted].sum() / n if n else np.nan
+
+    def value_counts(self, col_name, code):
+        _, pivot = self._country_tables(col_name)
+        return _row_value_counts(pivot, code)
+
+    def iter_rows(self, columns, codes, chunk_rows=MICRODATA_CHUNK_ROWS):
+        """Lignes répondants des pays choisis (colonnes `columns`), par blocs de `chunk_rows`.
+
+        Seul le bloc courant est copié, jamais la sélection entière.
+        """
+        rows = np.flatnonzero(self._country_rows(codes))
+        for start in range(0, len(rows), chunk_rows):
+            block = rows[start:start + chunk_rows]
+            yield pd.DataFrame({col: self._values(col)[block] for col in columns})
+
+
+class CountsBackend:
+    """Agrégats calculés à partir de l'artefact de volumes (aucune ligne répondant)."""
+
+    row_level = False
+    weight_col = None
+
+    def __init__(self, aggregates):
+        self.meta = aggregates['countries']
+        self.n_rows = aggregates['source_rows']
+        self._counts = {
+            col: pd.DataFrame(
+                [(code, v, c) for code, pairs in per_country.items() for v, c in pairs],
+                columns=[COUNTRY_COL, 'Valeur', 'Volume'],
+            )
+            for col, per_country in aggregates['counts'].items()
+        }
+        self._tables = {}
+        self.version = _fingerprint('counts', self.n_rows, sorted(self.meta.items()), aggregates['counts'])
+
+    def memory_bytes(self):
+        return int(sum(c.memory_usage(index=True, deep=False).sum() for c in self._counts.values()))
+
+    def countries(self):
+        return sorted(self.meta)
+
+    def n_respondents(self, codes):
+        return {c: int(self.meta.get(c, {}).get('n', 0)) for c in codes}
+
+    def has_variable(self, col_name):
+        return col_name in self._counts
+
+    def survey_year(self, code):
+        return self.meta.get(code, {}).get('year')
+
+    def counts(self, col_name, codes):
+        """Volumes ['Pays', 'Valeur', 'Volume'] des pays choisis."""
+        counts = self._counts[col_name]
+        counts = counts[counts[COUNTRY_COL].isin(codes)].copy()
+        counts['Pays'] = counts[COUNTRY_COL].map(lambda x: COUNTRY_NAMES.get(x, x))
+        return counts[['Pays', 'Valeur', 'Volume']]
+
+    def _country_tables(self, col_name):
+        """(stats, volumes par valeur) de tous les pays pour une variable, calculés une fois."""
+        tables = self._tables.get(col_name)
+        if tables is None:
+            counts = self.counts(col_name, self.countries())
+            pivot = (counts.pivot_table(index='Pays', columns='Valeur', values='Volume',
+                                        aggfunc='sum', fill_value=0)
+                     .sort_index(axis=1))
+            pivot.columns.name = col_name
+            tables = (stats_from_counts(counts).set_index('Pays'), pivot)
+            self._tables[col_name] = tables
+        return tables
+
+    def warm(self, col_name):
+        """Précalcule les agrégats par pays d'une variable (préchauffage)."""
+        self._country_tables(col_name)
+
+    def stats(self, col_name, codes):
+        stats, _ = self._country_tables(col_name)
+        return _select_countries(stats, codes).reset_index()
+
+    def distribution(self, col_name, codes):
+        _, pivot = self._country_tables(col_name)
+        return _select_distribution(pivot, codes)
+
+    def means(self, columns, codes):
+        names = sorted({COUNTRY_NAMES.get(c, c) for c in codes})
+        agg = {}
+        for label, col in columns.items():
+            if col in self._counts:
+                agg[label] = self._country_tables(col)[0]['Moyenne']
+        return pd.DataFrame(agg, columns=list(columns)).reindex(names)
+
+    def pooled_mean(self, col_name, codes):
+        counts = self.counts(col_name, codes)
+        n = counts['Volume'].sum()
+        return (counts['Valeur'] * counts['Volume']).sum() / n if n else np.nan
+
+    def value_counts(self, col_name, code):
+        _, pivot = self._country_tables(col_name)
+        return _row_value_counts(pivot, code)
+
+
+# ─── ARTEFACT D'AGRÉGATS ─────────────────────────────────────────────────────
+AGGREGATES_VERSION = 1
+
+
+class AggregateFold:
+    """Statistiques suffisantes par pays, accumulées bloc de lignes par bloc.
+
+    Pour chaque variable : volume par pays × valeur. Sommes et sommes des
+    carrés s'en déduisent exactement (Σ v·n, Σ v²·n), ainsi que la médiane :
+    le résultat ne dépend pas du découpage en blocs.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.rows = 0
+        self.sizes = None
+        self.years = None
+        self.counts = dict.fromkeys(self.columns)
+
+    @staticmethod
+    def _fold(total, part):
+        return part if total is None else total.add(part, fill_value=0)
+
+    def add(self, chunk):
+        """Replie un bloc (déjà passé par sanitize_missing_codes)."""
+        self.rows += len(chunk)
+        self.sizes = self._fold(self.sizes, chunk.groupby(COUNTRY_COL).size())
+        if 'Year survey' in chunk.columns:
+            self.years = self._fold(self.years, chunk.groupby([COUNTRY_COL, 'Year survey']).size())
+        for col in self.columns:
+            self.counts[col] = self._fold(self.counts[col], chunk.groupby([COUNTRY_COL, col]).size())
+
+    def result(self):
+        """Artefact d'agrégats (même format que build_aggregates)."""
+        # Aucun bloc lu (source vide) : artefact sans pays
+        sizes = self.sizes if self.sizes is not None else pd.Series(dtype='int64')
+        countries = {code: {'n': int(n)} for code, n in sizes.sort_index().items()}
+        if self.years is not None:
+            for code, per_year in self.years.sort_index().groupby(level=0):
+                countries[code]['year'] = int(per_year.idxmax()[1])
+
+        counts = {}
+        for col in self.columns:
+            per_country = {}
+            if self.counts[col] is None:
+                counts[col] = per_country
+                continue
+            for (code, value), n in self.counts[col].sort_index().items():
+                per_country.setdefault(code, []).append([float(value), int(n)])
+            counts[col] = per_country
+
+        return {
+            'version': AGGREGATES_VERSION,
+            'source_rows': int(self.rows),
+            'countries': countries,
+            'counts': counts,
+        }
+
+
+def _aggregate_columns(available, columns):
+    """Variables à agréger (THEMES par défaut) présentes dans `available` (toutes si None)."""
+    if columns is None:
+        columns = [col for col, _ in flat_variables().values()]
+    return [c for c in dict.fromkeys(columns) if available is None or c in available]
+
+
+def build_aggregates(df_full, columns=None):
+    """Volumes par pays × variable × valeur pour toutes les variables de THEMES.
+
+    `df_full` doit déjà être passé par sanitize_missing_codes.
+    """
+    fold = AggregateFold(_aggregate_columns(df_full.columns, columns))
+    fold.add(df_full)
+    return fold.result()
+
+
+# Lecture par blocs : ~8 octets par cellule lue, ×4 pour les tampons du
+# parseur CSV et les groupby du bloc.
+CHUNK_BYTES_PER_CELL = 8 * 4
+
+
+def chunk_rows_for(n_columns, max_memory_mb):
+    """Nombre de lignes par bloc pour rester sous `max_memory_mb` Mo."""
+    return max(1_000, int(max_memory_mb * MB / (n_columns * CHUNK_BYTES_PER_CELL)))
+
+
+@contextmanager
+def _csv_chunks(path, columns, chunk_rows):
+    """Blocs de lignes nettoyés du CSV, lus en une seule ouverture de la source.
+
+    Seules les colonnes pays, année et `columns` (variables de THEMES par
+    défaut) sont lues ; l'en-tête est celui du premier bloc, sans relire la
+    source (une release GitHub n'est téléchargée qu'une fois). Donne
+    (variables présentes dans le fichier, itérateur des blocs).
+    """
+    wanted = {COUNTRY_COL, 'Year survey', *_aggregate_columns(None, columns)}
+    with open_csv(path) as source:
+        reader = pd.read_csv(source, usecols=lambda col: col in wanted, chunksize=chunk_rows)
+        first = next(reader, None)
+        if first is None:
+            yield [], iter(())
+            return
+        chunks = (sanitize_missing_codes(chunk) for chunk in itertools.chain([first], reader))
+        yield _aggregate_columns(first.columns, columns), chunks
+
+
+def stream_aggregates(path=None, columns=None, max_memory_mb=256, chunk_rows=None):
+    """build_aggregates sans charger le fichier en mémoire.
+
+    Le CSV est lu par blocs de lignes, limité aux colonnes utiles (pays,
+    année, variables) ; chaque bloc est nettoyé des codes de non-réponse puis
+    replié dans un AggregateFold. Le pic mémoire dépend de la taille des
+    blocs (`chunk_rows`, sinon déduite de `max_memory_mb`), pas du fichier.
+    """
+    if chunk_rows is None:
+        n_columns = 2 + len(_aggregate_columns(None, columns))
+        chunk_rows = chunk_rows_for(n_columns, max_memory_mb)
+    with _csv_chunks(path, columns, chunk_rows) as (columns, chunks):
+        fold = AggregateFold(columns)
+        for chunk in chunks:
+            fold.add(chunk)
+    return fold.result()
+
+
+def save_aggregates(aggregates, path):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(aggregates, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_aggregates(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        aggregates = json.load(f)
+    if aggregates.get('version') != AGGREGATES_VERSION:
+        raise ValueError(f"Version d'artefact non supportée : {aggregates.get('version')}")
+    return aggregates
+
+
+# ─── DATASET PARTITIONNÉ PAR VAGUE × PAYS ────────────────────────────────────
+# Arborescence :
+#   <racine>/manifest.json
+#   <racine>/wave=<vague>/<code pays>.csv.gz
+# Le manifeste décrit chaque vague (colonnes, pays, lignes, année) : la liste
+# des pays et les effectifs sont connus sans lire aucune partition.
+PARTITIONS_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def load_manifest(root):
+    with open(os.path.join(root, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != PARTITIONS_VERSION:
+        raise ValueError(f"Version de manifeste non supportée : {manifest.get('version')}")
+    return manifest
+
+
+def write_partitions(df_full, root, wave):
+    """Écrit (ou remplace) la vague `wave` : une partition par pays, puis le manifeste.
+
+    `df_full` doit déjà être passé par sanitize_missing_codes. Les autres
+    vagues déjà présentes dans `root` sont conservées.
+    """
+    try:
+        manifest = load_manifest(root)
+    except FileNotFoundError:
+        manifest = {'version': PARTITIONS_VERSION, 'waves': {}}
+    wave_dir = f"wave={wave}"
+    os.makedirs(os.path.join(root, wave_dir), exist_ok=True)
+
+    countries = {}
+    for code, grp in df_full.groupby(COUNTRY_COL):
+        path = f"{wave_dir}/{code}.csv.gz"
+        # Compression rapide : écriture ~5× plus rapide qu'au niveau 9 par défaut
+        grp.to_csv(os.path.join(root, path), index=False,
+                   compression={'method': 'gzip', 'compresslevel': 1})
+        entry = {'path': path, 'rows': int(len(grp))}
+        if 'Year survey' in grp.columns and grp['Year survey'].notna().any():
+            entry['year'] = int(grp['Year survey'].mode()[0])
+        countries[code] = entry
+
+    manifest['waves'][wave] = {'columns': list(df_full.columns), 'countries': countries}
+    manifest['waves'] = dict(sorted(manifest['waves'].items()))
+    with open(os.path.join(root, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+STATS_COLUMNS = ['Pays', 'Moyenne', 'Écart-type', 'IC95', 'N', 'Médiane']
+
+
+def _concat_pivots(pivots):
+    """Concatène des tableaux pays × valeur (volumes entiers, ou poids cumulés en mode pondéré)."""
+    pivot = _concat_tables(pivots, []).fillna(0)
+    if all(p.dtypes.map(pd.api.types.is_integer_dtype).all() for p in pivots):
+        pivot = pivot.astype('int64')
+    return pivot.sort_index().sort_index(axis=1)
+
+
+def _concat_tables(tables, columns):
+    """Concatène des tableaux par pays (tableau vide aux colonnes `columns` si aucun)."""
+    if tables:
+        return pd.concat(tables)
+    if columns == STATS_COLUMNS:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(columns=columns, index=pd.Index([], name='Pays'), dtype=float)
+
+
+class PartitionBackend:
+    """Agrégats d'une vague lus dans les partitions pays, chargées à la demande.
+
+    Seules les partitions des pays interrogés sont lues (élagage par pays) ;
+    elles sont gardées dans le cache partagé 'partitions' (evs_cache), borné
+    en mémoire. Une requête concatène les seules colonnes utiles des
+    partitions sélectionnées en un RowBackend (pondéré par `weight_col` s'il
+    est donné), agrégé en une passe : les tableaux renvoyés sont identiques à
+    ceux d'un RowBackend sur la vague complète.
+    """
+
+    row_level = True
+
+    def __init__(self, root, wave, manifest=None, weight_col=None):
+        self.root = root
+        self.wave = wave
+        self.weight_col = weight_col
+        entry = (manifest or load_manifest(root))['waves'][wave]
+        self._columns = set(entry['columns'])
+        if weight_col and weight_col not in self._columns:
+            raise ValueError(f"Colonne de poids absente de la vague {wave} : {weight_col}")
+        self._entries = entry['countries']
+        self.n_rows = sum(e['rows'] for e in self._entries.values())
+        self._composites = {}
+        self.version = _fingerprint('partitions', os.path.abspath(root), wave, entry,
+                                    _file_stamp(os.path.join(root, MANIFEST_NAME)),
+                                    *([weight_col] if weight_col else []))
+
+    def memory_bytes(self):
+        # Les partitions chargées sont comptées dans le cache 'partitions'
+        return 0
+
+    def countries(self):
+        return sorted(c for c, e in self._entries.items() if e['rows'] > 0)
+
+    def n_respondents(self, codes):
+        return {c: self._entries[c]['rows'] if c in self._entries else 0 for c in codes}
+
+    def has_variable(self, col_name):
+        return col_name in self._columns or col_name in self._composites
+
+    def survey_year(self, code):
+        return self._entries.get(code, {}).get('year')
+
+    def add_composite(self, col_name, items):
+        """Enregistre un indice composite, calculé sur les colonnes concaténées de ses items."""
+        if not all(col in self._columns for col, _ in items):
+            return False
+        self._composites[col_name] = tuple(items)
+        return True
+
+    def _frame(self, code):
+        def load():
+            # Écrites par write_partitions : codes de non-réponse déjà remplacés
+            return pd.read_csv(os.path.join(self.root, self._entries[code]['path']))
+        return get_cache('partitions').get_or_compute((self.version, code), load)
+
+    def _concat(self, columns, codes):
+        """RowBackend des colonnes `columns` (composites compris) des partitions de `codes`."""
+        sources = [self.weight_col] if self.weight_col else []
+        for col in columns:
+            items = self._composites.get(col)
+            sources += [c for c, _ in items] if items else [col]
+        sources = list(dict.fromkeys(c for c in sources if c in self._columns and c != COUNTRY_COL))
+        frames = [self._frame(code) for code in codes]
+        # Une partition = un pays : colonne pays reconstruite sans relire ses valeurs
+        data = {COUNTRY_COL: pd.Categorical.from_codes(
+            np.repeat(np.arange(len(frames)), [len(f) for f in frames]), categories=list(codes))}
+        for col in sources:
+            data[col] = np.concatenate([f[col].to_numpy() for f in frames]) if frames else np.array([])
+        backend = RowBackend(pd.DataFrame(data), self.weight_col)
+        for col in columns:
+            if col in self._composites:
+                backend.add_composite(col, self._composites[col])
+        return backend
+
+    def _backend(self, columns, codes):
+        """Backend de la requête : celui de tous les pays s'il est préchauffé (warm), sinon
+        celui des seules partitions de `codes`."""
+        cache = get_cache('partitions')
+        columns = tuple(sorted(set(columns)))
+        everywhere = (self.version, 'columns', columns, None)
+        backend = cache.get(everywhere)
+        if backend is not None:
+            return backend
+        codes = tuple(sorted(c for c in set(codes) if c in self._entries))
+        key = everywhere if len(codes) == len(self._entries) else (self.version, 'columns', columns, codes)
+        return cache.get_or_compute(key, lambda: self._concat(columns, codes))
+
+    def warm(self, col_name):
+        """Lit toutes les partitions et précalcule les agrégats de la variable : toute
+        sélection est ensuite servie sans relecture."""
+        self._backend([col_name], self._entries).warm(col_name)
+
+    def stats(self, col_name, codes):
+        return self._backend([col_name], codes).stats(col_name, codes)
+
+    def distribution(self, col_name, codes):
+        return self._backend([col_name], codes).distribution(col_name, codes)
+
+    def means(self, columns, codes):
+        return self._backend(columns.values(), codes).means(columns, codes)
+
+    def pooled_mean(self, col_name, codes):
+        return self._backend([col_name], codes).pooled_mean(col_name, codes)
+
+    def value_counts(self, col_name, code):
+        return self._backend([col_name], [code]).value_counts(col_name, code)
+
+    def iter_rows(self, columns, codes, chunk_rows=MICRODATA_CHUNK_ROWS):
+        # Une partition à la fois, hors cache : l'export ne garde qu'un pays en mémoire
+        for code in sorted(set(codes)):
+            if code in self._entries:
+                yield from self._concat(columns, [code]).iter_rows(columns, [code], chunk_rows)
+
+
+class MultiWaveBackend:
+    """Comparaison de plusieurs vagues : une ligne par pays × vague (« France · 1999 »).
+
+    Couvre la partie de l'interface utilisée par les onglets 1 et 2 (stats,
+    distribution, moyennes) en réétiquetant les tableaux de chaque vague.
+    """
+
+    row_level = True
+
+    def __init__(self, backends):
+        self.backends = dict(backends)   # vague → backend
+        self.n_rows = sum(b.n_rows for b in self.backends.values())
+        self.weight_col = next(iter(self.backends.values())).weight_col
+        self.version = _fingerprint('waves', [(w, b.version) for w, b in self.backends.items()])
+
+    def memory_bytes(self):
+        return sum(b.memory_bytes() for b in self.backends.values())
+
+    def countries(self):
+        return sorted({c for b in self.backends.values() for c in b.countries()})
+
+    def n_respondents(self, codes):
+        sizes = [b.n_respondents(codes) for b in self.backends.values()]
+        return {c: sum(s[c] for s in sizes) for c in codes}
+
+    def has_variable(self, col_name):
+        return any(b.has_variable(col_name) for b in self.backends.values())
+
+    def add_composite(self, col_name, items):
+        added = [b.add_composite(col_name, items) for b in self.backends.values()]
+        return any(added)
+
+    def _waves(self, col_name):
+        return [(w, b) for w, b in self.backends.items() if b.has_variable(col_name)]
+
+    def stats(self, col_name, codes):
+        tables = []
+        for wave, backend in self._waves(col_name):
+            stats = backend.stats(col_name, codes)
+            stats['Pays'] = stats['Pays'] + f" · {wave}"
+            tables.append(stats)
+        stats = _concat_tables(tables, STATS_COLUMNS)
+        return stats.sort_values('Pays', kind='stable').reset_index(drop=True)
+
+    def distribution(self, col_name, codes):
+        pivots, pcts = [], []
+        for wave, backend in self._waves(col_name):
+            pivot, pivot_pct = backend.distribution(col_name, codes)
+            pivots.append(pivot.rename(index=lambda p: f"{p} · {wave}"))
+            pcts.append(pivot_pct.rename(index=lambda p: f"{p} · {wave}"))
+        pivot = _concat_pivots(pivots)
+        pivot_pct = _concat_tables(pcts, []).fillna(0.0).reindex(index=pivot.index, columns=pivot.columns)
+        pivot.columns.name = pivot_pct.columns.name = col_name
+        return pivot, pivot_pct
+
+    def means(self, columns, codes):
+        tables = []
+        for wave, backend in self.backends.items():
+            available = {k: v for k, v in columns.items() if backend.has_variable(v)}
+            means = backend.means(available, codes).reindex(columns=list(columns))
+            tables.append(means.rename(index=lambda p: f"{p} · {wave}"))
+        return _concat_tables(tables, list(columns)).sort_index()
+
+
+# ─── BASE SQL EMBARQUÉE (SQLITE / DUCKDB) ────────────────────────────────────
+# Une table `survey` : code pays, année et variables de THEMES. Le moteur se
+# déduit de l'extension du fichier : .duckdb → DuckDB (paquet optionnel,
+# stockage en colonnes), sinon SQLite (bibliothèque standard). SQLite stocke
+# par lignes : un index couvrant (pays, variable) par variable évite de
+# relire toutes les colonnes à chaque agrégation.
+SQL_TABLE = 'survey'
+
+
+def sql_engine_for(path):
+    return 'duckdb' if str(path).endswith('.duckdb') else 'sqlite'
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_connect(path, read_only=True):
+    if sql_engine_for(path) == 'duckdb':
+        import duckdb
+        return duckdb.connect(str(path), read_only=read_only)
+    import sqlite3
+    if read_only:
+        return sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+    return sqlite3.connect(path)
+
+
+def _write_database(db_path, chunks, columns):
+    """Écrit les blocs (déjà nettoyés) dans une base neuve ; renvoie le nombre de lignes."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    duck = sql_engine_for(db_path) == 'duckdb'
+    con = _sql_connect(db_path, read_only=False)
+    rows = 0
+    try:
+        for chunk in chunks:
+            chunk = chunk.astype({col: float for col in columns})
+            if duck:
+                con.register('chunk', chunk)
+                con.execute(f"INSERT INTO {SQL_TABLE} SELECT * FROM chunk" if rows
+                            else f"CREATE TABLE {SQL_TABLE} AS SELECT * FROM chunk")
+                con.unregister('chunk')
+            else:
+                chunk.to_sql(SQL_TABLE, con, if_exists='append', index=False)
+            rows += len(chunk)
+        if not duck:
+            country = _quote(COUNTRY_COL)
+            con.execute(f"CREATE INDEX idx_country ON {SQL_TABLE} ({country})")
+            for i, col in enumerate(columns):
+                con.execute(f"CREATE INDEX idx_var_{i} ON {SQL_TABLE} ({country}, {_quote(col)})")
+        con.commit()
+    finally:
+        con.close()
+    return rows
+
+
+def write_database(df_full, db_path, columns=None, chunk_rows=100_000):
+    """Base SQL (SQLite, ou DuckDB si `db_path` finit par .duckdb) à partir d'un DataFrame.
+
+    `df_full` doit déjà être passé par sanitize_missing_codes. Il est écrit par
+    tranches de `chunk_rows` lignes (l'insertion convertit chaque tranche en objets Python).
+    """
+    columns = _aggregate_columns(df_full.columns, columns)
+    usecols = [COUNTRY_COL] + (['Year survey'] if 'Year survey' in df_full.columns else []) + columns
+    chunks = (df_full.iloc[start:start + chunk_rows][usecols] for start in range(0, len(df_full), chunk_rows))
+    return _write_database(db_path, chunks, columns)
+
+
+def stream_database(db_path, path=None, columns=None, chunk_rows=100_000):
+    """write_database sans charger le CSV en mémoire (lecture par blocs, source ouverte une fois)."""
+    with _csv_chunks(path, columns, chunk_rows) as (columns, chunks):
+        return _write_database(db_path, chunks, columns)
+
+
+def _composite_sql(items, min_share=COMPOSITE_MIN_SHARE):
+    """Expression SQL d'un indice composite (même calcul que composite_scores)."""
+    scales = {col: scale for col, scale in flat_variables().values()}
+    units, answered = [], []
+    for col, reverse in items:
+        lo, hi = scale_bounds(scales[col])
+        unit = f"(({_quote(col)} - {lo}) / {float(hi - lo)})"
+        units.append(f"COALESCE({'1 - ' + unit if reverse else unit}, 0)")
+        answered.append(f"(CASE WHEN {_quote(col)} IS NULL THEN 0 ELSE 1 END)")
+    n_answered = f"({' + '.join(answered)})"
+    return (f"(CASE WHEN {n_answered} >= {min_share * len(items)} "
+            f"THEN ({' + '.join(units)}) / {n_answered} * 10 END)")
+
+
+class SqlBackend:
+    """Agrégats calculés par une base SQL embarquée (fichier SQLite ou DuckDB).
+
+    Chaque variable est interrogée une fois pour tous les pays : volumes par
+    pays × valeur (distribution, médiane) et moments par pays (N, somme,
+    somme des carrés). Toute sélection se lit ensuite dans ces
+    tableaux, comme pour RowBackend. Les indices composites sont des
+    expressions SQL sur leurs items. Une connexion en lecture seule par thread.
+    """
+
+    row_level = True
+    weight_col = None
+
+    def __init__(self, path):
+        self.path = path
+        self.engine = sql_engine_for(path)
+        self._local = threading.local()
+        self._columns = [d[0] for d in self._connection().execute(
+            f"SELECT * FROM {SQL_TABLE} LIMIT 0").description]
+        self._expressions = {col: _quote(col) for col in self._columns}
+        self._tables = {}
+
+        country = _quote(COUNTRY_COL)
+        self._sizes = dict(self._query(
+            f"SELECT {country}, COUNT(*) FROM {SQL_TABLE} WHERE {country} IS NOT NULL GROUP BY 1 ORDER BY 1"))
+        self.n_rows = self._query(f"SELECT COUNT(*) FROM {SQL_TABLE}")[0][0]
+        self._years = {}
+        if 'Year survey' in self._columns:
+            # Année la plus fréquente par pays (la plus ancienne en cas d'égalité, comme .mode())
+            for code, year, _ in sorted(self._query(
+                    f"SELECT {country}, {_quote('Year survey')}, COUNT(*) FROM {SQL_TABLE} "
+                    f"WHERE {_quote('Year survey')} IS NOT NULL GROUP BY 1, 2"),
+                    key=lambda r: (r[0], -r[2], r[1])):
+                self._years.setdefault(code, int(year))
+        self.version = _fingerprint('sql', self.engine, os.path.abspath(path), _file_stamp(path), self.n_rows,
+                                    self._columns, sorted(self._sizes.items()))
+
+    def memory_bytes(self):
+        # Données sur disque ; seuls de petits tableaux par variable restent en mémoire
+        return 0
+
+    def _connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = _sql_connect(self.path)
+            self._local.con = con
+        return con
+
+    def _query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def countries(self):
+        return [c for c, n in self._sizes.items() if n > 0]
+
+    def n_respondents(self, codes):
+        return {c: int(self._sizes.get(c, 0)) for c in codes}
+
+    def has_variable(self, col_name):
+        return col_name in self._expressions
+
+    def survey_year(self, code):
+        return self._years.get(code)
+
+    def add_composite(self, col_name, items):
+        """Ajoute un indice composite comme variable (expression SQL sur les items).
+
+        Renvoie False si un item manque dans la base.
+        """
+        if not all(col in self._columns for col, _ in items):
+            return False
+        self._expressions.setdefault(col_name, _composite_sql(items))
+        return True
+
+    def variable_frame(self, col_name, codes):
+        """Lignes ['Pays', code, variable] des pays choisis, sans valeur manquante (filtrées en SQL)."""
+        country = _quote(COUNTRY_COL)
+        rows = self._query(
+            f"SELECT c, v FROM (SELECT {country} AS c, {self._expressions[col_name]} AS v FROM {SQL_TABLE}) t "
+            f"WHERE v IS NOT NULL AND c IN ({', '.join('?' * len(codes))})", tuple(codes)) if codes else []
+        frame = pd.DataFrame(rows, columns=[COUNTRY_COL, col_name])
+        frame.insert(0, 'Pays', frame[COUNTRY_COL].map(lambda x: COUNTRY_NAMES.get(x, x)))
+        return frame
+
+    def iter_rows(self, columns, codes, chunk_rows=MICRODATA_CHUNK_ROWS):
+        """Lignes répondants des pays choisis, lues par blocs avec un curseur (fetchmany)."""
+        if not codes:
+            return
+        selected = ', '.join(f"{self._expressions[col]} AS {_quote(col)}" for col in columns)
+        cursor = self._connection().execute(
+            f"SELECT {selected} FROM {SQL_TABLE} WHERE {_quote(COUNTRY_COL)} IN ({', '.join('?' * len(codes))})",
+            tuple(codes))
+        while rows := cursor.fetchmany(chunk_rows):
+            yield pd.DataFrame(rows, columns=list(columns))
+
+    def _country_tables(self, col_name):
+        """(stats, volumes par valeur, moments) de tous les pays pour une variable, calculés une fois."""
+        tables = self._tables.get(col_name)
+        if tables is None:
+            country, expr = _quote(COUNTRY_COL), self._expressions[col_name]
+            values = f"(SELECT {country} AS c, {expr} AS v FROM {SQL_TABLE} WHERE {country} IS NOT NULL)"
+            counts = pd.DataFrame(self._query(
+                f"SELECT c, v, COUNT(*) FROM {values} t WHERE v IS NOT NULL GROUP BY 1, 2"),
+                columns=[COUNTRY_COL, 'Valeur', 'Volume'])
+            moments = pd.DataFrame(self._query(
+                f"SELECT c, COUNT(v), SUM(v), SUM(v * v) FROM {values} t WHERE v IS NOT NULL GROUP BY 1"),
+                columns=[COUNTRY_COL, 'N', 'Somme', 'Somme2']).set_index(COUNTRY_COL)
+
+            counts['Pays'] = counts[COUNTRY_COL].map(lambda x: COUNTRY_NAMES.get(x, x))
+            pivot = (counts.pivot_table(index='Pays', columns='Valeur', values='Volume',
+                                        aggfunc='sum', fill_value=0)
+                     .sort_index(axis=1))
+            pivot.columns.name = col_name
+
+            by_name = moments.rename(index=lambda x: COUNTRY_NAMES.get(x, x)).sort_index()
+            by_name.index.name = 'Pays'
+            n = by_name['N'].astype(float)
+            # Σ(v - moyenne)² = Σv² - (Σv)²/n ; borné à 0 (arrondis si toutes les réponses sont égales)
+            m2 = (by_name['Somme2'] - by_name['Somme'] ** 2 / n).clip(lower=0)
+            std = np.sqrt((m2 / (n - 1)).where(n > 1))
+            # SQLite n'a pas d'agrégat médiane : elle se lit dans les volumes par valeur
+            medians = stats_from_counts(counts[['Pays', 'Valeur', 'Volume']]).set_index('Pays')['Médiane']
+            stats = pd.DataFrame({
+                'Moyenne': by_name['Somme'] / n,
+                'Écart-type': std,
+                'IC95': (1.96 * std / np.sqrt(n)).where(n > 1, 0.0),
+                'N': n,
+                'Médiane': medians.reindex(by_name.index),
+            })
+            tables = (stats, pivot, moments)
+            self._tables[col_name] = tables
+        return tables
+
+    def warm(self, col_name):
+        """Précalcule les agrégats par pays d'une variable (préchauffage)."""
+        self._country_tables(col_name)
+
+    def stats(self, col_name, codes):
+        stats, _, _ = self._country_tables(col_name)
+        return _select_countries(stats, codes).reset_index()
+
+    def distribution(self, col_name, codes):
+        _, pivot, _ = self._country_tables(col_name)
+        return _select_distribution(pivot, codes)
+
+    def means(self, columns, codes):
+        present = [c for c in sorted(set(codes)) if self._sizes.get(c, 0) > 0]
+        agg = {}
+        for label, col in columns.items():
+            moments = self._country_tables(col)[2].reindex(present)
+            agg[label] = (moments['Somme'] / moments['N']).to_numpy(dtype=float)
+        names = [COUNTRY_NAMES.get(c, c) for c in present]
+        means = pd.DataFrame(agg, index=pd.Index(names, name='Pays'), columns=list(columns))
+        return means.sort_index()
+
+    def pooled_mean(self, col_name, codes):
+        moments = self._country_tables(col_name)[2].reindex(sorted(set(codes))).dropna()
+        n = moments['N'].sum()
+        return moments['Somme'].sum() / n if n else np.nan
+
+    def value_counts(self, col_name, code):
+        _, pivot, _ = self._country_tables(col_name)
+        return _row_value_counts(pivot, code)
+
+
+# ─── EXPORT DES MICRODONNÉES ─────────────────────────────────────────────────
+def microdata_columns(backend, columns):
+    """Colonnes exportées : code pays, année et poids s'ils existent, puis `columns`."""
+    extra = [COUNTRY_COL, 'Year survey', *([backend.weight_col] if backend.weight_col else [])]
+    head = [col for col in extra if backend.has_variable(col)]
+    return head + [col for col in dict.fromkeys(columns) if col not in head and backend.has_variable(col)]
+
+
+def microdata_chunks(backend, columns, codes, compress=False, chunk_rows=MICRODATA_CHUNK_ROWS):
+    """CSV des lignes répondants (pays `codes`, colonnes `columns`) par blocs d'octets.
+
+    Générateur : un bloc de `chunk_rows` lignes à la fois, compressé à la volée
+    en gzip si `compress`. La mémoire utilisée ne dépend pas de la taille de
+    l'export (backends à lignes répondants : RowBackend, partitions, SQL).
+    """
+    gz = zlib.compressobj(wbits=31) if compress else None   # 31 : en-tête gzip
+    header = True
+    for chunk in backend.iter_rows(columns, codes, chunk_rows):
+        data = chunk.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+        data = gz.compress(data) if gz else data
+        if data:
+            yield data
+    if header:
+        data = pd.DataFrame(columns=list(columns)).to_csv(index=False).encode('utf-8')
+        yield gz.compress(data) if gz else data
+    if gz:
+        yield gz.flush()
+
+
+def microdata_bytes(backend, columns, codes, compress=False):
+    """Export complet (bytes) des microdonnées, assemblé bloc par bloc sur disque.
+
+    Pour un téléchargement Streamlit : il garde de toute façon le fichier
+    entier en mémoire pour le servir. Seul ce fichier final (compressé si
+    `compress`) est chargé une fois ; ni la sélection de lignes ni le CSV
+    non compressé ne sont matérialisés.
+    """
+    with tempfile.TemporaryFile() as f:
+        for data in microdata_chunks(backend, columns, codes, compress):
+            f.write(data)
+        f.seek(0)
+        return f.read()
+
+
+# ─── DONNÉES SYNTHÉTIQUES ────────────────────────────────────────────────────
+def synthetic_dataset(n_rows=157_000, countries=None, seed=0, missing_rate=0.05):
+    """Jeu factice au format du dataset mappé (tests de charge, benchmarks).
+
+    Chaque pays reçoit sa propre distribution par variable (tirage de Dirichlet
+    sur l'échelle de THEMES) ; une part `missing_rate` des réponses est vide ou
+    codée -1/-2 comme dans les fichiers EVS. Colonne WEIGHT_COL : poids
+    d'enquête factices.
+    """
+    rng = np.random.default_rng(seed)
+    if countries is None:
+        countries = list(COUNTRY_NAMES)
+    weights = rng.uniform(0.5, 1.5, len(countries))
+    country = rng.choice(np.asarray(countries), n_rows, p=weights / weights.sum())
+    data = {COUNTRY_COL: country}
+
+    country_years = dict(zip(countries, rng.choice([2017, 2018, 2019, 2020, 2021, 2022], len(countries))))
+    data['Year survey'] = np.array([country_years[c] for c in country])
+
+    rows_by_country = {c: np.flatnonzero(country == c) for c in countries}
+    for col, scale in flat_variables().values():
+        lo, hi = scale_bounds(scale)
+        scale_values = np.arange(lo, hi + 1, dtype=float)
+        values = np.empty(n_rows)
+        for rows in rows_by_country.values():
+            p = rng.dirichlet(np.full(len(scale_values), 2.0))
+            values[rows] = rng.choice(scale_values, len(rows), p=p)
+        missing = rng.random(n_rows) < missing_rate
+        values[missing] = rng.choice([np.nan, -1.0, -2.0], missing.sum())
+        data[col] = values
+
+    # Poids d'enquête log-normaux, de moyenne 1 dans chaque pays
+    weights = rng.lognormal(0.0, 0.5, n_rows)
+    for rows in rows_by_country.values():
+        if len(rows):
+            weights[rows] /= weights[rows].mean()
+    data[WEIGHT_COL] = weights
+    return pd.DataFrame(data)
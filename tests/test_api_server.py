@@ -0,0 +1,18 @@
+"""API JSON : réponses calculées par le backend, pondérées ou non."""
+import pytest
+
+from evs_api_server import StatsService
+from evs_stats_core import RowBackend, WEIGHT_COL, sanitize_missing_codes, synthetic_dataset
+
+VAR = 'Most people can be trusted'
+
+
+@pytest.mark.parametrize('weight_col', [None, WEIGHT_COL])
+def test_distribution_keeps_volumes(weight_col):
+    backend = RowBackend(sanitize_missing_codes(synthetic_dataset(2_000, countries=['DE', 'FR'], seed=6)),
+                         weight_col)
+    payload = StatsService(backend).distribution({'var': [VAR], 'countries': ['DE,FR']})
+    pivot, _ = backend.distribution(VAR, ['DE', 'FR'])
+    for row in payload['distribution']:
+        assert row['counts'] == pytest.approx(list(pivot.loc[row['Pays']].values), abs=0)
+        assert all(isinstance(c, float if weight_col else int) for c in row['counts'])
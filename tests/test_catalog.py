@@ -0,0 +1,25 @@
+"""Catalogue des colonnes : colonnes continues écartées de l'analyse par valeur."""
+from evs_stats_core import (
+    CATALOG_MAX_DISTINCT, WEIGHT_COL, ColumnCatalog, RowBackend, sanitize_missing_codes, synthetic_dataset,
+)
+
+
+def _frame():
+    return sanitize_missing_codes(synthetic_dataset(3_000, countries=['DE', 'FR', 'IT'], seed=5))
+
+
+def test_continuous_columns_are_not_selectable():
+    catalog = ColumnCatalog.from_frame(_frame())
+    assert catalog.search('weight', numeric=True) == [WEIGHT_COL]
+    assert catalog.search('weight', numeric=True, max_distinct=CATALOG_MAX_DISTINCT) == []
+    assert not catalog.categorical(WEIGHT_COL)
+    assert catalog.categorical('Most people can be trusted')
+    assert not catalog.categorical('absente')
+
+
+def test_country_tables_are_counted():
+    backend = RowBackend(_frame())
+    before = backend.memory_bytes()
+    backend.warm(WEIGHT_COL)
+    _, pivot = backend._country_tables(WEIGHT_COL)
+    assert backend.memory_bytes() >= before + pivot.memory_usage(deep=False).sum()
@@ -0,0 +1,27 @@
+"""Banc d'équivalence sur jeux réduits : écarts et dépassements de budget font échouer les tests."""
+import pytest
+
+from evs_equivalence import (
+    ENGINES, Case, _parse_budgets, edge_case_dataset, run_case, weighted_edge_case_dataset,
+)
+from evs_stats_core import WEIGHT_COL, synthetic_dataset
+
+ROWS = 5_000
+
+DATASETS = {
+    'cas limites': (lambda: edge_case_dataset(), None),
+    'synthétique': (lambda: synthetic_dataset(ROWS, seed=0), None),
+    'cas limites pondérés': (lambda: weighted_edge_case_dataset(), WEIGHT_COL),
+    'synthétique pondéré': (lambda: synthetic_dataset(ROWS, seed=0), WEIGHT_COL),
+}
+
+
+@pytest.mark.parametrize('name', DATASETS)
+def test_engines_match_reference_within_budget(name):
+    make, weight_col = DATASETS[name]
+    case = Case(name, make(), 0, weight_col)
+    try:
+        # Le tableau détaillé (stdout) est affiché par pytest en cas d'échec
+        assert run_case(case, list(ENGINES), _parse_budgets([]))
+    finally:
+        case.cleanup()
@@ -0,0 +1,67 @@
+"""Export des microdonnées : rappel de téléchargement différé de l'onglet 3."""
+import gzip
+import io
+from pathlib import Path
+
+import pandas as pd
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+from evs_stats_core import (
+    COUNTRY_COL, THEMES, RowBackend, sanitize_missing_codes, synthetic_dataset,
+    microdata_columns, microdata_bytes,
+)
+
+APP = str(Path(__file__).resolve().parent.parent / 'evs_stats_app.py')
+MICRODATA_LABEL = "📥 Télécharger les microdonnées"
+
+
+def _raw():
+    return synthetic_dataset(3_000, countries=['DE', 'FR', 'IT'], seed=1)
+
+
+def _backend():
+    return RowBackend(sanitize_missing_codes(_raw()))
+
+
+def test_microdata_bytes_match_filtered_rows():
+    backend = _backend()
+    columns = tuple(microdata_columns(backend, [col for col, _ in next(iter(THEMES.values())).values()]))
+    expected = backend.df_full[backend.df_full[COUNTRY_COL].isin(['DE', 'FR'])][list(columns)]
+    for compress in (False, True):
+        data = microdata_bytes(backend, columns, ('DE', 'FR'), compress)
+        assert isinstance(data, bytes)
+        if compress:
+            data = gzip.decompress(data)
+        assert data == expected.to_csv(index=False).encode('utf-8')
+
+
+def test_microdata_without_rows_keeps_header():
+    backend = _backend()
+    columns = tuple(microdata_columns(backend, []))
+    data = microdata_bytes(backend, columns, (), True)
+    assert list(pd.read_csv(io.BytesIO(gzip.decompress(data))).columns) == list(columns)
+
+
+def test_download_button_callable_returns_the_export(tmp_path, monkeypatch):
+    data_path = tmp_path / 'data.csv'
+    _raw().to_csv(data_path, index=False)
+    monkeypatch.setenv('EVS_DATA_PATH', str(data_path))
+    monkeypatch.setenv('EVS_WARMUP', '0')
+    monkeypatch.setenv('EVS_PROGRESSIVE', '0')
+    buttons = []
+    monkeypatch.setattr(streamlit, 'download_button',
+                        lambda label, data, *args, **kwargs: buttons.append((label, data)) or False)
+
+    at = AppTest.from_file(APP, default_timeout=300)
+    at.query_params['c'] = 'DE,FR'
+    at.run()
+    assert not at.exception
+    data = next(data for label, data in buttons if label == MICRODATA_LABEL)
+    assert callable(data)
+
+    payload = data()
+    assert isinstance(payload, bytes)
+    backend = _backend()
+    columns = list(pd.read_csv(io.BytesIO(gzip.decompress(payload)), nrows=0).columns)
+    assert payload == microdata_bytes(backend, tuple(columns), ('DE', 'FR'), True)
@@ -0,0 +1,45 @@
+"""Permaliens : aller-retour vue → paramètres d'URL → vue."""
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+from evs_permalink import parse_view, view_params
+from evs_stats_core import (
+    COMPOSITE_PRESETS, COMPOSITE_THEME, composite_column, composite_label, synthetic_dataset,
+)
+
+APP = str(Path(__file__).resolve().parent.parent / 'evs_stats_app.py')
+NAME, ITEMS = next(iter(COMPOSITE_PRESETS.items()))
+
+
+def test_composite_round_trip():
+    params = view_params(['FR', 'DE'], composite_column(NAME, ITEMS), True, False, True)
+    view = parse_view(params)
+    assert view['theme'] == COMPOSITE_THEME
+    assert view['var'] == composite_label(NAME)
+    assert view['composite'] == (NAME, tuple(ITEMS))
+    assert 'column' not in view
+
+
+def test_unknown_composite_is_not_a_catalog_column():
+    params = view_params(['FR'], composite_column("Indice de session", ITEMS), True, False, True)
+    view = parse_view(params)
+    assert 'column' not in view and 'var' not in view
+
+
+def test_app_restores_composite_link(tmp_path, monkeypatch):
+    data_path = tmp_path / 'data.csv'
+    synthetic_dataset(3_000, countries=['DE', 'FR', 'IT'], seed=4).to_csv(data_path, index=False)
+    monkeypatch.setenv('EVS_DATA_PATH', str(data_path))
+    monkeypatch.setenv('EVS_WARMUP', '0')
+    monkeypatch.setenv('EVS_PROGRESSIVE', '0')
+    col = composite_column(NAME, ITEMS)
+
+    at = AppTest.from_file(APP, default_timeout=300)
+    at.query_params['c'] = 'DE,FR'
+    at.query_params['var'] = col
+    at.run()
+    assert not at.exception
+    assert [s.value for s in at.selectbox[:2]] == [COMPOSITE_THEME, composite_label(NAME)]
+    assert [t.value for t in at.text_input if t.key == 'catalog_query'] == ['']
+    assert at.query_params['var'] in (col, [col])
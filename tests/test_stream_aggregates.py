@@ -0,0 +1,52 @@
+"""Agrégats en flux : même artefact que build_aggregates, source lue une fois."""
+import io
+import zipfile
+
+import evs_stats_core
+from evs_stats_core import (
+    build_aggregates, sanitize_missing_codes, stream_aggregates, synthetic_dataset,
+)
+
+
+def _raw():
+    return synthetic_dataset(2_000, countries=['DE', 'FR', 'IT'], seed=2)
+
+
+def test_stream_matches_build(tmp_path):
+    raw = _raw()
+    path = tmp_path / 'data.csv'
+    raw.to_csv(path, index=False)
+    expected = build_aggregates(sanitize_missing_codes(raw.copy()))
+    assert stream_aggregates(str(path), chunk_rows=300) == expected
+
+
+def test_release_is_downloaded_once(monkeypatch):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        z.writestr('data.csv', _raw().to_csv(index=False))
+    downloads = []
+
+    def download(*args, **kwargs):
+        downloads.append(1)
+        return buffer.getvalue()
+
+    monkeypatch.setattr(evs_stats_core, '_download_zip', download)
+    aggregates = stream_aggregates(chunk_rows=500)
+    assert downloads == [1]
+    assert sorted(aggregates['countries']) == ['DE', 'FR', 'IT']
+
+
+def test_header_only_source(tmp_path):
+    path = tmp_path / 'empty.csv'
+    _raw().head(0).to_csv(path, index=False)
+    aggregates = stream_aggregates(str(path))
+    assert aggregates['source_rows'] == 0
+    assert aggregates['countries'] == {}
+    assert all(per_country == {} for per_country in aggregates['counts'].values())
+
+
+def test_fold_without_chunks():
+    fold = evs_stats_core.AggregateFold(['Most people can be trusted'])
+    aggregates = fold.result()
+    assert aggregates['countries'] == {}
+    assert aggregates['counts'] == {'Most people can be trusted': {}}
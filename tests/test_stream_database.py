@@ -0,0 +1,32 @@
+"""Base SQL en flux : source lue une fois, mêmes agrégats que les lignes répondants."""
+import io
+import zipfile
+
+import pandas as pd
+
+import evs_stats_core
+from evs_stats_core import (
+    RowBackend, SqlBackend, sanitize_missing_codes, stream_database, synthetic_dataset,
+)
+
+
+def test_release_is_downloaded_once(tmp_path, monkeypatch):
+    raw = synthetic_dataset(2_000, countries=['DE', 'FR', 'IT'], seed=3)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        z.writestr('data.csv', raw.to_csv(index=False))
+    downloads = []
+
+    def download(*args, **kwargs):
+        downloads.append(1)
+        return buffer.getvalue()
+
+    monkeypatch.setattr(evs_stats_core, '_download_zip', download)
+    db_path = str(tmp_path / 'survey.sqlite')
+    assert stream_database(db_path, chunk_rows=700) == len(raw)
+    assert downloads == [1]
+
+    col = 'Most people can be trusted'
+    expected = RowBackend(sanitize_missing_codes(raw.copy())).stats(col, ['DE', 'FR', 'IT'])
+    pd.testing.assert_frame_equal(SqlBackend(db_path).stats(col, ['DE', 'FR', 'IT']), expected,
+                                  check_dtype=False)
@@ -0,0 +1,56 @@
+"""Préchauffage en arrière-plan : échecs exposés et registre borné."""
+import time
+
+import evs_cache
+from evs_cache import start_warmup, forget_warmup
+
+
+def _wait(warmup, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not warmup.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert warmup.finished
+
+
+def _fail():
+    raise RuntimeError("échec")
+
+
+def test_failed_tasks_are_reported():
+    warmup = start_warmup(('test', 'failures'), [lambda: None, _fail, lambda: None], 1)
+    _wait(warmup)
+    assert warmup.done == 3
+    assert warmup.errors == 1
+    assert [index for index, _ in warmup.failures] == [1]
+    assert isinstance(warmup.failures[0][1], RuntimeError)
+
+
+def test_forget_warmup_restarts_it():
+    key = ('test', 'forget')
+    calls = []
+    _wait(start_warmup(key, [lambda: calls.append(1)], 1))
+    assert start_warmup(key, [lambda: calls.append(2)], 1) is not None and calls == [1]
+    forget_warmup(key)
+    _wait(start_warmup(key, [lambda: calls.append(3)], 1))
+    assert calls == [1, 3]
+
+
+def test_finished_warmups_are_pruned():
+    for i in range(evs_cache.MAX_WARMUPS + 10):
+        _wait(start_warmup(('test', 'prune', i), [], 1))
+    assert len(evs_cache._WARMUPS) <= evs_cache.MAX_WARMUPS + 1
+
+
+def test_task_factory_runs_once():
+    key = ('test', 'factory')
+    built = []
+
+    def tasks():
+        built.append(1)
+        return [lambda: None]
+
+    first = start_warmup(key, tasks, 1)
+    assert start_warmup(key, tasks, 1) is first
+    _wait(first)
+    assert start_warmup(key, tasks, 1) is first
+    assert built == [1] and first.done == 1
@@ -0,0 +1,10 @@
+"""Statistiques pondérées : colonne de poids validée au chargement."""
+import pytest
+
+from evs_stats_core import RowBackend, sanitize_missing_codes, synthetic_dataset
+
+
+def test_missing_weight_column_is_reported():
+    df = sanitize_missing_codes(synthetic_dataset(500, countries=['DE', 'FR'], seed=7))
+    with pytest.raises(ValueError, match="Colonne de poids absente du dataset : Poids"):
+        RowBackend(df, 'Poids')